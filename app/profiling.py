@@ -0,0 +1,209 @@
+import collections
+import contextvars
+import functools
+import hmac
+import inspect
+import os
+import random
+import sys
+import threading
+import time
+
+from fastapi import APIRouter, Header, HTTPException
+from fastapi.responses import PlainTextResponse
+from fastapi.routing import APIRoute
+
+# Profiling is off unless a token is configured; requests and the /debug/profile
+# endpoints must present it.
+PROFILE_TOKEN = os.environ.get("PROFILE_TOKEN")
+# Fraction of requests profiled without being asked to
+PROFILE_SAMPLE_RATE = float(os.environ.get("PROFILE_SAMPLE_RATE", 0))
+# Seconds between two stack samples
+PROFILE_INTERVAL = float(os.environ.get("PROFILE_INTERVAL", 0.005))
+
+
+class Profile:
+    """A request being profiled: its route and the threads running its endpoint."""
+
+    __slots__ = ("route", "threads")
+
+    def __init__(self):
+        self.route = None
+        self.threads = set()
+
+
+current_profile = contextvars.ContextVar("current_profile", default=None)
+
+
+class Sampler:
+    """
+    Statistical profiler. While profiled requests are in flight, a background thread
+    takes the stacks of their threads every `interval` seconds with
+    sys._current_frames() and counts them per route, as collapsed stacks that
+    flamegraph.pl and speedscope read directly.
+    """
+
+    def __init__(self, interval=PROFILE_INTERVAL):
+        self.interval = interval
+        self.active = set()
+        self.stacks = collections.defaultdict(collections.Counter)
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="profiler", daemon=True)
+        self.thread.start()
+
+    def start(self, profile):
+        with self.lock:
+            self.active.add(profile)
+        self.wakeup.set()
+
+    def stop(self, profile):
+        with self.lock:
+            self.active.discard(profile)
+            if not self.active:
+                self.wakeup.clear()
+
+    def run(self):
+        while True:
+            self.wakeup.wait()
+            frames = sys._current_frames()
+            with self.lock:
+                for profile in self.active:
+                    for thread_id in profile.threads:
+                        frame = frames.get(thread_id)
+                        if frame is not None:
+                            self.stacks[profile.route][collapse(profile.route, frame)] += 1
+            del frames
+            time.sleep(self.interval)
+
+    def collapsed(self, route=None):
+        with self.lock:
+            return "".join(
+                f"{stack} {count}\n"
+                for name, stacks in self.stacks.items() if route is None or name == route
+                for stack, count in stacks.most_common())
+
+    def clear(self):
+        with self.lock:
+            self.stacks.clear()
+
+
+def collapse(route, frame):
+    # Root first, stopping at the endpoint wrapper so server frames are left out
+    names = []
+    while frame is not None and frame.f_code not in _wrapper_codes:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({os.path.basename(code.co_filename)})")
+        frame = frame.f_back
+    names.append(route)
+    return ";".join(reversed(names))
+
+
+_wrapper_codes = set()
+sampler = None
+
+
+def profiled(route, call):
+    """Wrap a route's endpoint so the threads running it are sampled while its request is profiled."""
+    if inspect.iscoroutinefunction(call):
+        @functools.wraps(call)
+        async def async_wrapper(*args, **kwargs):
+            profile = current_profile.get()
+            if profile is None:
+                return await call(*args, **kwargs)
+            # Async endpoints share the event loop thread with every other request,
+            # so their samples may include concurrent requests
+            profile.route = route
+            profile.threads.add(threading.get_ident())
+            sampler.start(profile)
+            try:
+                return await call(*args, **kwargs)
+            finally:
+                sampler.stop(profile)
+        _wrapper_codes.add(async_wrapper.__code__)
+        return async_wrapper
+
+    @functools.wraps(call)
+    def wrapper(*args, **kwargs):
+        profile = current_profile.get()
+        if profile is None:
+            return call(*args, **kwargs)
+        profile.route = route
+        profile.threads.add(threading.get_ident())
+        sampler.start(profile)
+        try:
+            return call(*args, **kwargs)
+        finally:
+            sampler.stop(profile)
+    _wrapper_codes.add(wrapper.__code__)
+    return wrapper
+
+
+def authorized(token):
+    # Compared as bytes: compare_digest rejects non-ASCII str. Starlette decodes headers
+    # as latin-1, so encoding them back gives the bytes the client sent.
+    if token is None or not PROFILE_TOKEN:
+        return False
+    if isinstance(token, str):
+        token = token.encode("latin-1", "replace")
+    return hmac.compare_digest(token, PROFILE_TOKEN.encode())
+
+
+class ProfilingMiddleware:
+    """Profiles PROFILE_SAMPLE_RATE of the requests, and any request sent with `X-Profile: <token>`."""
+
+    def __init__(self, app, sample_rate=PROFILE_SAMPLE_RATE):
+        self.app = app
+        self.sample_rate = sample_rate
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        requested = next((value for name, value in scope["headers"] if name == b"x-profile"), None)
+        if not authorized(requested) and random.random() >= self.sample_rate:
+            return await self.app(scope, receive, send)
+        token = current_profile.set(Profile())
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            current_profile.reset(token)
+
+
+router = APIRouter(prefix="/debug/profile", include_in_schema=False)
+
+
+def check_token(token):
+    if not authorized(token):
+        raise HTTPException(status_code=403, detail="Invalid profile token")
+
+
+@router.get("", response_class=PlainTextResponse)
+def get_profile(route: str = None, x_profile_token: str = Header(None)):
+    """
+    The samples gathered so far in collapsed-stack format, one `stack count` line per
+    distinct stack, each rooted at its route (e.g. `POST /sensors/{sensor_id}/data`).
+    Pipe it to flamegraph.pl or load it in speedscope.
+    """
+    check_token(x_profile_token)
+    return sampler.collapsed(route)
+
+
+@router.delete("")
+def clear_profile(x_profile_token: str = Header(None)):
+    check_token(x_profile_token)
+    sampler.clear()
+    return {"cleared": True}
+
+
+def install(app):
+    """Enable profiling on every route registered so far. Does nothing without PROFILE_TOKEN."""
+    global sampler
+    if not PROFILE_TOKEN:
+        return
+    sampler = Sampler()
+    for route in app.routes:
+        if isinstance(route, APIRoute):
+            name = f"{','.join(sorted(route.methods))} {route.path}"
+            route.dependant.call = profiled(name, route.dependant.call)
+    app.include_router(router)
+    app.add_middleware(ProfilingMiddleware)
@@ -0,0 +1,147 @@
+import gzip
+import importlib.util
+import json
+import os
+
+from fastapi import HTTPException, Response
+from fastapi.encoders import jsonable_encoder
+
+try:
+    import orjson
+except ImportError:  # optional, FAST_JSON needs it
+    orjson = None
+
+try:
+    import zstandard
+except ImportError:  # optional, zstd is only offered when installed
+    zstandard = None
+
+# pyarrow is optional too, and only imported by the requests that ask for Arrow or Parquet
+ARROW_AVAILABLE = importlib.util.find_spec("pyarrow") is not None
+
+# Serialize the data-heavy responses (time series, fleet lists, the summary) with
+# orjson, straight from the repository results. Otherwise they go through
+# jsonable_encoder and the json module, like FastAPI does for every route.
+FAST_JSON = os.environ.get("FAST_JSON", "").lower() in ("1", "true", "yes") and orjson is not None
+
+# Bodies smaller than this are not worth compressing
+COMPRESS_MIN_BYTES = int(os.environ.get("COMPRESS_MIN_BYTES", 1024))
+
+MEDIA_TYPE = "application/json"
+ARROW_MEDIA_TYPE = "application/vnd.apache.arrow.stream"
+PARQUET_MEDIA_TYPE = "application/vnd.apache.parquet"
+
+
+def dumps(content) -> bytes:
+    if FAST_JSON:
+        # NON_STR_KEYS: the time series are keyed by their bucket's datetime
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+    # Same output as FastAPI's JSONResponse
+    return json.dumps(jsonable_encoder(content), ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+
+
+def json_response(content, request=None) -> Response:
+    """
+    Return `content` from a route without FastAPI encoding it again, compressed as the
+    client accepts when `request` is given.
+    """
+    if request is None:
+        return Response(dumps(content), media_type=MEDIA_TYPE)
+    return encoded_response(request, dumps(content), MEDIA_TYPE)
+
+
+def accepted_encodings(request):
+    # Content codings of Accept-Encoding, without the ones refused with q=0
+    encodings = set()
+    for item in request.headers.get("accept-encoding", "").split(","):
+        name, _, params = item.partition(";")
+        quality = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if quality > 0:
+            encodings.add(name.strip().lower())
+    return encodings
+
+
+def encoded_response(request, body, media_type, compress=True) -> Response:
+    headers = {"Vary": "Accept, Accept-Encoding"}
+    if compress and len(body) >= COMPRESS_MIN_BYTES:
+        encodings = accepted_encodings(request)
+        if zstandard is not None and "zstd" in encodings:
+            body = zstandard.ZstdCompressor(level=3).compress(body)
+            headers["Content-Encoding"] = "zstd"
+        elif "gzip" in encodings:
+            body = gzip.compress(body, compresslevel=6)
+            headers["Content-Encoding"] = "gzip"
+    return Response(body, media_type=media_type, headers=headers)
+
+
+def table_format(request):
+    """"arrow" or "parquet" when the client asks for it and pyarrow is installed, None for JSON."""
+    accept = request.headers.get("accept", "")
+    if not ARROW_AVAILABLE:
+        return None
+    if ARROW_MEDIA_TYPE in accept:
+        return "arrow"
+    if PARQUET_MEDIA_TYPE in accept:
+        return "parquet"
+    return None
+
+
+def table_response(request, table, fmt) -> Response:
+    import pyarrow as pa
+    sink = pa.BufferOutputStream()
+    if fmt == "parquet":
+        import pyarrow.parquet as pq
+        # Parquet compresses its pages itself
+        pq.write_table(table, sink)
+        return encoded_response(request, sink.getvalue().to_pybytes(), PARQUET_MEDIA_TYPE, compress=False)
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return encoded_response(request, sink.getvalue().to_pybytes(), ARROW_MEDIA_TYPE)
+
+
+def columns_table(columns):
+    """An Arrow table from a columnar result, {"name": [values]}."""
+    import pyarrow as pa
+    return pa.table(columns)
+
+
+def records_table(records):
+    """An Arrow table from a list of flat or nested records, e.g. a fleet list."""
+    import pyarrow as pa
+    return pa.Table.from_pylist(records)
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    # Weak comparison, as If-None-Match calls for: W/ prefixes are ignored
+    if if_none_match.strip() == "*":
+        return True
+    opaque = etag[2:] if etag.startswith("W/") else etag
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if (tag[2:] if tag.startswith("W/") else tag) == opaque:
+            return True
+    return False
+
+
+def check_not_modified(if_none_match, etag) -> None:
+    """Answer 304 Not Modified when If-None-Match names the current `etag`."""
+    if etag is not None and if_none_match and etag_matches(if_none_match, etag):
+        raise HTTPException(status_code=304, headers={"ETag": etag})
+
+
+def with_etag(response: Response, etag) -> Response:
+    if etag is not None:
+        response.headers["ETag"] = etag
+    return response
+
+
+def raw_json(body: bytes) -> Response:
+    """A response for a payload serialized beforehand, e.g. kept in a cache."""
+    return Response(body, media_type=MEDIA_TYPE)
@@ -0,0 +1,111 @@
+from datetime import datetime
+
+from fastapi import APIRouter, Header, HTTPException, Query, Request
+
+from app import responses
+from shared.aio.cassandra_client import AsyncCassandraClient
+from shared.aio.database import AsyncPostgres
+from shared.aio.elasticsearch_client import AsyncElasticsearchClient
+from shared.aio.mongodb_client import AsyncMongoDBClient
+from shared.aio.redis_client import AsyncRedisClient
+from shared.aio.timescale import AsyncTimescale
+from shared.database import SQLALCHEMY_DATABASE_URL
+from shared.fanout import FanoutError
+from shared.sensors import async_repository, schemas, versions
+
+# The hot sensor routes served on the event loop. The clients and their connection
+# pools are created once at startup and shared by every request.
+
+router = APIRouter(
+    prefix="/sensors",
+    responses={404: {"description": "Not found"}},
+    tags=["sensors"],
+)
+
+
+class Clients:
+    db = None
+    timescale = None
+    redis = None
+    mongodb = None
+    es = None
+    cassandra = None
+
+
+clients = Clients()
+
+
+@router.on_event("startup")
+async def open_clients():
+    clients.db = AsyncPostgres(SQLALCHEMY_DATABASE_URL)
+    clients.timescale = AsyncTimescale()
+    await clients.db.connect()
+    await clients.timescale.connect()
+    clients.redis = AsyncRedisClient(host="redis")
+    clients.mongodb = AsyncMongoDBClient(host="mongodb")
+    await clients.mongodb.getCollection("sensors").create_index([("location", "2dsphere")])
+    clients.es = AsyncElasticsearchClient(host="elasticsearch")
+    clients.cassandra = AsyncCassandraClient(hosts=["cassandra"])
+
+
+@router.on_event("shutdown")
+async def close_clients():
+    await clients.db.close()
+    await clients.timescale.close()
+    await clients.redis.close()
+    clients.mongodb.close()
+    await clients.es.close()
+    clients.cassandra.close()
+
+
+@router.get("/near")
+async def get_sensors_near(latitude: float, longitude: float, radius: int):
+    """
+    Get a list of sensors near to a given location within a specified radius.
+
+    Args:
+        latitude (float): The latitude of the location.
+        longitude (float): The longitude of the location.
+        radius (int): The radius in meters.
+
+    Returns:
+        List[Dict[str, Any]]: A list of sensors near the specified location.
+    """
+    return await async_repository.get_sensors_near(mongodb_client=clients.mongodb, db=clients.db, redis=clients.redis, latitude=latitude, longitude=longitude, radius=radius)
+
+
+@router.get("/search")
+async def search_sensors(query: str, size: int = 10, search_type: str = "match"):
+    sensors_list = await async_repository.search_sensors(db=clients.db, mongodb_client=clients.mongodb, es=clients.es, query=query, size=size, search_type=search_type)
+    if not sensors_list:
+        raise HTTPException(status_code=404, detail="There are no sensors that match the specified query")
+    return sensors_list
+
+
+@router.post("/{sensor_id}/data")
+async def record_data(sensor_id: int, data: schemas.SensorData):
+    db_sensor = await async_repository.get_sensor(clients.db, sensor_id)
+    if db_sensor is None:
+        raise HTTPException(status_code=404, detail="Sensor not found")
+    try:
+        return await async_repository.record_data(cassandra=clients.cassandra, redis=clients.redis, timescale=clients.timescale, sensor_id=sensor_id, data=data)
+    except FanoutError as e:
+        raise HTTPException(status_code=503, detail=e.detail())
+
+
+@router.get("/{sensor_id}/data")
+async def get_data(request: Request, sensor_id: int, bucket: str = None, from_date: datetime = Query(None, alias="from"), to_date: datetime = Query(None, alias="to"), layout: str = Query("rows", regex="^(rows|columnar)$"), if_none_match: str = Header(None)):
+    if from_date is not None and to_date is not None and bucket is not None:
+        fmt = responses.table_format(request)
+        etag = None
+        if versions.CONDITIONAL_GET:
+            # Before any other store: a current If-None-Match costs one Redis lookup
+            etag = await versions.read_aggregate_async(clients.redis, sensor_id, to_date, bucket, (from_date, to_date, bucket, layout, fmt))
+            responses.check_not_modified(if_none_match, etag)
+        if await async_repository.get_sensor(clients.db, sensor_id) is None:
+            raise HTTPException(status_code=404, detail="Sensor not found")
+        data = await async_repository.get_data_timescale(timescale=clients.timescale, sensor_id=sensor_id, from_date=from_date, to_date=to_date, bucket=bucket, layout="columnar" if fmt else layout)
+        if fmt is not None:
+            return responses.with_etag(responses.table_response(request, responses.columns_table(data), fmt), etag)
+        return responses.with_etag(responses.json_response(data, request), etag)
+    return await async_repository.get_data(redis=clients.redis, sensor_id=sensor_id, db=clients.db)
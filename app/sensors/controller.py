@@ -1,16 +1,23 @@
 import json
+import os
+from typing import List, Optional
 
-from fastapi import APIRouter, Depends, HTTPException, Request, Query
+from fastapi import APIRouter, Depends, Header, HTTPException, Request, Response, Query
 from sqlalchemy.orm import Session
 
+from app import responses
+from app.responses import dumps, json_response, raw_json
+from shared.cache import TTLCache
 from shared.database import SessionLocal
-from shared.publisher import Publisher
+from shared.messages import Reading, SensorEvent
 from shared.redis_client import RedisClient
 from shared.mongodb_client import MongoDBClient
 from shared.elasticsearch_client import ElasticsearchClient
+from shared.fanout import FanoutError
 from shared.sensors.repository import DataCommand
 from shared.timescale import Timescale
-from shared.sensors import repository, schemas
+from shared.transport import PublishError, get_publisher
+from shared.sensors import read_model, repository, schemas, versions
 from datetime import datetime
 from shared.cassandra_client import CassandraClient
 
@@ -64,7 +71,14 @@ def get_cassandra_client():
         cassandra.close()
 
 
-publisher = Publisher()
+publisher = get_publisher()
+
+# Largest batch POST /sensors/bulk accepts
+BULK_MAX_SENSORS = int(os.environ.get("BULK_MAX_SENSORS", 10000))
+# Seconds the fleet summary is served from memory before it is recomputed
+SUMMARY_TTL = float(os.environ.get("SUMMARY_TTL", 5))
+
+summary_cache = TTLCache(SUMMARY_TTL)
 
 router = APIRouter(
     prefix="/sensors",
@@ -106,8 +120,8 @@ def search_sensors(query: str, size: int = 10, search_type: str = "match", db: S
     return sensors_list
 
 @router.get("/temperature/values")
-def get_temperature_values(db: Session = Depends(get_db), mongodb_client: MongoDBClient = Depends(get_mongodb_client), cassandra_client: CassandraClient = Depends(get_cassandra_client)):
-    return repository.get_temperature_values(db=db, mongodb_client=mongodb_client, cassandra=cassandra_client)
+def get_temperature_values(request: Request, db: Session = Depends(get_db), mongodb_client: MongoDBClient = Depends(get_mongodb_client), cassandra_client: CassandraClient = Depends(get_cassandra_client), redis_client: RedisClient = Depends(get_redis_client)):
+    return fleet_response(request, repository.get_temperature_values(db=db, mongodb_client=mongodb_client, cassandra=cassandra_client, redis=redis_client))
 
 
 @router.get("/quantity_by_type")
@@ -116,8 +130,40 @@ def get_sensors_quantity(db: Session = Depends(get_db), cassandra_client: Cassan
 
 
 @router.get("/low_battery")
-def get_low_battery_sensors(db: Session = Depends(get_db), mongodb_client: MongoDBClient = Depends(get_mongodb_client), cassandra_client: CassandraClient = Depends(get_cassandra_client)):
-    return repository.get_low_battery_sensors(db=db, mongodb_client=mongodb_client, cassandra=cassandra_client)
+def get_low_battery_sensors(request: Request, db: Session = Depends(get_db), mongodb_client: MongoDBClient = Depends(get_mongodb_client), cassandra_client: CassandraClient = Depends(get_cassandra_client), redis_client: RedisClient = Depends(get_redis_client)):
+    return fleet_response(request, repository.get_low_battery_sensors(db=db, mongodb_client=mongodb_client, cassandra=cassandra_client, redis=redis_client))
+
+
+def fleet_response(request, result):
+    # Fleet lists as JSON, or their `sensors` as an Arrow or Parquet table when asked with Accept
+    fmt = responses.table_format(request)
+    if fmt is not None:
+        return responses.table_response(request, responses.records_table(result["sensors"]), fmt)
+    return json_response(result, request)
+
+
+@router.get("/summary")
+def get_fleet_summary():
+    """
+    Get the counts by type, the number of low battery sensors and the fleet-wide
+    temperature statistics in one call, cached for SUMMARY_TTL seconds.
+
+    Returns:
+        Dict[str, Any]: `quantity`, `quantity_by_type`, `low_battery` and `temperature`.
+    """
+    # Cassandra is only connected to when the cached summary has expired. The cache
+    # keeps the serialized body, so a hit costs no encoding either.
+    def compute():
+        cassandra = CassandraClient(hosts=["cassandra"])
+        try:
+            return dumps(repository.get_fleet_summary(cassandra))
+        finally:
+            cassandra.close()
+
+    try:
+        return raw_json(summary_cache.get("summary", compute))
+    except FanoutError as e:
+        raise HTTPException(status_code=503, detail=e.detail())
 
 
 # 🙋🏽‍♀️ Add here the route to get all sensors
@@ -128,19 +174,77 @@ def get_sensors(db: Session = Depends(get_db)):
 
 # 🙋🏽‍♀️ Add here the route to create a sensor
 @router.post("")
-def create_sensor(sensor: schemas.SensorCreate, db: Session = Depends(get_db), mongodb_client: MongoDBClient = Depends(get_mongodb_client), es: ElasticsearchClient = Depends(get_elastic_search), cassandra: CassandraClient = Depends(get_cassandra_client)):
+def create_sensor(sensor: schemas.SensorCreate, db: Session = Depends(get_db), mongodb_client: MongoDBClient = Depends(get_mongodb_client), es: ElasticsearchClient = Depends(get_elastic_search), cassandra: CassandraClient = Depends(get_cassandra_client), redis_client: RedisClient = Depends(get_redis_client)):
     db_sensor = repository.get_sensor_by_name(db, sensor.name)
     if db_sensor:
         raise HTTPException(status_code=400, detail="Sensor with same name already registered")
-    return repository.create_sensor(db=db, sensor=sensor, mongodb_client=mongodb_client, es=es, cassandra=cassandra)
+    try:
+        created = repository.create_sensor(db=db, sensor=sensor, mongodb_client=mongodb_client, es=es, cassandra=cassandra, redis=redis_client)
+    except FanoutError as e:
+        raise HTTPException(status_code=503, detail=e.detail())
+    publish_created([created])
+    return created
+
+# Bulk registration, answered per sensor: a name taken already does not fail the others
+@router.post("/bulk")
+def create_sensors(sensors: List[schemas.SensorCreate], db: Session = Depends(get_db), mongodb_client: MongoDBClient = Depends(get_mongodb_client), es: ElasticsearchClient = Depends(get_elastic_search), cassandra: CassandraClient = Depends(get_cassandra_client), redis_client: RedisClient = Depends(get_redis_client)):
+    if len(sensors) > BULK_MAX_SENSORS:
+        raise HTTPException(status_code=413, detail=f"At most {BULK_MAX_SENSORS} sensors per request")
+    try:
+        result = repository.create_sensors(db=db, sensors=sensors, mongodb_client=mongodb_client, es=es, cassandra=cassandra, redis=redis_client)
+    except FanoutError as e:
+        raise HTTPException(status_code=503, detail=e.detail())
+    publish_created(result["created"])
+    return result
+
+
+def publish_created(sensors):
+    # The consumer adds the sensors to the read model; the response carries the whole profile
+    if read_model.READ_MODEL:
+        for sensor in sensors:
+            publish_event(SensorEvent(SensorEvent.CREATED, sensor["id"], sensor))
+
+
+def publish_event(event):
+    # The sensor is already written: without its event the read model falls back to the stores
+    try:
+        publisher.publish(event)
+    except PublishError as e:
+        print(f"Could not publish {event}: {e}")
+
+# Conditional GETs: these dependencies come before the store ones in the routes'
+# signatures, so a request whose If-None-Match is current gets its 304 from one Redis
+# lookup, without any store being connected to.
+
+def profile_version(sensor_id: int, if_none_match: str = Header(None), redis_client: RedisClient = Depends(get_redis_client)) -> Optional[str]:
+    if not versions.CONDITIONAL_GET:
+        return None
+    etag = versions.read_profile(redis_client, sensor_id)
+    responses.check_not_modified(if_none_match, etag)
+    return etag
+
+
+def aggregate_version(request: Request, sensor_id: int, bucket: str = None, from_date: datetime = Query(None, alias="from"), to_date: datetime = Query(None, alias="to"), layout: str = Query("rows", regex="^(rows|columnar)$"), if_none_match: str = Header(None), redis_client: RedisClient = Depends(get_redis_client)) -> Optional[str]:
+    # Only aggregates over closed ranges have one; the latest reading changes all the time
+    if not versions.CONDITIONAL_GET or from_date is None or to_date is None or bucket is None:
+        return None
+    variant = (from_date, to_date, bucket, layout, responses.table_format(request))
+    etag = versions.read_aggregate(redis_client, sensor_id, to_date, bucket, variant)
+    responses.check_not_modified(if_none_match, etag)
+    return etag
+
 
 # 🙋🏽‍♀️ Add here the route to get a sensor by id
 @router.get("/{sensor_id}")
-def get_sensor(sensor_id: int, db: Session = Depends(get_db), mongodb_client: MongoDBClient = Depends(get_mongodb_client)):
-    db_sensor = repository.get_sensor_specific(db, sensor_id,mongodb_client)
+def get_sensor(sensor_id: int, response: Response, etag: Optional[str] = Depends(profile_version), db: Session = Depends(get_db), mongodb_client: MongoDBClient = Depends(get_mongodb_client), redis_client: RedisClient = Depends(get_redis_client)):
+    db_sensor = repository.get_sensor_profile(db, sensor_id, mongodb_client, redis_client)
     if db_sensor is None:
         raise HTTPException(status_code=404, detail="Sensor not found")
-    
+    if etag is not None:
+        response.headers["ETag"] = etag
+    elif versions.CONDITIONAL_GET:
+        # Created before versioning: the next request gets an ETag
+        versions.track(redis_client, sensor_id)
     return db_sensor
 
 # 🙋🏽‍♀️ Add here the route to update a sensor
@@ -149,20 +253,62 @@ def record_data(sensor_id: int, data: schemas.SensorData, db: Session = Depends(
     db_sensor = repository.get_sensor(db, sensor_id)
     if db_sensor is None:
         raise HTTPException(status_code=404, detail="Sensor not found")
-    return repository.record_data(cassandra=cassandra, redis=redis_client, timescale=timescale, sensor_id=sensor_id, data=data)
+    try:
+        return repository.record_data(cassandra=cassandra, redis=redis_client, timescale=timescale, sensor_id=sensor_id, data=data)
+    except FanoutError as e:
+        raise HTTPException(status_code=503, detail=e.detail())
 
 # 🙋🏽‍♀️ Add here the route to get data from a sensor
 @router.get("/{sensor_id}/data")
-def get_data(sensor_id: int, bucket: str=None, from_date: datetime = Query(None, alias="from"), to_date: datetime = Query(None, alias="to"), db: Session = Depends(get_db), mongodb_client: MongoDBClient = Depends(get_mongodb_client), timescale: Timescale = Depends(get_timescale), redis_client: RedisClient = Depends(get_redis_client)):
-    db_sensor = repository.get_sensor(db, sensor_id)
-    if db_sensor is None:
-        raise HTTPException(status_code=404, detail="Sensor not found")
+def get_data(request: Request, sensor_id: int, bucket: str=None, from_date: datetime = Query(None, alias="from"), to_date: datetime = Query(None, alias="to"), layout: str = Query("rows", regex="^(rows|columnar)$"), etag: Optional[str] = Depends(aggregate_version), db: Session = Depends(get_db), mongodb_client: MongoDBClient = Depends(get_mongodb_client), timescale: Timescale = Depends(get_timescale), redis_client: RedisClient = Depends(get_redis_client)):
     if from_date is not None and to_date and not None and bucket is not None:
-          return repository.get_data_timescale(timescale=timescale, sensor_id=sensor_id,from_date=from_date, to_date=to_date, bucket=bucket)
+          db_sensor = repository.get_sensor(db, sensor_id)
+          if db_sensor is None:
+              raise HTTPException(status_code=404, detail="Sensor not found")
+          # layout=columnar: {"t": [...], "avg_temperature": [...], ...} instead of an object per bucket.
+          # Arrow and Parquet, negotiated with Accept, are built from the same columns.
+          fmt = responses.table_format(request)
+          data = repository.get_data_timescale(timescale=timescale, sensor_id=sensor_id,from_date=from_date, to_date=to_date, bucket=bucket, layout="columnar" if fmt else layout)
+          if fmt is not None:
+              return responses.with_etag(responses.table_response(request, responses.columns_table(data), fmt), etag)
+          return responses.with_etag(json_response(data, request), etag)
     else:
+        # Raises 404 itself when the sensor does not exist
         return repository.get_data(redis=redis_client, sensor_id=sensor_id, db=db)
 
 
+@router.get("/{sensor_id}/view")
+def get_sensor_view(sensor_id: int, db: Session = Depends(get_db), mongodb_client: MongoDBClient = Depends(get_mongodb_client), redis_client: RedisClient = Depends(get_redis_client), cassandra: CassandraClient = Depends(get_cassandra_client)):
+    """
+    Get a sensor with its latest reading and temperature statistics, from its read
+    model when READ_MODEL is enabled.
+
+    Returns:
+        Dict[str, Any]: The profile of the sensor plus `data` and `temperature_statistics`.
+    """
+    view = repository.get_sensor_view(db, sensor_id, mongodb_client, redis_client, cassandra)
+    if view is None:
+        raise HTTPException(status_code=404, detail="Sensor not found")
+    return view
+
+
+@router.get("/{sensor_id}/data/recent")
+def get_recent_data(sensor_id: int, count: int = Query(None, gt=0), seconds: int = Query(None, gt=0), db: Session = Depends(get_db), redis_client: RedisClient = Depends(get_redis_client)):
+    """
+    Get the latest readings of a sensor straight from its Redis ring buffer.
+
+    Args:
+        count (int, optional): Return at most the last `count` readings.
+        seconds (int, optional): Return only readings from the last `seconds` seconds.
+
+    Returns:
+        List[Dict[str, Any]]: The readings, oldest first.
+    """
+    db_sensor = repository.get_sensor(db, sensor_id)
+    if db_sensor is None:
+        raise HTTPException(status_code=404, detail="Sensor not found")
+    return repository.get_recent_data(redis=redis_client, sensor_id=sensor_id, count=count, seconds=seconds)
+
 
 # 🙋🏽‍♀️ Add here the route to delete a sensor
 @router.delete("/{sensor_id}")
@@ -170,7 +316,10 @@ def delete_sensor(sensor_id: int, db: Session = Depends(get_db), mongodb_client:
     db_sensor = repository.get_sensor(db, sensor_id)
     if db_sensor is None:
         raise HTTPException(status_code=404, detail="Sensor not found")
-    return repository.delete_sensor(db=db, sensor_id=sensor_id, redis=redis_client, mongodb_client=mongodb_client)
+    deleted = repository.delete_sensor(db=db, sensor_id=sensor_id, redis=redis_client, mongodb_client=mongodb_client)
+    if read_model.READ_MODEL:
+        publish_event(SensorEvent(SensorEvent.DELETED, sensor_id))
+    return deleted
 
 
 class ExamplePayload():
@@ -178,9 +327,27 @@ class ExamplePayload():
         self.example = example
 
     def to_json(self):
-        return json.dumps(self, default=lambda o: o.__dict__, sort_keys=True, indent=4)
+        return json.dumps(self, default=lambda o: o.__dict__, sort_keys=True, separators=(",", ":"))
+
+
+@router.post("/{sensor_id}/data/queue", status_code=202)
+def queue_data(sensor_id: int, data: schemas.SensorData, db: Session = Depends(get_db)):
+    # The consumer writes the reading to Redis, Timescale and Cassandra
+    db_sensor = repository.get_sensor(db, sensor_id)
+    if db_sensor is None:
+        raise HTTPException(status_code=404, detail="Sensor not found")
+    try:
+        publisher.publish(Reading(sensor_id, data.dict()))
+    except PublishError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    return {"message": "Data published to the queue"}
+
+
 @router.post("/exemple/queue")
 def exemple_queue():
     # Publish here the data to the queue
-    publisher.publish(ExamplePayload("holaaaaa"))
+    try:
+        publisher.publish(ExamplePayload("holaaaaa"))
+    except PublishError as e:
+        raise HTTPException(status_code=503, detail=str(e))
     return {"message": "Data published to the queue"}
\ No newline at end of file
@@ -0,0 +1,153 @@
+import asyncio
+import os
+from collections import defaultdict
+from typing import List
+
+import redis.asyncio as aioredis
+from fastapi import APIRouter, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
+
+from shared.sensors.live import LOW_BATTERY_CHANNEL, sensor_channel, type_channel
+
+# Server-Sent Events stream of the live updates the write path publishes on Redis.
+# Each API process holds a single pattern subscription and hands every message to the
+# clients listening on its channel, through a bounded queue per client: a client that
+# does not keep up loses its oldest updates instead of holding back the others.
+
+# Updates queued per client before the oldest are dropped
+LIVE_CLIENT_BUFFER = int(os.environ.get("LIVE_CLIENT_BUFFER", 100))
+# Seconds between keep-alive comments on an idle stream
+LIVE_KEEPALIVE = float(os.environ.get("LIVE_KEEPALIVE", 15))
+
+router = APIRouter(
+    prefix="/sensors",
+    tags=["sensors"],
+)
+
+
+class Listener:
+    """A connected client: the channels it follows and its queue of pending updates."""
+
+    __slots__ = ("channels", "queue", "dropped", "last")
+
+    def __init__(self, channels, size=LIVE_CLIENT_BUFFER):
+        self.channels = channels
+        self.queue = asyncio.Queue(maxsize=size)
+        self.dropped = 0
+        self.last = None
+
+    def offer(self, payload):
+        # An update is published on the sensor's and the type's channels back to back;
+        # a client following both gets it once
+        if payload == self.last:
+            return
+        self.last = payload
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(payload)
+
+
+class Hub:
+    """Dispatches the messages of the `live:*` channels to the listeners of each channel."""
+
+    def __init__(self):
+        self.listeners = defaultdict(set)
+        self.task = None
+        self.client = None
+
+    def start(self):
+        if self.task is None:
+            self.client = aioredis.Redis(host=os.environ.get("REDIS_HOST", "redis"))
+            self.task = asyncio.get_running_loop().create_task(self.run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+            await self.client.close()
+
+    async def run(self):
+        while True:
+            pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+            try:
+                await pubsub.psubscribe("live:*")
+                while True:
+                    message = await pubsub.get_message(timeout=1.0)
+                    if message is None:
+                        continue
+                    channel = message["channel"].decode()
+                    payload = message["data"].decode()
+                    for listener in self.listeners.get(channel, ()):
+                        listener.offer(payload)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Updates published while reconnecting are lost, clients keep their streams
+                print(f"Live updates subscription failed ({e}), reconnecting")
+                await asyncio.sleep(1)
+            finally:
+                await pubsub.close()
+
+    def add(self, channels):
+        self.start()
+        listener = Listener(channels)
+        for channel in channels:
+            self.listeners[channel].add(listener)
+        return listener
+
+    def remove(self, listener):
+        for channel in listener.channels:
+            self.listeners[channel].discard(listener)
+            if not self.listeners[channel]:
+                del self.listeners[channel]
+
+
+hub = Hub()
+
+
+@router.on_event("shutdown")
+async def stop_hub():
+    await hub.stop()
+
+
+async def events(request, channels):
+    # Registered once the response starts, so the finally below always unregisters it
+    listener = hub.add(channels)
+    try:
+        while not await request.is_disconnected():
+            try:
+                payload = await asyncio.wait_for(listener.queue.get(), LIVE_KEEPALIVE)
+            except asyncio.TimeoutError:
+                yield ": keep-alive\n\n"
+                continue
+            if listener.dropped:
+                yield f"event: dropped\ndata: {listener.dropped}\n\n"
+                listener.dropped = 0
+            yield f"data: {payload}\n\n"
+    finally:
+        hub.remove(listener)
+
+
+@router.get("/live")
+async def live_updates(request: Request, sensor_id: List[int] = Query(None), types: List[str] = Query(None, alias="type"), low_battery: bool = False):
+    """
+    Stream new readings and low battery transitions as Server-Sent Events.
+
+    Args:
+        sensor_id (List[int], optional): Follow these sensors; may be repeated.
+        type (List[str], optional): Follow every sensor of these types; may be repeated.
+        low_battery (bool, optional): Follow the low battery transitions of every sensor.
+
+    Returns:
+        StreamingResponse: `text/event-stream` with one JSON `data:` line per update,
+        `"event": "reading"` or `"event": "low_battery"`. A `dropped` event gives the
+        number of updates skipped because the client fell behind.
+    """
+    channels = [sensor_channel(id) for id in sensor_id or []] + [type_channel(name) for name in types or []]
+    if low_battery:
+        channels.append(LOW_BATTERY_CHANNEL)
+    if not channels:
+        raise HTTPException(status_code=400, detail="Give at least one sensor_id, type or low_battery=true")
+    return StreamingResponse(events(request, channels), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
@@ -346,3 +346,17 @@ def test_get_sensors_low_battery():
     actual = response.json()
     print("Actual response:", actual)
     print("Expected response:", expected)
+
+
+def test_get_fleet_summary():
+    response = client.get("/sensors/summary")
+    assert response.status_code == 200
+    json = response.json()
+    assert json["quantity"] == 4
+    assert sorted(json["quantity_by_type"], key=lambda item: item["type"]) == [
+        {"type": "Temperatura", "quantity": 2},
+        {"type": "Velocitat", "quantity": 2},
+    ]
+    assert json["low_battery"] == 2
+    assert json["temperature"]["max_temperature"] == 17.0
+    assert json["temperature"]["min_temperature"] == 1.0
@@ -0,0 +1,10 @@
+import pytest
+
+from shared import schema
+
+
+@pytest.fixture(scope="module", autouse=True)
+def forget_schemas():
+    # The clear_dbs fixture of each module drops stores after clients checked them, so
+    # the next clients check again and recreate them
+    schema.forget()
@@ -142,6 +142,35 @@ def test_get_sensor_2_data_updated():
     assert json["battery_level"] == 1.9
     assert json["last_seen"] == "2020-01-01T00:00:01.000Z"
 
+def test_get_sensor_1_view():
+    response = client.get("/sensors/1/view")
+    assert response.status_code == 200
+    json = response.json()
+    assert json["name"] == "Sensor Temperatura 1"
+    assert json["type"] == "Temperatura"
+    assert json["data"]["temperature"] == 2.0
+    assert json["data"]["battery_level"] == 1.9
+    assert json["temperature_statistics"]["max_temperature"] == 2.0
+    assert json["temperature_statistics"]["min_temperature"] == 1.0
+
+
+def test_documentals_create_sensors_bulk():
+    sensor = {"latitude": 1.0, "longitude": 1.0, "type": "Temperatura", "mac_address": "00:00:00:00:00:02",
+              "manufacturer": "Dummy", "model": "Dummy Temp", "serie_number": "0000 0000 0000 0000",
+              "firmware_version": "1.0", "description": "Sensor de temperatura model Dummy Temp del fabricant Dummy"}
+    response = client.post("/sensors/bulk", json=[{**sensor, "name": "Sensor Temperatura 2"},
+                                                 {**sensor, "name": "Sensor Temperatura 1"},
+                                                 {**sensor, "name": "Sensor Temperatura 3"},
+                                                 {**sensor, "name": "Sensor Temperatura 2"}])
+    assert response.status_code == 200
+    json = response.json()
+    assert [created["name"] for created in json["created"]] == ["Sensor Temperatura 2", "Sensor Temperatura 3"]
+    assert [conflict["index"] for conflict in json["conflicts"]] == [1, 3]
+    response = client.get(f"/sensors/{json['created'][1]['id']}")
+    assert response.status_code == 200
+    assert response.json()["name"] == "Sensor Temperatura 3"
+
+
 # Works individally but for some reason after combining all tests it does not. Commeting for now.
 """"
 def test_get_near():
@@ -62,6 +62,13 @@ def test_get_sensor_1():
     assert response.status_code == 200
     assert response.json() == {"id": 1, "name": "Sensor Temperatura 1", "latitude": 1.0, "longitude": 1.0, "type": "Temperatura", "mac_address": "00:00:00:00:00:00", "manufacturer": "Dummy", "model":"Dummy Temp", "serie_number": "0000 0000 0000 0000", "firmware_version": "1.0", "description": "Sensor de temperatura model Dummy Temp del fabricant Dummy"}
 
+def test_get_sensor_1_not_modified():
+    """A sensor not changed since the client fetched it is answered with 304"""
+    etag = client.get("/sensors/1").headers["etag"]
+    response = client.get("/sensors/1", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.content == b""
+
 def test_get_sensor_2():
     """A sensor can be properly retrieved"""
     response = client.get("/sensors/2")
@@ -83,4 +83,39 @@ def test_clau_post_sensor_data_not_exists():
 def test_clau_get_sensor_data_not_exists():
     response = client.get("/sensors/2/data")
     assert response.status_code == 404
-    assert "Sensor not found" in response.text
\ No newline at end of file
+    assert "Sensor not found" in response.text
+
+def test_clau_get_sensor_data_legacy_json():
+    redis_client = RedisClient(host="redis")
+    redis_client.set("sensor:1:data", '{"temperature": 2.0, "humidity": 2.0, "battery_level": 0.5, "velocity": null, "last_seen": "2020-01-02T00:00:00.000Z"}')
+    redis_client.close()
+    response = client.get("/sensors/1/data")
+    assert response.status_code == 200
+    json = response.json()
+    assert json["temperature"] == 2.0
+    assert json["battery_level"] == 0.5
+    assert json["last_seen"] == "2020-01-02T00:00:00.000Z"
+
+def test_clau_get_sensor_recent_data():
+    response = client.post("/sensors/1/data", json={"temperature": 3.0, "humidity": 1.0, "battery_level": 1.0,
+        "last_seen": "2020-01-01T00:01:00.000Z"})
+    assert response.status_code == 200
+    response = client.get("/sensors/1/data/recent?count=2")
+    assert response.status_code == 200
+    json = response.json()
+    assert [reading["temperature"] for reading in json] == [1.0, 3.0]
+    assert json[-1]["last_seen"] == "2020-01-01T00:01:00.000Z"
+
+def test_clau_get_sensor_recent_data_not_exists():
+    response = client.get("/sensors/2/data/recent")
+    assert response.status_code == 404
+
+def test_clau_metrics():
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert 'store_operation_seconds_count{operation="get_record",store="redis"}' in response.text
+    assert 'store="postgres"' in response.text
+
+def test_clau_live_needs_a_topic():
+    response = client.get("/sensors/live")
+    assert response.status_code == 400
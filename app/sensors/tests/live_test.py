@@ -0,0 +1,90 @@
+import json
+import logging
+
+from fastapi import FastAPI
+from fastapi.responses import StreamingResponse
+from fastapi.testclient import TestClient
+
+from app.sensors.live import Listener
+from app.timing import ServerTimingMiddleware
+from shared.sensors import live
+
+
+def messages(sensor_id, battery_level, previous, sensor_type="Temperatura"):
+    record = {"battery_level": battery_level}
+    previous = None if previous is None else {"battery_level": previous}
+    return live.transition_messages(sensor_id, record, previous, sensor_type)
+
+
+def test_is_low():
+    assert live.is_low({"battery_level": 0.1}) is True
+    assert live.is_low({"battery_level": live.LOW_BATTERY_LEVEL}) is True
+    assert live.is_low({"battery_level": 0.9}) is False
+    assert live.is_low({"battery_level": None}) is None
+    assert live.is_low(None) is None
+
+
+def test_transition_to_low_battery():
+    """Crossing the level is published on the sensor's, the type's and the low battery channels"""
+    published = messages(1, 0.1, 0.5)
+    assert [channel for channel, _ in published] == ["live:sensor:1", "live:type:Temperatura", live.LOW_BATTERY_CHANNEL]
+    assert json.loads(published[0][1]) == {"event": "low_battery", "sensor_id": 1, "battery_level": 0.1, "low": True}
+
+
+def test_transition_back_from_low_battery():
+    published = messages(1, 0.5, 0.1, sensor_type=None)
+    assert [channel for channel, _ in published] == ["live:sensor:1", live.LOW_BATTERY_CHANNEL]
+    assert json.loads(published[0][1])["low"] is False
+
+
+def test_no_transition():
+    """Readings on the same side of the level, or without a battery level, publish nothing"""
+    assert messages(1, 0.1, 0.15) == []
+    assert messages(1, 0.5, 0.9) == []
+    assert messages(1, None, 0.1) == []
+
+
+def test_first_reading():
+    """The first reading of a sensor counts as a transition only when it is low"""
+    assert len(messages(1, 0.1, None)) == 3
+    assert messages(1, 0.5, None) == []
+    assert len(live.transition_messages(1, {"battery_level": 0.1}, {"battery_level": None}, None)) == 2
+
+
+def test_listener_drops_oldest():
+    """A client that does not keep up loses its oldest updates, and they are counted"""
+    listener = Listener(["live:sensor:1"], size=2)
+    for payload in ["a", "b", "c", "d"]:
+        listener.offer(payload)
+    assert listener.dropped == 2
+    assert [listener.queue.get_nowait(), listener.queue.get_nowait()] == ["c", "d"]
+    assert listener.queue.empty()
+
+
+def test_listener_deduplicates():
+    """An update published on the sensor's and the type's channels reaches the client once"""
+    listener = Listener(["live:sensor:1", "live:type:Temperatura"], size=10)
+    for payload in ["a", "a", "b", "b", "a"]:
+        listener.offer(payload)
+    assert listener.dropped == 0
+    assert [listener.queue.get_nowait() for _ in range(listener.queue.qsize())] == ["a", "b", "a"]
+
+
+def test_event_streams_are_not_slow_requests(caplog):
+    app = FastAPI()
+
+    @app.get("/stream")
+    def stream():
+        return StreamingResponse(iter(["data: 1\n\n"]), media_type="text/event-stream")
+
+    @app.get("/plain")
+    def plain():
+        return {}
+
+    app.add_middleware(ServerTimingMiddleware, header=False, slow_ms=1e-6)
+    client = TestClient(app)
+    with caplog.at_level(logging.WARNING, logger="slow_requests"):
+        client.get("/stream")
+        assert caplog.records == []
+        client.get("/plain")
+    assert [json.loads(record.message)["path"] for record in caplog.records] == ["/plain"]
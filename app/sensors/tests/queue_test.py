@@ -0,0 +1,65 @@
+import fakeredis
+import pytest
+from fastapi.testclient import TestClient
+
+from app.main import app
+from app.sensors import controller
+from benchmarks import fakes
+from shared.messages import Reading, SensorEvent
+from shared.redis_client import RedisClient
+from shared.redis_streams import RedisStreamPublisher, stream_key
+from shared.sensors import models
+from shared.transport import PublishError
+
+client = TestClient(app)
+
+
+def stream_publisher(connected=True):
+    # The Redis transport on an in-memory Redis, which refuses connections unless `connected`
+    server = fakeredis.FakeServer()
+    server.connected = connected
+    publisher = RedisStreamPublisher.__new__(RedisStreamPublisher)
+    publisher.redis = RedisClient()
+    publisher.redis._client = fakeredis.FakeRedis(server=server)
+    publisher.partitions = 1
+    publisher.queue = "sensor_data"
+    return publisher
+
+
+@pytest.fixture
+def failing_transport(monkeypatch):
+    monkeypatch.setattr(controller, "publisher", stream_publisher(connected=False))
+    session = fakes.fake_session_factory()()
+    session.add(models.Sensor(name="Queued sensor"))
+    session.commit()
+    app.dependency_overrides[controller.get_db] = lambda: session
+    yield
+    app.dependency_overrides.pop(controller.get_db)
+    session.close()
+
+
+def test_redis_publisher_publishes():
+    publisher = stream_publisher()
+    publisher.publish(Reading(1, {"temperature": 1.0, "last_seen": "2020-01-01T00:00:00"}))
+    assert len(publisher.redis.xrange(stream_key(0, "sensor_data"))) == 1
+
+
+def test_redis_publisher_connection_error():
+    with pytest.raises(PublishError):
+        stream_publisher(connected=False).publish(SensorEvent(SensorEvent.DELETED, 1))
+
+
+def test_redis_publisher_encoding_error():
+    with pytest.raises(PublishError):
+        stream_publisher().publish(Reading(1, {"temperature": 1.0, "last_seen": "x" * 70000}))
+
+
+def test_queue_data_transport_down(failing_transport):
+    """The reading is not queued: the client is told to retry"""
+    response = client.post("/sensors/1/data/queue", json={"temperature": 1.0, "last_seen": "2020-01-01T00:00:00"})
+    assert response.status_code == 503
+
+
+def test_events_transport_down(failing_transport):
+    """The sensor is written already: a lost event is only logged"""
+    controller.publish_event(SensorEvent(SensorEvent.DELETED, 1))
@@ -131,6 +131,35 @@ def test_get_sensor_data_3_month():
     assert response.status_code == 200
     json = response.json()
     assert len(json) == 1
+
+def test_get_sensor_data_1_day_columnar():
+    response = client.get("/sensors/1/data?from=2020-01-01T00:00:00.000Z&to=2020-01-03T00:00:00.000Z&bucket=day&layout=columnar")
+    assert response.status_code == 200
+    json = response.json()
+    assert set(json) == {"t", "avg_velocity", "avg_temperature", "avg_humidity", "avg_battery_level"}
+    assert len(json["t"]) == 3
+    assert len(json["avg_temperature"]) == 3
+
+def test_get_sensor_data_1_day_arrow():
+    # pyarrow is optional: without it the route only answers JSON
+    pa = pytest.importorskip("pyarrow")
+    response = client.get("/sensors/1/data?from=2020-01-01T00:00:00.000Z&to=2020-01-03T00:00:00.000Z&bucket=day",
+                          headers={"Accept": "application/vnd.apache.arrow.stream", "Accept-Encoding": "identity"})
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/vnd.apache.arrow.stream"
+    table = pa.ipc.open_stream(response.content).read_all()
+    assert table.num_rows == 3
+    assert "avg_temperature" in table.column_names
+
+def test_get_sensor_data_3_day_not_modified():
+    # Sensor 3 has readings up to 2020-01-15, so these buckets are closed
+    url = "/sensors/3/data?from=2020-01-01T00:00:00.000Z&to=2020-01-02T00:00:00.000Z&bucket=day"
+    response = client.get(url)
+    assert response.status_code == 200
+    etag = response.headers["etag"]
+    response = client.get(url, headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.headers["etag"] == etag
     
 def test_post_sensor_data_not_exists():
     response = client.post("/sensors/4/data", json={"temperature": 1.0, "humidity": 1.0, "battery_level": 1.0, "last_seen": "2020-01-01T00:00:00.000Z"})
@@ -0,0 +1,91 @@
+import json
+import logging
+import os
+import time
+from collections import defaultdict
+
+from starlette.datastructures import Headers, MutableHeaders
+
+from shared import metrics
+
+# Add a Server-Timing header with the time spent in each store to every response
+SERVER_TIMING = os.environ.get("SERVER_TIMING", "").lower() in ("1", "true", "yes")
+# Log requests slower than this many milliseconds, 0 disables the log
+SLOW_REQUEST_MS = float(os.environ.get("SLOW_REQUEST_MS", 0))
+
+slow_requests = logging.getLogger("slow_requests")
+
+
+def store_totals(spans):
+    """Milliseconds and number of operations per store."""
+    totals = defaultdict(lambda: [0.0, 0])
+    for store, _, seconds in spans:
+        totals[store][0] += seconds * 1000
+        totals[store][1] += 1
+    return totals
+
+
+def server_timing(spans, total_ms):
+    # Writes that were fanned out overlap, so the stores may add up to more than total
+    entries = [f'{store};dur={ms:.1f};desc="{count} ops"' for store, (ms, count) in store_totals(spans).items()]
+    entries.append(f"total;dur={total_ms:.1f}")
+    return ", ".join(entries)
+
+
+class ServerTimingMiddleware:
+    """
+    Times the store operations of each request, from the spans the client wrappers
+    record in `shared.metrics`. Adds them as a Server-Timing header when SERVER_TIMING
+    is set, and logs requests slower than SLOW_REQUEST_MS as one JSON line on the
+    `slow_requests` logger. Only installed when one of the two is enabled.
+    Event streams (/sensors/live) last as long as their client and are not logged.
+    """
+
+    def __init__(self, app, header=SERVER_TIMING, slow_ms=SLOW_REQUEST_MS):
+        self.app = app
+        self.header = header
+        self.slow_ms = slow_ms
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        spans = []
+        token = metrics.spans.set(spans)
+        started = time.perf_counter()
+        status = None
+        streaming = False
+
+        async def send_timed(message):
+            nonlocal status, streaming
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                streaming = Headers(scope=message).get("content-type", "").startswith("text/event-stream")
+                if self.header:
+                    headers = MutableHeaders(scope=message)
+                    headers.append("Server-Timing", server_timing(spans, (time.perf_counter() - started) * 1000))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_timed)
+        finally:
+            metrics.spans.reset(token)
+            total_ms = (time.perf_counter() - started) * 1000
+            if self.slow_ms and total_ms >= self.slow_ms and not streaming:
+                self.log_slow(scope, status, total_ms, spans)
+
+    def log_slow(self, scope, status, total_ms, spans):
+        route = scope.get("route")
+        slow_requests.warning(json.dumps({
+            "event": "slow_request",
+            "method": scope["method"],
+            "path": scope["path"],
+            "route": getattr(route, "path", None),
+            "status": status,
+            "duration_ms": round(total_ms, 1),
+            "stores": {store: {"ms": round(ms, 1), "ops": count} for store, (ms, count) in store_totals(spans).items()},
+            # The slowest operations, enough to tell a single slow query from many fast ones
+            "slowest": [
+                {"store": store, "operation": operation, "ms": round(seconds * 1000, 1)}
+                for store, operation, seconds in sorted(spans, key=lambda span: span[2], reverse=True)[:10]
+            ],
+        }))
@@ -0,0 +1,193 @@
+import math
+import threading
+from collections import namedtuple
+
+import fakeredis
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from shared.database import Base
+from shared.redis_client import RedisClient
+from shared.sensors.repository import TEMPERATURE_STATISTICS_INSERT, TEMPERATURE_STATISTICS_SELECT
+
+# In-process stand-ins for the stores, exposing just what the repository calls.
+# They keep the repository code itself on the measured path, without the network.
+
+EARTH_RADIUS = 6371000
+
+
+def fake_redis_client():
+    """The real RedisClient, codec included, on top of an in-memory Redis."""
+    client = RedisClient()
+    client._client = fakeredis.FakeRedis()
+    return client
+
+
+def fake_session_factory():
+    """SQLAlchemy sessions on an in-memory SQLite database with the sensors table."""
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(engine)
+    return sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+
+class FakeResult(list):
+    def one(self):
+        return self[0] if self else None
+
+
+TemperatureStatistics = namedtuple("TemperatureStatistics", "max_temperature min_temperature total_temperature temperature_count")
+
+
+class FakeCassandraClient:
+    """Keeps temperature statistics so their read-modify-write runs; other statements are only counted."""
+
+    def __init__(self):
+        self.statistics = {}
+        self.statements = 0
+        self.lock = threading.Lock()
+
+    def close(self):
+        pass
+
+    def execute(self, query, parameters=None, raise_errors=False):
+        with self.lock:
+            self.statements += 1
+            if query is TEMPERATURE_STATISTICS_SELECT:
+                row = self.statistics.get(parameters[0])
+                return FakeResult([row] if row else [])
+            if query is TEMPERATURE_STATISTICS_INSERT:
+                sensor_id, max_temp, min_temp, _, total, count = parameters
+                self.statistics[sensor_id] = TemperatureStatistics(max_temp, min_temp, total, count)
+            return FakeResult()
+
+
+class FakeConnection:
+    autocommit = False
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+
+class FakeCursor:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def fetchall(self):
+        return self.rows
+
+
+class FakeTimescale:
+    """Accepts any statement; queries over a continuous aggregate return `rows`."""
+
+    def __init__(self, rows=()):
+        self.conn = FakeConnection()
+        self.cursor = FakeCursor(list(rows))
+        self.statements = 0
+
+    def close(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def execute(self, query):
+        self.statements += 1
+
+    def commit(self):
+        pass
+
+    def refresh_materialized_view(self, view):
+        self.statements += 1
+
+
+def distance(a, b):
+    """Haversine distance in meters between two [longitude, latitude] points."""
+    lon1, lat1, lon2, lat2 = map(math.radians, (*a, *b))
+    h = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS * math.asin(math.sqrt(h))
+
+
+class FakeCollection:
+    def __init__(self):
+        self.documents = []
+
+    def create_index(self, keys):
+        pass
+
+    def insert_one(self, document):
+        document.setdefault("_id", len(self.documents) + 1)
+        self.documents.append(document)
+
+    def find_one(self, filter):
+        for document in self.documents:
+            if all(document.get(key) == value for key, value in filter.items()):
+                return document
+        return None
+
+    def find(self, filter, projection=None):
+        near = filter.get("location", {}).get("$near")
+        if near is None:
+            return [document for document in self.documents if all(document.get(key) == value for key, value in filter.items())]
+        point = near["$geometry"]["coordinates"]
+        matches = []
+        for document in self.documents:
+            meters = distance(point, document["location"]["coordinates"])
+            if meters <= near["$maxDistance"]:
+                matches.append((meters, document))
+        # $near returns the closest first
+        return [document for _, document in sorted(matches, key=lambda match: match[0])]
+
+    def delete_one(self, filter):
+        document = self.find_one(filter)
+        if document is not None:
+            self.documents.remove(document)
+
+
+class FakeMongoDBClient:
+    def __init__(self):
+        self.collections = {}
+        self.collection = None
+
+    def close(self):
+        pass
+
+    def getDatabase(self, database):
+        return self
+
+    def getCollection(self, collection):
+        self.collection = self.collections.setdefault(collection, FakeCollection())
+        return self.collection
+
+
+class FakeElasticsearchClient:
+    """Case-insensitive term matching over the indexed documents, enough for match/prefix/similar queries."""
+
+    def __init__(self):
+        self.indices = {}
+
+    def close(self):
+        pass
+
+    def index_document(self, index_name, document, id=None):
+        self.indices.setdefault(index_name, []).append(document)
+
+    def search(self, index_name, query):
+        clause = query["query"]
+        if "multi_match" in clause:
+            term = str(clause["multi_match"]["query"]).lower()
+            fields = clause["multi_match"]["fields"]
+            match = lambda document: any(term in str(document.get(field, "")).lower().split() for field in fields)
+        elif "prefix" in clause:
+            field, prefix = next(iter(clause["prefix"].items()))
+            field = field.removesuffix(".keyword")
+            match = lambda document: str(document.get(field, "")).startswith(prefix)
+        else:
+            field, options = next(iter(clause["match"].items()))
+            terms = str(options["query"]).lower().split()
+            match = lambda document: all(term in str(document.get(field, "")).lower() for term in terms)
+        hits = [{"_source": document} for document in self.indices.get(index_name, []) if match(document)]
+        return {"hits": {"hits": hits[:query.get("size", 10)]}}
@@ -0,0 +1,301 @@
+"""
+Benchmarks of the hot repository paths: recording a reading, the Timescale aggregate
+query, the geospatial lookup and the Elasticsearch search.
+
+    python -m benchmarks.run                  # in-memory stand-ins (benchmarks.fakes)
+    python -m benchmarks.run --backend real   # the docker-compose stores
+    python -m benchmarks.run --save           # store the results as the new baseline
+
+Each benchmark reports ops/s, p50/p99 latency and the memory allocated per operation
+(peak traced by tracemalloc). The Redis memory a sensor takes with each record codec
+is reported after them. Results are compared with the baseline of the same
+backend in baselines.json, and the exit status is 1 when one of them regresses by
+more than --tolerance. Baselines depend on the machine: refresh them with --save
+when that changes.
+"""
+import argparse
+import contextlib
+import datetime
+import json
+import logging
+import os
+import random
+import sys
+import time
+import tracemalloc
+import uuid
+from pathlib import Path
+
+from shared import redis_codec
+from shared.sensors import repository, schemas
+
+BASELINES = Path(__file__).with_name("baselines.json")
+# Sensors are placed around this point, [longitude, latitude]
+CENTER = (2.1734, 41.3851)
+TYPES = ("Temperatura", "Velocitat")
+# Iterations whose allocations are traced; tracing slows everything down
+ALLOCATION_SAMPLES = 200
+# Readings kept in each sensor's recent buffer when comparing the codecs
+MEMORY_READINGS = 100
+
+
+class Stores:
+    def __init__(self, db, redis, timescale, cassandra, mongodb, es):
+        self.db = db
+        self.redis = redis
+        self.timescale = timescale
+        self.cassandra = cassandra
+        self.mongodb = mongodb
+        self.es = es
+
+    def close(self):
+        for client in (self.db, self.redis, self.timescale, self.cassandra, self.mongodb, self.es):
+            client.close()
+
+
+def fake_stores():
+    from benchmarks import fakes
+    hours = [datetime.datetime(2020, 1, 1, hour) for hour in range(24)]
+    return Stores(
+        db=fakes.fake_session_factory()(),
+        redis=fakes.fake_redis_client(),
+        timescale=fakes.FakeTimescale((hour, 1.0, 20.0, 50.0, 0.5) for hour in hours),
+        cassandra=fakes.FakeCassandraClient(),
+        mongodb=fakes.FakeMongoDBClient(),
+        es=fakes.FakeElasticsearchClient(),
+    )
+
+
+def real_stores():
+    from shared.cassandra_client import CassandraClient
+    from shared.database import SessionLocal
+    from shared.elasticsearch_client import ElasticsearchClient
+    from shared.mongodb_client import MongoDBClient
+    from shared.redis_client import RedisClient
+    from shared.timescale import Timescale
+    return Stores(
+        db=SessionLocal(),
+        redis=RedisClient(host="redis"),
+        timescale=Timescale(),
+        cassandra=CassandraClient(hosts=["cassandra"]),
+        mongodb=MongoDBClient(host="mongodb"),
+        es=ElasticsearchClient(host="elasticsearch"),
+    )
+
+
+def seed(stores, count, rng):
+    """Create `count` sensors within ~2 km of CENTER, each with one reading."""
+    run = uuid.uuid4().hex[:8]
+    ids = []
+    for i in range(count):
+        sensor = schemas.SensorCreate(
+            name=f"bench-{run}-{i}",
+            longitude=CENTER[0] + rng.uniform(-0.02, 0.02),
+            latitude=CENTER[1] + rng.uniform(-0.02, 0.02),
+            type=TYPES[i % len(TYPES)],
+            mac_address=f"00:00:00:00:{i // 256:02x}:{i % 256:02x}",
+            manufacturer="Dummy",
+            model="Dummy Temp",
+            serie_number="0000 0000 0000 0000",
+            firmware_version="1.0",
+            description=f"Benchmark sensor {i}",
+        )
+        sensor_id = repository.create_sensor(db=stores.db, sensor=sensor, mongodb_client=stores.mongodb, es=stores.es, cassandra=stores.cassandra)["id"]
+        repository.record_data(cassandra=stores.cassandra, redis=stores.redis, timescale=stores.timescale, sensor_id=sensor_id, data=reading(rng, 0))
+        ids.append(sensor_id)
+    if hasattr(stores.es, "client"):
+        # Make the new documents searchable right away
+        stores.es.client.indices.refresh(index="sensors")
+    return ids
+
+
+def reading(rng, n):
+    # A distinct last_seen per call, so duplicate suppression never skips the writes
+    last_seen = datetime.datetime(2020, 1, 1, tzinfo=datetime.timezone.utc) + datetime.timedelta(seconds=n)
+    return schemas.SensorData(
+        temperature=rng.uniform(-10, 40),
+        humidity=rng.uniform(0, 100),
+        battery_level=rng.uniform(0, 1),
+        velocity=None,
+        last_seen=last_seen.isoformat(),
+    )
+
+
+def bench_record_data(stores, ids, rng):
+    counter = iter(range(1, sys.maxsize))
+
+    def op():
+        n = next(counter)
+        repository.record_data(cassandra=stores.cassandra, redis=stores.redis, timescale=stores.timescale, sensor_id=ids[n % len(ids)], data=reading(rng, n))
+    return op
+
+
+def bench_get_data_timescale(stores, ids, rng):
+    def op():
+        repository.get_data_timescale(timescale=stores.timescale, sensor_id=rng.choice(ids), from_date="2020-01-01T00:00:00", to_date="2020-01-02T00:00:00", bucket="hour")
+    return op
+
+
+def bench_get_sensors_near(stores, ids, rng):
+    def op():
+        repository.get_sensors_near(mongodb_client=stores.mongodb, db=stores.db, redis=stores.redis, latitude=CENTER[1], longitude=CENTER[0], radius=500)
+    return op
+
+
+def bench_search_sensors(stores, ids, rng):
+    def op():
+        repository.search_sensors(db=stores.db, mongodb_client=stores.mongodb, es=stores.es, query=json.dumps({"type": rng.choice(TYPES)}), size=10, search_type="match")
+    return op
+
+
+BENCHMARKS = {
+    "record_data": bench_record_data,
+    "get_data_timescale": bench_get_data_timescale,
+    "get_sensors_near": bench_get_sensors_near,
+    "search_sensors": bench_search_sensors,
+}
+
+
+def used_memory(client, key):
+    try:
+        return client.memory_usage(key, samples=0)
+    except Exception:
+        # The in-memory Redis has no MEMORY USAGE: count the encoded bytes instead
+        if client.type(key) == b"zset":
+            return sum(len(member) for member in client.zrange(key, 0, -1))
+        return client.strlen(key)
+
+
+def codec_memory(stores, rng, sensors):
+    """Bytes of Redis memory per sensor for its latest record and its recent buffer, by codec."""
+    redis = stores.redis
+    codec = redis._codec
+    results = {}
+    try:
+        for name in redis_codec.CODECS:
+            redis._codec = redis_codec.CODECS[name]
+            record_bytes = recent_bytes = 0
+            for i in range(sensors):
+                data_key, recent_key = f"benchmark:{name}:{i}:data", f"benchmark:{name}:{i}:recent"
+                for n in range(MEMORY_READINGS):
+                    data = reading(rng, n)
+                    redis.append_recent(recent_key, n, data.dict(), MEMORY_READINGS, sys.maxsize)
+                redis.set_record(data_key, data.dict())
+                record_bytes += used_memory(redis._client, data_key)
+                recent_bytes += used_memory(redis._client, recent_key)
+                redis._client.delete(data_key, recent_key)
+            results[name] = {"record_bytes": round(record_bytes / sensors), "recent_bytes": round(recent_bytes / sensors)}
+    finally:
+        redis._codec = codec
+    return results
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def measure(op, iterations, warmup):
+    for _ in range(warmup):
+        op()
+    timings = []
+    for _ in range(iterations):
+        started = time.perf_counter_ns()
+        op()
+        timings.append(time.perf_counter_ns() - started)
+
+    allocated = []
+    tracemalloc.start()
+    try:
+        for _ in range(min(iterations, ALLOCATION_SAMPLES)):
+            before = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            op()
+            allocated.append(tracemalloc.get_traced_memory()[1] - before)
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "ops_per_sec": round(iterations / (sum(timings) / 1e9), 1),
+        "p50_us": round(percentile(timings, 0.50) / 1000, 1),
+        "p99_us": round(percentile(timings, 0.99) / 1000, 1),
+        "alloc_kib": round(sum(allocated) / len(allocated) / 1024, 1),
+    }
+
+
+def regressions(results, baseline, tolerance):
+    found = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        if result["ops_per_sec"] < base["ops_per_sec"] * (1 - tolerance):
+            found.append(f"{name}: ops/s {result['ops_per_sec']} < baseline {base['ops_per_sec']}")
+        for metric in ("p99_us", "alloc_kib"):
+            if result[metric] > base[metric] * (1 + tolerance):
+                found.append(f"{name}: {metric} {result[metric]} > baseline {base[metric]}")
+    return found
+
+
+def report(results, baseline):
+    print(f"{'benchmark':<20} {'ops/s':>10} {'p50 us':>10} {'p99 us':>10} {'KiB/op':>8}  vs baseline ops/s")
+    for name, result in results.items():
+        base = baseline.get(name)
+        change = f"{result['ops_per_sec'] / base['ops_per_sec'] - 1:+.1%}" if base else "-"
+        print(f"{name:<20} {result['ops_per_sec']:>10} {result['p50_us']:>10} {result['p99_us']:>10} {result['alloc_kib']:>8}  {change}")
+
+
+def report_memory(memory, backend):
+    unit = "MEMORY USAGE" if backend == "real" else "encoded bytes, no MEMORY USAGE in the in-memory Redis"
+    print(f"\nRedis memory per sensor ({unit}), recent buffer of {MEMORY_READINGS} readings")
+    print(f"{'codec':<20} {'record':>10} {'recent':>10}")
+    for name, sizes in memory.items():
+        print(f"{name:<20} {sizes['record_bytes']:>10} {sizes['recent_bytes']:>10}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the hot repository paths.")
+    parser.add_argument("--backend", choices=("fake", "real"), default="fake")
+    parser.add_argument("--only", action="append", choices=sorted(BENCHMARKS), help="Run only this benchmark; may be repeated.")
+    parser.add_argument("--iterations", type=int, default=2000)
+    parser.add_argument("--warmup", type=int, default=100)
+    parser.add_argument("--sensors", type=int, default=200)
+    parser.add_argument("--memory-sensors", type=int, default=50, help="Sensors written with each codec to compare their Redis memory.")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed relative regression before failing.")
+    parser.add_argument("--save", action="store_true", help="Store the results as the baseline of this backend.")
+    args = parser.parse_args(argv)
+
+    baselines = json.loads(BASELINES.read_text()) if BASELINES.exists() else {}
+    baseline = baselines.get(args.backend, {})
+    rng = random.Random(42)
+    # The repository logs and prints every write; keep that out of the report
+    logging.getLogger().setLevel(logging.WARNING)
+    results = {}
+    stores = fake_stores() if args.backend == "fake" else real_stores()
+    try:
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            ids = seed(stores, args.sensors, rng)
+            for name in args.only or BENCHMARKS:
+                results[name] = measure(BENCHMARKS[name](stores, ids, rng), args.iterations, args.warmup)
+            memory = codec_memory(stores, rng, args.memory_sensors)
+            if args.backend == "real":
+                for sensor_id in ids:
+                    repository.delete_sensor(db=stores.db, sensor_id=sensor_id, redis=stores.redis, mongodb_client=stores.mongodb)
+    finally:
+        stores.close()
+
+    report(results, baseline)
+    report_memory(memory, args.backend)
+    if args.save:
+        baselines[args.backend] = {**baseline, **results}
+        BASELINES.write_text(json.dumps(baselines, indent=2, sort_keys=True) + "\n")
+        print(f"Baseline saved to {BASELINES}")
+        return 0
+    found = regressions(results, baseline, args.tolerance)
+    for regression in found:
+        print(f"REGRESSION {regression}")
+    return 1 if found else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,140 @@
+import math
+import os
+
+from shared.messages import Alert
+from shared.sensors.writers import reading_timestamp
+
+# Online anomaly detection on the readings the consumer records. State is a few
+# floats per sensor and field, updated in O(1) per reading, so the cost grows with
+# the ingest rate and not with the history.
+
+# Set to 0 to disable the detection stage
+ANOMALY_DETECTION = os.environ.get("ANOMALY_DETECTION", "1").lower() in ("1", "true", "yes")
+# Queue the alerts are published to, as `<name>.0`
+ALERT_QUEUE = os.environ.get("ALERT_QUEUE", "alerts")
+# Weight of the newest reading in the moving mean and variance
+ANOMALY_ALPHA = float(os.environ.get("ANOMALY_ALPHA", 0.1))
+# Standard deviations from the moving mean that make a value or a rate of change an outlier
+ANOMALY_THRESHOLD = float(os.environ.get("ANOMALY_THRESHOLD", 4))
+# Smallest standard deviation a value or rate is measured against, so a change after a
+# run of identical readings, which have no variance, is still an outlier
+ANOMALY_MIN_STD = float(os.environ.get("ANOMALY_MIN_STD", 0.1))
+# Readings of a sensor seen before its outliers are reported
+ANOMALY_WARMUP = int(os.environ.get("ANOMALY_WARMUP", 20))
+# Identical consecutive values after which a sensor is reported as stuck
+ANOMALY_STUCK_COUNT = int(os.environ.get("ANOMALY_STUCK_COUNT", 30))
+
+FIELDS = ("temperature", "humidity", "velocity")
+
+
+class Ewma:
+    """Exponentially weighted moving mean and variance."""
+
+    __slots__ = ("mean", "variance")
+
+    def __init__(self, value):
+        self.mean = value
+        self.variance = 0.0
+
+    def deviation(self, value, min_std):
+        # Distance from the mean in standard deviations, before `value` is folded in
+        return abs(value - self.mean) / max(math.sqrt(self.variance), min_std)
+
+    def update(self, value, alpha):
+        diff = value - self.mean
+        increment = alpha * diff
+        self.mean += increment
+        self.variance = (1 - alpha) * (self.variance + diff * increment)
+
+
+class FieldState:
+    """What the detector keeps per sensor and field."""
+
+    __slots__ = ("value", "timestamp", "count", "repeats", "level", "rate")
+
+    def __init__(self, value, timestamp):
+        self.value = value
+        self.timestamp = timestamp
+        self.count = 1
+        self.repeats = 1
+        self.level = Ewma(value)
+        self.rate = None
+
+
+class Detector:
+    """
+    Flags, per sensor and field:
+      - outlier: a value far from the moving mean of the sensor;
+      - rate: a change per second far from the usual ones;
+      - stuck: the same value ANOMALY_STUCK_COUNT readings in a row.
+    Readings not newer than the last one seen (redeliveries, late arrivals) are ignored,
+    so retries do not skew the state.
+    """
+
+    def __init__(self, publish, alpha=ANOMALY_ALPHA, threshold=ANOMALY_THRESHOLD,
+                 warmup=ANOMALY_WARMUP, stuck_count=ANOMALY_STUCK_COUNT, min_std=ANOMALY_MIN_STD):
+        self.publish = publish
+        self.alpha = alpha
+        self.threshold = threshold
+        self.min_std = min_std
+        self.warmup = warmup
+        self.stuck_count = stuck_count
+        self.states = {}
+
+    def observe(self, sensor_id, data):
+        """Fold a recorded reading (schemas.SensorData) into the state of its sensor, publishing the alerts it raises."""
+        timestamp = None
+        for field in FIELDS:
+            value = getattr(data, field)
+            if value is None:
+                continue
+            if timestamp is None:
+                timestamp = reading_timestamp(data)
+            for alert in self.check(sensor_id, field, value, timestamp, data.last_seen):
+                try:
+                    self.publish(alert)
+                except Exception as e:
+                    # The reading is recorded already: a lost alert must not get it redelivered
+                    print(f"Failed to publish {alert}: {e}")
+
+    def check(self, sensor_id, field, value, timestamp, last_seen):
+        key = (sensor_id, field)
+        state = self.states.get(key)
+        if state is None:
+            self.states[key] = FieldState(value, timestamp)
+            return []
+        elapsed = timestamp - state.timestamp
+        if elapsed <= 0:
+            return []
+
+        alerts = []
+        warm = state.count >= self.warmup
+        deviation = state.level.deviation(value, self.min_std)
+        if warm and deviation > self.threshold:
+            alerts.append(Alert(sensor_id, "outlier", field, value, last_seen,
+                                {"mean": state.level.mean, "deviation": round(deviation, 2)}))
+        state.level.update(value, self.alpha)
+
+        rate = (value - state.value) / elapsed
+        if state.rate is None:
+            state.rate = Ewma(rate)
+        else:
+            deviation = state.rate.deviation(rate, self.min_std)
+            if warm and deviation > self.threshold:
+                alerts.append(Alert(sensor_id, "rate", field, value, last_seen,
+                                    {"rate": rate, "previous": state.value, "deviation": round(deviation, 2)}))
+            state.rate.update(rate, self.alpha)
+
+        state.repeats = state.repeats + 1 if value == state.value else 1
+        # Reported once, when the run reaches the limit
+        if state.repeats == self.stuck_count:
+            alerts.append(Alert(sensor_id, "stuck", field, value, last_seen, {"repeats": state.repeats}))
+
+        state.value = value
+        state.timestamp = timestamp
+        state.count += 1
+        return alerts
+
+    def forget(self, sensor_id):
+        for field in FIELDS:
+            self.states.pop((sensor_id, field), None)
@@ -1,13 +1,88 @@
 import json
+import os
 
-from shared.subscriber import Subscriber
+from prometheus_client import start_http_server
 
-subscriber = Subscriber()
+from consumer import anomaly
+from consumer.supervisor import supervise
+from shared import messages, schema
+from shared.cassandra_client import CassandraClient
+from shared.partitioning import QUEUE_PARTITIONS
+from shared.redis_client import RedisClient
+from shared.sensors import read_model, schemas, writers
+from shared.timescale import Timescale
+from shared.transport import get_publisher, get_subscriber
 
+# Each worker serves its metrics on this port plus its partition number
+CONSUMER_METRICS_PORT = int(os.environ.get("CONSUMER_METRICS_PORT", 9100))
 
-def callback(ch, method, properties, body):
-    data = json.loads(body)
-    print("Received data:", data)
 
+def handle_batch(bodies, redis, timescale, cassandra, detector=None):
+    """
+    Write every reading of the batch, then pass it to the anomaly `detector`. Returns
+    `(index, body)` for each message with failed readings, where the body holds only
+    those readings, so the subscriber retries them without rewriting the ones that succeeded.
+    """
+    failures = []
+    for index, body in enumerate(bodies):
+        if not messages.is_readings(body):
+            event = messages.decode_event(body)
+            if event is None:
+                print("Received data:", json.loads(body))
+                continue
+            if detector is not None and event.kind == messages.SensorEvent.DELETED:
+                detector.forget(event.sensor_id)
+            try:
+                read_model.apply_event(redis, event)
+            except Exception as e:
+                print(f"Failed to apply {event}: {e}")
+                failures.append((index, body))
+            continue
+        failed = []
+        for reading in messages.decode_readings(body):
+            data = schemas.SensorData(**reading.data)
+            try:
+                writers.record_data(cassandra=cassandra, redis=redis, timescale=timescale,
+                                       sensor_id=reading.sensor_id, data=data)
+            except Exception as e:
+                print(f"Failed to record {reading}: {e}")
+                failed.append(reading)
+                try:
+                    timescale.rollback()
+                except Exception as e:
+                    print(f"Timescale is unavailable: {e}")
+            else:
+                if detector is not None:
+                    detector.observe(reading.sensor_id, data)
+        if failed:
+            failures.append((index, messages.encode_readings(failed)))
+    return failures
 
-subscriber.subscribe(callback)
+
+def run(partition):
+    # One worker per partition keeps the readings of each sensor in order.
+    # Each worker process opens its own connections.
+    start_http_server(CONSUMER_METRICS_PORT + partition)
+    redis = RedisClient(host=os.environ.get("REDIS_HOST", "redis"))
+    timescale = Timescale()
+    schema.ensure("timescale", timescale)
+    cassandra = CassandraClient(hosts=[os.environ.get("CASSANDRA_HOST", "cassandra")])
+    alerts = detector = None
+    if anomaly.ANOMALY_DETECTION:
+        # The readings of a sensor all reach the same worker, which keeps their detection state
+        alerts = get_publisher(queue=anomaly.ALERT_QUEUE, partitions=1)
+        detector = anomaly.Detector(alerts.publish)
+    subscriber = get_subscriber(partition)
+    try:
+        subscriber.subscribe(lambda bodies: handle_batch(bodies, redis, timescale, cassandra, detector))
+    finally:
+        subscriber.close()
+        if alerts is not None:
+            alerts.close()
+        cassandra.close()
+        timescale.close()
+        redis.close()
+
+
+if __name__ == "__main__":
+    supervise(run, QUEUE_PARTITIONS)
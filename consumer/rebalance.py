@@ -0,0 +1,59 @@
+import argparse
+import collections
+
+import pika
+
+from shared import messages
+from shared.partitioning import partition_for, queue_name
+from shared.publisher import QUEUE_NAME, RABBITMQ_HOST, declare_queue
+
+
+def rebalance(channel, old_partitions, new_partitions):
+    """
+    Move queued readings and sensor events from `old_partitions` RabbitMQ queues to the queues they map
+    to with `new_partitions`. Run it with publishers and consumers stopped, then start
+    them with the new QUEUE_PARTITIONS. Queues no longer needed are deleted.
+    """
+    for partition in range(new_partitions):
+        declare_queue(channel, partition)
+    channel.confirm_delivery()
+    for partition in range(old_partitions):
+        queue = declare_queue(channel, partition)
+        # Only what is queued now, so readings put back into this queue are not read again
+        count = channel.queue_declare(queue=queue, passive=True).method.message_count
+        moved = 0
+        for _ in range(count):
+            method, properties, body = channel.basic_get(queue)
+            if method is None:
+                break
+            if messages.is_readings(body):
+                by_partition = collections.defaultdict(list)
+                for reading in messages.decode_readings(body):
+                    by_partition[partition_for(reading.sensor_id, new_partitions)].append(reading)
+                for target, readings in by_partition.items():
+                    channel.basic_publish(exchange='', routing_key=queue_name(QUEUE_NAME, target), body=messages.encode_readings(readings))
+            else:
+                event = messages.decode_event(body)
+                if event is not None:
+                    target = partition_for(event.sensor_id, new_partitions)
+                else:
+                    target = partition if partition < new_partitions else 0
+                channel.basic_publish(exchange='', routing_key=queue_name(QUEUE_NAME, target), body=body)
+            channel.basic_ack(method.delivery_tag)
+            moved += 1
+        print(f"Partition {partition}: re-routed {moved} messages")
+        if partition >= new_partitions:
+            channel.queue_delete(queue)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Re-route queued readings after changing QUEUE_PARTITIONS")
+    parser.add_argument("old_partitions", type=int)
+    parser.add_argument("new_partitions", type=int)
+    args = parser.parse_args()
+    credentials = pika.PlainCredentials('guest', 'guest')
+    conn = pika.BlockingConnection(pika.ConnectionParameters(RABBITMQ_HOST, 5672, '/', credentials))
+    try:
+        rebalance(conn.channel(), args.old_partitions, args.new_partitions)
+    finally:
+        conn.close()
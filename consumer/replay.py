@@ -0,0 +1,54 @@
+import argparse
+import os
+
+import pika
+
+from shared.partitioning import queue_name
+from shared.publisher import QUEUE_NAME, RABBITMQ_HOST
+from shared.redis_client import RedisClient
+from shared.redis_streams import DEAD_LETTER_STREAM, STREAM_MAXLEN, stream_key
+from shared.subscriber import DEAD_LETTER_QUEUE
+from shared.transport import QUEUE_TRANSPORT
+
+
+def replay_rabbitmq(limit=None):
+    """Move dead-lettered messages back to their partition queue with a fresh attempt count."""
+    credentials = pika.PlainCredentials('guest', 'guest')
+    conn = pika.BlockingConnection(pika.ConnectionParameters(RABBITMQ_HOST, 5672, '/', credentials))
+    try:
+        channel = conn.channel()
+        channel.confirm_delivery()
+        count = channel.queue_declare(queue=DEAD_LETTER_QUEUE, passive=True).method.message_count
+        replayed = 0
+        for _ in range(count if limit is None else min(count, limit)):
+            method, properties, body = channel.basic_get(DEAD_LETTER_QUEUE)
+            if method is None:
+                break
+            partition = (properties.headers or {}).get("x-partition", 0)
+            channel.basic_publish(exchange='', routing_key=queue_name(QUEUE_NAME, partition), body=body)
+            channel.basic_ack(method.delivery_tag)
+            replayed += 1
+        return replayed
+    finally:
+        conn.close()
+
+
+def replay_redis(limit=None):
+    redis = RedisClient(host=os.environ.get("REDIS_HOST", "redis"))
+    try:
+        replayed = 0
+        for entry_id, fields in redis.xrange(DEAD_LETTER_STREAM, count=limit):
+            redis.xadd(stream_key(int(fields[b"partition"])), {"body": fields[b"body"]}, maxlen=STREAM_MAXLEN)
+            redis.xdel(DEAD_LETTER_STREAM, entry_id)
+            replayed += 1
+        return replayed
+    finally:
+        redis.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay dead-lettered messages into their partition queues")
+    parser.add_argument("--limit", type=int, default=None, help="replay at most this many messages")
+    args = parser.parse_args()
+    replay = replay_redis if QUEUE_TRANSPORT == "redis" else replay_rabbitmq
+    print(f"Replayed {replay(args.limit)} messages")
@@ -0,0 +1,75 @@
+import multiprocessing
+import os
+import signal
+import time
+
+# Seconds to wait before restarting a worker, doubled on every crash up to the max
+RESTART_BACKOFF = 1
+RESTART_BACKOFF_MAX = 60
+# Seconds a worker has to exit after SIGTERM before it is killed
+STOP_TIMEOUT = float(os.environ.get("STOP_TIMEOUT", 10))
+
+
+def run_worker(target, slot):
+    # Forked workers inherit the supervisor's handlers, which would turn terminate() into a no-op
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    target(slot)
+
+
+def supervise(target, workers):
+    """
+    Run `workers` processes of `target`, each called with its slot number, and restart
+    any that exits, with exponential backoff per slot. Stops all workers on SIGTERM or SIGINT.
+    """
+    processes = {}
+    started_at = {}
+    backoff = {}
+    restart_at = {}
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    def start(slot):
+        process = multiprocessing.Process(target=run_worker, args=(target, slot), name=f"consumer-{slot}", daemon=True)
+        process.start()
+        processes[slot] = process
+        started_at[slot] = time.monotonic()
+        print(f"Started worker {slot} (pid {process.pid})")
+
+    for slot in range(workers):
+        backoff[slot] = RESTART_BACKOFF
+        start(slot)
+
+    while not stopping:
+        now = time.monotonic()
+        for slot, process in processes.items():
+            if process.is_alive():
+                continue
+            if slot not in restart_at:
+                # A worker that ran for a while before dying starts over with a short backoff
+                if now - started_at[slot] > RESTART_BACKOFF_MAX:
+                    backoff[slot] = RESTART_BACKOFF
+                print(f"Worker {slot} exited with code {process.exitcode}, restarting in {backoff[slot]}s")
+                restart_at[slot] = now + backoff[slot]
+                backoff[slot] = min(backoff[slot] * 2, RESTART_BACKOFF_MAX)
+            elif now >= restart_at[slot]:
+                del restart_at[slot]
+                start(slot)
+        time.sleep(0.5)
+
+    for process in processes.values():
+        process.terminate()
+    # One deadline for all of them, so a stuck worker cannot hold up the shutdown
+    deadline = time.monotonic() + STOP_TIMEOUT
+    for slot, process in processes.items():
+        process.join(max(0, deadline - time.monotonic()))
+        if process.is_alive():
+            print(f"Worker {slot} did not stop in {STOP_TIMEOUT}s, killing it")
+            process.kill()
+            process.join()
@@ -0,0 +1,117 @@
+from datetime import datetime, timedelta
+
+from consumer.anomaly import Detector
+from shared.sensors.schemas import SensorData
+
+START = datetime(2020, 1, 1)
+
+
+def reading(temperature, seconds):
+    return SensorData(temperature=temperature, last_seen=(START + timedelta(seconds=seconds)).isoformat())
+
+
+def detector(alerts, **options):
+    options.setdefault("warmup", 10)
+    options.setdefault("stuck_count", 1000)
+    return Detector(alerts.append, **options)
+
+
+def observe(detector, sensor_id, values, start=0):
+    for second, value in enumerate(values, start):
+        detector.observe(sensor_id, reading(value, second))
+
+
+def kinds(alerts):
+    return [alert.kind for alert in alerts]
+
+
+def test_spike_after_steady_values_is_an_outlier():
+    """A change after identical readings is flagged, although they have no variance"""
+    alerts = []
+    d = detector(alerts)
+    observe(d, 1, [20.0] * 20)
+    assert alerts == []
+    d.observe(1, reading(30.0, 20))
+    assert "outlier" in kinds(alerts)
+    assert alerts[0].sensor_id == 1
+    assert alerts[0].field == "temperature"
+    assert alerts[0].value == 30.0
+
+
+def test_noise_is_not_an_outlier():
+    """Values within the usual spread of the sensor raise nothing"""
+    alerts = []
+    d = detector(alerts)
+    observe(d, 1, [20.0, 21.0] * 20 + [20.5])
+    assert alerts == []
+
+
+def test_no_outliers_before_warmup():
+    alerts = []
+    d = detector(alerts)
+    observe(d, 1, [20.0] * 5 + [30.0])
+    assert alerts == []
+
+
+def test_rate_of_change():
+    """A usual value reached much faster than usual is a rate alert, not an outlier"""
+    alerts = []
+    d = detector(alerts)
+    observe(d, 1, [20.0, 22.0] * 20)
+    d.observe(1, SensorData(temperature=21.0, last_seen=(START + timedelta(seconds=39.01)).isoformat()))
+    assert kinds(alerts) == ["rate"]
+    assert alerts[0].detail["previous"] == 22.0
+
+
+def test_stuck_is_reported_once():
+    alerts = []
+    d = detector(alerts, stuck_count=5)
+    observe(d, 1, [20.0] * 4)
+    assert alerts == []
+    observe(d, 1, [20.0] * 3, start=4)
+    assert kinds(alerts) == ["stuck"]
+    assert alerts[0].detail == {"repeats": 5}
+
+
+def test_late_and_duplicate_readings_are_ignored():
+    """Redeliveries and late readings neither raise alerts nor change the state"""
+    alerts = []
+    d = detector(alerts)
+    observe(d, 1, [20.0] * 20)
+    state = d.states[(1, "temperature")]
+    d.observe(1, reading(30.0, 19))
+    d.observe(1, reading(30.0, 5))
+    assert alerts == []
+    assert state.count == 20
+    assert state.value == 20.0
+
+
+def test_sensors_are_independent():
+    alerts = []
+    d = detector(alerts)
+    observe(d, 1, [20.0] * 20)
+    d.observe(2, reading(30.0, 20))
+    assert alerts == []
+
+
+def test_forget():
+    """A deleted sensor starts over: its next reading is its first"""
+    alerts = []
+    d = detector(alerts)
+    observe(d, 1, [20.0] * 20)
+    d.forget(1)
+    assert (1, "temperature") not in d.states
+    d.observe(1, reading(30.0, 20))
+    assert alerts == []
+    assert d.states[(1, "temperature")].count == 1
+
+
+def test_publish_failure_does_not_raise():
+    """The reading is recorded already, so a lost alert is only logged"""
+    def publish(alert):
+        raise RuntimeError("queue unavailable")
+
+    d = Detector(publish, warmup=10)
+    for second in range(20):
+        d.observe(1, reading(20.0, second))
+    d.observe(1, reading(30.0, 20))
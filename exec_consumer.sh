@@ -1,4 +1,7 @@
 path= pwd
 export PYTHONPATH=$PYTHONPATH:$path
 echo $PYTHONPATH
-python ./consumer/main.py
\ No newline at end of file
+# Schemas are created by `python -m shared.bootstrap`; workers only check their version once
+export SCHEMA_MODE=${SCHEMA_MODE:-verify}
+# QUEUE_PARTITIONS sets the number of queue partitions, one worker process each
+python ./consumer/main.py
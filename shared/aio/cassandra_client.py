@@ -0,0 +1,46 @@
+import asyncio
+import time
+
+from shared import metrics
+from shared.cassandra_client import CassandraClient
+
+
+class AsyncCassandraClient:
+    """
+    Awaitable queries on top of the driver's own async futures (`execute_async`).
+    A query resolves to the rows of its first page.
+    """
+
+    def __init__(self, hosts):
+        self.client = CassandraClient(hosts)
+
+    def close(self):
+        self.client.close()
+
+    def execute(self, query, parameters=None):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        operation = metrics.statement(query)
+        started = time.perf_counter()
+        # The callbacks run outside the request's context, so they are given its spans
+        spans = metrics.spans.get()
+
+        def resolve(rows):
+            metrics.record("cassandra", operation, time.perf_counter() - started, current=spans)
+            if not future.done():
+                future.set_result(rows)
+
+        def fail(error):
+            metrics.record("cassandra", operation, time.perf_counter() - started, failed=True, current=spans)
+            if not future.done():
+                future.set_exception(error)
+
+        def on_success(rows):
+            loop.call_soon_threadsafe(resolve, rows)
+
+        def on_error(error):
+            loop.call_soon_threadsafe(fail, error)
+
+        # Callbacks run on the driver's event thread, hence call_soon_threadsafe
+        self.client.get_session().execute_async(query, parameters).add_callbacks(on_success, on_error)
+        return future
@@ -0,0 +1,35 @@
+import asyncpg
+
+from shared import metrics
+
+
+class AsyncPostgres:
+    """A pool of asyncpg connections. Call `connect` once before use."""
+
+    store = "postgres"
+
+    def __init__(self, dsn, min_size=1, max_size=10):
+        self.dsn = dsn
+        self.min_size = min_size
+        self.max_size = max_size
+        self.pool = None
+
+    async def connect(self):
+        self.pool = await asyncpg.create_pool(self.dsn, min_size=self.min_size, max_size=self.max_size)
+        metrics.POOL_CONNECTIONS.labels(self.store, "checked_out").set_function(lambda: self.pool.get_size() - self.pool.get_idle_size())
+        metrics.POOL_CONNECTIONS.labels(self.store, "idle").set_function(self.pool.get_idle_size)
+
+    async def close(self):
+        await self.pool.close()
+
+    async def fetch(self, query, *args):
+        with metrics.track(self.store, metrics.statement(query)):
+            return await self.pool.fetch(query, *args)
+
+    async def fetchrow(self, query, *args):
+        with metrics.track(self.store, metrics.statement(query)):
+            return await self.pool.fetchrow(query, *args)
+
+    async def execute(self, query, *args):
+        with metrics.track(self.store, metrics.statement(query)):
+            return await self.pool.execute(query, *args)
@@ -0,0 +1,17 @@
+from elasticsearch import AsyncElasticsearch
+
+from shared import metrics
+
+
+class AsyncElasticsearchClient:
+    """asyncio counterpart of `shared.elasticsearch_client.ElasticsearchClient` for searches."""
+
+    def __init__(self, host="localhost", port="9200"):
+        self.client = AsyncElasticsearch(["http://" + host + ":" + port])
+
+    async def close(self):
+        await self.client.close()
+
+    @metrics.timed("elasticsearch")
+    async def search(self, index_name, query):
+        return await self.client.search(index=index_name, body=query)
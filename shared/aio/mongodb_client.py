@@ -0,0 +1,23 @@
+from motor.motor_asyncio import AsyncIOMotorClient
+
+from shared import metrics
+
+
+class AsyncMongoDBClient:
+    """asyncio counterpart of `shared.mongodb_client.MongoDBClient`, backed by Motor."""
+
+    def __init__(self, host="localhost", port=27017):
+        self.client = AsyncIOMotorClient(host, port, event_listeners=[metrics.mongo_listener()])
+        self.database = self.client["MongoDB_"]
+        self.collection = self.database["sensors"]
+
+    def close(self):
+        self.client.close()
+
+    def getDatabase(self, database):
+        self.database = self.client[database]
+        return self.database
+
+    def getCollection(self, collection):
+        self.collection = self.database[collection]
+        return self.collection
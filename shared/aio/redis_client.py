@@ -0,0 +1,103 @@
+import redis.asyncio as redis
+
+from shared import metrics, redis_codec
+
+
+class AsyncRedisClient:
+    """asyncio counterpart of `shared.redis_client.RedisClient` for the async routes."""
+
+    def __init__(self, host='localhost', port=6379, db=0, codec=None):
+        self._client = redis.Redis(host=host, port=port, db=db)
+        self._codec = redis_codec.get_codec(codec)
+
+    async def close(self):
+        await self._client.close()
+
+    @metrics.timed("redis")
+    async def set_nx(self, key, value, ttl):
+        return bool(await self._client.set(key, value, nx=True, ex=ttl))
+
+    @metrics.timed("redis")
+    async def set_nx_exists(self, key, value, ttl, other):
+        pipe = self._client.pipeline(transaction=False)
+        pipe.set(key, value, nx=True, ex=ttl)
+        pipe.exists(other)
+        done, exists = await pipe.execute()
+        return bool(done), bool(exists)
+
+    @metrics.timed("redis")
+    async def set_record(self, key, record):
+        return await self._client.set(key, self._codec.encode(record))
+
+    @metrics.timed("redis")
+    async def swap_record(self, key, record, messages=()):
+        pipe = self._client.pipeline(transaction=False)
+        pipe.set(key, self._codec.encode(record), get=True)
+        for channel, payload in messages:
+            pipe.publish(channel, payload)
+        return redis_codec.decode((await pipe.execute())[0])
+
+    @metrics.timed("redis")
+    async def get_record(self, key):
+        return redis_codec.decode(await self._client.get(key))
+
+    @metrics.timed("redis")
+    async def get_records(self, keys):
+        return [redis_codec.decode(value) for value in await self._client.mget(keys)]
+
+    @metrics.timed("redis")
+    async def hgetall_many(self, keys):
+        pipe = self._client.pipeline(transaction=False)
+        for key in keys:
+            pipe.hgetall(key)
+        return await pipe.execute()
+
+    @metrics.timed("redis")
+    async def hset(self, key, mapping):
+        return await self._client.hset(key, mapping=mapping)
+
+    @metrics.timed("redis")
+    async def hget(self, key, field):
+        return await self._client.hget(key, field)
+
+    @metrics.timed("redis")
+    async def hsetnx(self, key, field, value):
+        return await self._client.hsetnx(key, field, value)
+
+    @metrics.timed("redis")
+    async def hincr(self, key, field, defaults=None):
+        pipe = self._client.pipeline(transaction=False)
+        for name, value in (defaults or {}).items():
+            pipe.hsetnx(key, name, value)
+        pipe.hincrby(key, field, 1)
+        return (await pipe.execute())[-1]
+
+    @metrics.timed("redis")
+    async def hmget_with_score(self, key, fields, zset, member):
+        pipe = self._client.pipeline(transaction=False)
+        pipe.hmget(key, fields)
+        pipe.zscore(zset, member)
+        return tuple(await pipe.execute())
+
+    @metrics.timed("redis")
+    async def zadd_gt(self, key, member, score):
+        return bool(await self._client.zadd(key, {member: score}, gt=True, ch=True))
+
+    @metrics.timed("redis")
+    async def publish_many(self, messages):
+        pipe = self._client.pipeline(transaction=False)
+        for channel, payload in messages:
+            pipe.publish(channel, payload)
+        return await pipe.execute()
+
+    @metrics.timed("redis")
+    async def append_recent(self, key, score, record, maxlen, window):
+        pipe = self._client.pipeline(transaction=False)
+        pipe.zadd(key, {self._codec.encode(record): score})
+        pipe.zremrangebyrank(key, 0, -maxlen - 1)
+        pipe.zremrangebyscore(key, "-inf", f"({score - window}")
+        return await pipe.execute()
+
+    @metrics.timed("redis")
+    async def delete(self, key):
+        return await self._client.delete(key)
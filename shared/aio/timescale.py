@@ -0,0 +1,23 @@
+import os
+
+from shared.aio.database import AsyncPostgres
+
+
+class AsyncTimescale(AsyncPostgres):
+    """asyncio counterpart of `shared.timescale.Timescale`, configured from the same TS_* env vars."""
+
+    store = "timescale"
+
+    def __init__(self, **kwargs):
+        super().__init__(
+            "postgresql://{user}:{password}@{host}:{port}/{database}".format(
+                user=os.environ.get("TS_USER"),
+                password=os.environ.get("TS_PASSWORD"),
+                host=os.environ.get("TS_HOST"),
+                port=os.environ.get("TS_PORT"),
+                database=os.environ.get("TS_DBNAME")),
+            **kwargs)
+
+    async def refresh_materialized_view(self, view):
+        # asyncpg runs it outside a transaction, as the procedure requires
+        await self.execute("CALL refresh_continuous_aggregate('" + view + "', NULL, NULL)")
@@ -0,0 +1,86 @@
+"""
+Create or upgrade the schema of every store and record its version marker.
+
+    python -m shared.bootstrap                     # every store
+    python -m shared.bootstrap --store cassandra   # only some of them
+    python -m shared.bootstrap --check             # exit 1 if a store is not up to date
+
+Run it once per deploy, before the API and the consumers start. Those then only check
+the markers (see SCHEMA_MODE in shared/schema.py).
+"""
+import argparse
+import os
+import sys
+import time
+
+from shared import schema
+
+STORES = ["postgres", "timescale", "cassandra", "elasticsearch", "mongodb"]
+
+
+def connect(store):
+    from shared.cassandra_client import CassandraClient
+    from shared.elasticsearch_client import ElasticsearchClient
+    from shared.mongodb_client import MongoDBClient
+    from shared.timescale import Timescale
+    factories = {
+        "timescale": Timescale,
+        "cassandra": lambda: CassandraClient(hosts=[os.environ.get("CASSANDRA_HOST", "cassandra")]),
+        "elasticsearch": lambda: ElasticsearchClient(host=os.environ.get("ELASTICSEARCH_HOST", "elasticsearch")),
+        "mongodb": lambda: MongoDBClient(host=os.environ.get("MONGODB_HOST", "mongodb")),
+    }
+    return factories[store]()
+
+
+def retry(action, store, attempts, delay):
+    # Stores come up at their own pace after `docker-compose up`
+    for attempt in range(1, attempts + 1):
+        try:
+            return action()
+        except schema.SchemaError:
+            raise
+        except Exception as e:
+            if attempt == attempts:
+                raise
+            print(f"{store} is not ready ({e}), retrying in {delay}s")
+            time.sleep(delay)
+
+
+def bootstrap(store, mode):
+    if store == "postgres":
+        if mode == "auto":
+            schema.postgres_bootstrap()
+        elif len(schema.postgres_pending()[1]):
+            raise schema.SchemaError("postgres has pending migrations; run `python -m shared.bootstrap`")
+        return
+    client = connect(store)
+    try:
+        schema.ensure(store, client, mode=mode)
+    finally:
+        client.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Create or upgrade the schema of the stores.")
+    parser.add_argument("--store", action="append", choices=STORES, help="Bootstrap only this store; may be repeated.")
+    parser.add_argument("--check", action="store_true", help="Only check the versions, do not change anything.")
+    parser.add_argument("--attempts", type=int, default=60)
+    parser.add_argument("--delay", type=float, default=5)
+    args = parser.parse_args(argv)
+
+    mode = "verify" if args.check else "auto"
+    # Creating the clients already checks or applies the schema in this mode
+    schema.SCHEMA_MODE = mode
+    failed = False
+    for store in args.store or STORES:
+        try:
+            retry(lambda: bootstrap(store, mode), store, args.attempts, args.delay)
+            print(f"{store}: schema version {schema.VERSIONS.get(store, 'migrations')} {'checked' if args.check else 'ready'}")
+        except schema.SchemaError as e:
+            print(e)
+            failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
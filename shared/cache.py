@@ -0,0 +1,52 @@
+import threading
+import time
+from concurrent.futures import Future
+
+
+class TTLCache:
+    """
+    In-process cache of computed values, each kept for `ttl` seconds. Refreshes are
+    single-flight: when an entry is missing or expired, one caller computes it and the
+    concurrent callers for the same key wait for its result instead of computing it too.
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.entries = {}
+        self.inflight = {}
+        self.lock = threading.Lock()
+
+    def get(self, key, compute):
+        entry = self.entries.get(key)
+        if entry is not None and entry[0] > time.monotonic():
+            return entry[1]
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                return entry[1]
+            flight = self.inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self.inflight[key] = Future()
+        if not leader:
+            return flight.result()
+        try:
+            value = compute()
+        except Exception as e:
+            # Not cached: the next caller tries again
+            with self.lock:
+                del self.inflight[key]
+            flight.set_exception(e)
+            raise
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            del self.inflight[key]
+        flight.set_result(value)
+        return value
+
+    def invalidate(self, key=None):
+        with self.lock:
+            if key is None:
+                self.entries.clear()
+            else:
+                self.entries.pop(key, None)
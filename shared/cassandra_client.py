@@ -1,12 +1,15 @@
 from cassandra.cluster import Cluster
 import os
 
+from shared import metrics, schema
+
 class CassandraClient:
     def __init__(self, hosts):
         self.cluster = Cluster(hosts, protocol_version=4, load_balancing_policy=None)
         self.session = self.cluster.connect()
-        self.create_keyspace()
-        self.init_schema("migrations_cs/cassandra_tables.cql")
+        # The keyspace and tables are created by `python -m shared.bootstrap`, or here if missing
+        schema.ensure("cassandra", self)
+        self.session.set_keyspace("sensor")
         
     def create_keyspace(self):
         create_keyspace_query = """
@@ -24,16 +27,23 @@ class CassandraClient:
     def close(self):
         self.cluster.shutdown()
 
-    def execute(self, query, parameters=None):
+    def execute(self, query, parameters=None, raise_errors=False):
+        """
+        Run a query. Errors are logged and give None, as the read routes expect; the
+        write path passes `raise_errors=True` so its callers can retry or report the store.
+        """
         try:
             print(f"Executing query: {query} with parameters: {parameters}")
-            if parameters:
-                return self.get_session().execute(query, parameters)
-            else:
-                return self.get_session().execute(query)
+            with metrics.track("cassandra", metrics.statement(query)):
+                if parameters:
+                    return self.get_session().execute(query, parameters)
+                else:
+                    return self.get_session().execute(query)
         except Exception as e:
             print(f"Error executing query: {query}")
             print(f"Exception: {e}")
+            if raise_errors:
+                raise
 
     def init_schema(self, schema_file_path):
         #print("FILE PATH ES ->>" ,os.path.abspath(schema_file_path))
@@ -45,7 +55,7 @@ class CassandraClient:
                 queries = [q.strip() for q in schema_queries.split(';') if q.strip()]
                 for query in queries:
                     if query:
-                        result = self.execute(query)
+                        result = self.execute(query, raise_errors=True)
                         if result:
                             print("Query Result:", result.all())
         except Exception as e:
@@ -1,21 +1,20 @@
 from elasticsearch import Elasticsearch
-import time
+from elasticsearch.helpers import bulk
+from shared import metrics, schema
 
 class ElasticsearchClient:
     def __init__(self, host="localhost", port="9200"):
         self.host = host
         self.port = port
         self.client = Elasticsearch(["http://"+self.host+":"+self.port])
-
-        while not self.ping():
-            print("Waiting for Elasticsearch to start...")
-            time.sleep(1)
-        self.setup_index_and_mapping()
+        # Waits for Elasticsearch and creates the index only when it is missing
+        schema.ensure("elasticsearch", self)
         
 
     def ping(self):
         return self.client.ping()
     
+    @metrics.timed("elasticsearch")
     def clearIndex(self, index_name):
         if self.client.indices.exists(index=index_name):
             # If the index exists, delete it
@@ -27,6 +26,7 @@ class ElasticsearchClient:
     def close(self):
         self.client.close()
 
+    @metrics.timed("elasticsearch")
     def create_index(self, index_name):
         # If the index does not exists, create it
         if not self.client.indices.exists(index=index_name):
@@ -34,19 +34,35 @@ class ElasticsearchClient:
         else:
             return None
     
+    @metrics.timed("elasticsearch")
     def create_mapping(self, index_name, mapping):
         return self.client.indices.put_mapping(index=index_name, body=mapping)
     
+    @metrics.timed("elasticsearch")
     def search(self, index_name, query):
         return self.client.search(index=index_name, body=query)
     
-    def index_document(self, index_name, document):
-        return self.client.index(index=index_name, body=document)
+    @metrics.timed("elasticsearch")
+    def index_document(self, index_name, document, id=None):
+        return self.client.index(index=index_name, id=id, body=document)
+
+    @metrics.timed("elasticsearch")
+    def bulk_index(self, index_name, documents, ids=None):
+        actions = [{"_index": index_name, "_source": document} for document in documents]
+        for action, id in zip(actions, ids or ()):
+            action["_id"] = id
+        return bulk(self.client, actions)
+
+    @metrics.timed("elasticsearch")
+    def delete_documents(self, index_name, ids):
+        # Missing documents are not an error: the delete is only meant to leave none behind
+        return bulk(self.client, ({"_op_type": "delete", "_index": index_name, "_id": id} for id in ids), raise_on_error=False)
     
     
     def setup_index_and_mapping(self):
         index_name = "sensors"
         mapping = {
+            "_meta": {"schema_version": schema.VERSIONS["elasticsearch"]},
             "properties": {
                 "name": {"type": "text",
                      "fields": {
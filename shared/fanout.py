@@ -0,0 +1,127 @@
+import asyncio
+import concurrent.futures
+import contextvars
+import os
+import time
+
+from shared import metrics
+
+# Threads shared by every fan-out in the process
+FANOUT_WORKERS = int(os.environ.get("FANOUT_WORKERS", 16))
+# Default seconds a single store may take before it is reported as failed
+FANOUT_TIMEOUT = float(os.environ.get("FANOUT_TIMEOUT", 10))
+# Seconds a write may wait for a free thread before it is cancelled and reported as failed
+FANOUT_QUEUE_TIMEOUT = float(os.environ.get("FANOUT_QUEUE_TIMEOUT", FANOUT_TIMEOUT))
+
+_executor = concurrent.futures.ThreadPoolExecutor(max_workers=FANOUT_WORKERS, thread_name_prefix="fanout")
+metrics.FANOUT_QUEUED.set_function(_executor._work_queue.qsize)
+
+
+class FanoutError(Exception):
+    """Some of the writes failed. `results` has the ones that succeeded, `failures` the errors by store."""
+
+    def __init__(self, results, failures):
+        self.results = results
+        self.failures = failures
+        super().__init__("Failed stores: " + ", ".join(f"{name} ({error})" for name, error in failures.items()))
+
+    def detail(self):
+        return {
+            "succeeded": sorted(self.results),
+            "failed": {name: str(error) for name, error in self.failures.items()},
+        }
+
+
+def fanout(tasks, timeouts=None):
+    """
+    Run independent store writes concurrently and wait for all of them, so the latency
+    is that of the slowest store rather than the sum.
+
+    Args:
+        tasks (Dict[str, Callable]): The writes, by store name.
+        timeouts (Dict[str, float], optional): Seconds per store, FANOUT_TIMEOUT by default,
+            counted from when a thread starts the write.
+
+    Returns:
+        Dict[str, Any]: The result of each write.
+
+    Raises:
+        FanoutError: If any write raised or timed out. A write that timed out keeps
+        running in its thread and may still complete. Writes that had not started when
+        another failed, or after FANOUT_QUEUE_TIMEOUT, are cancelled and never run.
+    """
+    timeouts = timeouts or {}
+    submitted = time.monotonic()
+    started = {}
+
+    def clocked(name, task):
+        def run():
+            # Time spent waiting for a free thread does not count against the timeout
+            started[name] = time.monotonic()
+            return task()
+        return run
+
+    # Each write runs in a copy of the caller's context, so it is timed with the caller's request
+    pending = {name: _executor.submit(contextvars.copy_context().run, clocked(name, task)) for name, task in tasks.items()}
+    results = {}
+    failures = {}
+    while pending:
+        now = time.monotonic()
+        wake = []
+        for name, future in list(pending.items()):
+            timeout = timeouts.get(name, FANOUT_TIMEOUT)
+            if future.done():
+                del pending[name]
+                try:
+                    results[name] = future.result()
+                except Exception as e:
+                    failures[name] = e
+            elif name not in started and now >= submitted + FANOUT_QUEUE_TIMEOUT and future.cancel():
+                del pending[name]
+                failures[name] = TimeoutError(f"not started after {FANOUT_QUEUE_TIMEOUT}s")
+            elif name in started and now >= started[name] + timeout:
+                del pending[name]
+                failures[name] = TimeoutError(f"timed out after {timeout}s")
+            elif name in started:
+                wake.append(started[name] + timeout)
+            else:
+                # Not started yet: its deadline is at least a whole timeout away
+                wake.append(min(submitted + FANOUT_QUEUE_TIMEOUT, now + timeout))
+        if failures:
+            # The request fails anyway: writes still queued are dropped, so a retry does not race them
+            for name, future in list(pending.items()):
+                if future.cancel():
+                    del pending[name]
+                    failures[name] = concurrent.futures.CancelledError("not started, another store failed")
+        if pending:
+            concurrent.futures.wait(pending.values(), timeout=max(0, min(wake) - time.monotonic()),
+                                    return_when=concurrent.futures.FIRST_COMPLETED)
+    if failures:
+        raise FanoutError(results, failures)
+    return results
+
+
+def store_timeouts(**defaults):
+    """Timeouts by store name for `fanout`, each overridable with FANOUT_TIMEOUT_<NAME>."""
+    return {name: float(os.environ.get(f"FANOUT_TIMEOUT_{name.upper()}", seconds)) for name, seconds in defaults.items()}
+
+
+async def async_fanout(tasks, timeouts=None):
+    """`fanout` for coroutines: awaits the writes concurrently on the running event loop."""
+    timeouts = timeouts or {}
+    names = list(tasks)
+    outcomes = await asyncio.gather(
+        *(asyncio.wait_for(tasks[name], timeouts.get(name, FANOUT_TIMEOUT)) for name in names),
+        return_exceptions=True)
+    results = {}
+    failures = {}
+    for name, outcome in zip(names, outcomes):
+        if isinstance(outcome, asyncio.TimeoutError):
+            failures[name] = TimeoutError(f"timed out after {timeouts.get(name, FANOUT_TIMEOUT)}s")
+        elif isinstance(outcome, Exception):
+            failures[name] = outcome
+        else:
+            results[name] = outcome
+    if failures:
+        raise FanoutError(results, failures)
+    return results
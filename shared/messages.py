@@ -0,0 +1,144 @@
+import json
+import struct
+
+from shared.redis_codec import READING_FIELDS
+
+# Binary reading messages start with this magic, JSON messages start with "{"
+MAGIC = b"SR"
+VERSION = 2
+
+_header = struct.Struct("<2sBI")
+# sensor_id, presence bitmask, the numeric fields, length of last_seen
+_reading = struct.Struct("<iB4dH")
+# Version 1 had a one-byte length; still decoded for the messages queued before the upgrade
+_readings_by_version = {1: struct.Struct("<iB4dB"), VERSION: _reading}
+_last_seen_bit = 1 << len(READING_FIELDS)
+
+
+class Reading:
+    """A sensor reading travelling through the queue. Many of them are packed per message."""
+
+    __slots__ = ("sensor_id", "data")
+
+    def __init__(self, sensor_id, data):
+        self.sensor_id = sensor_id
+        self.data = data
+
+    def __repr__(self):
+        return f"Reading({self.sensor_id}, {self.data})"
+
+
+class SensorEvent:
+    """
+    A sensor was created or deleted. Routed like the readings of the sensor, so the
+    consumer sees its changes and readings in order.
+    """
+
+    __slots__ = ("kind", "sensor_id", "profile")
+
+    CREATED = "sensor_created"
+    DELETED = "sensor_deleted"
+
+    def __init__(self, kind, sensor_id, profile=None):
+        self.kind = kind
+        self.sensor_id = sensor_id
+        self.profile = profile
+
+    def __repr__(self):
+        return f"SensorEvent({self.kind}, {self.sensor_id})"
+
+    def to_json(self):
+        return json.dumps({"event": self.kind, "sensor_id": self.sensor_id, "profile": self.profile}, separators=(",", ":"))
+
+
+class Alert:
+    """An anomaly the consumer detected in the readings of a sensor, published to the alerts queue."""
+
+    __slots__ = ("sensor_id", "kind", "field", "value", "last_seen", "detail")
+
+    def __init__(self, sensor_id, kind, field, value, last_seen, detail=None):
+        self.sensor_id = sensor_id
+        self.kind = kind
+        self.field = field
+        self.value = value
+        self.last_seen = last_seen
+        self.detail = detail or {}
+
+    def __repr__(self):
+        return f"Alert({self.sensor_id}, {self.kind}, {self.field}={self.value})"
+
+    def to_json(self):
+        return json.dumps({
+            "alert": self.kind,
+            "sensor_id": self.sensor_id,
+            "field": self.field,
+            "value": self.value,
+            "last_seen": self.last_seen,
+            **self.detail,
+        }, separators=(",", ":"))
+
+
+def decode_event(body):
+    """The SensorEvent in a JSON message, or None for other JSON messages."""
+    try:
+        message = json.loads(body)
+    except ValueError:
+        return None
+    if not isinstance(message, dict) or message.get("event") not in (SensorEvent.CREATED, SensorEvent.DELETED):
+        return None
+    return SensorEvent(message["event"], message["sensor_id"], message.get("profile"))
+
+
+def is_readings(body):
+    return body[:2] == MAGIC
+
+
+def encode_readings(readings):
+    """
+    Pack readings into one message: a header with magic, version and count, then per
+    reading a fixed-layout record followed by `last_seen` as UTF-8.
+    """
+    parts = [_header.pack(MAGIC, VERSION, len(readings))]
+    for reading in readings:
+        data = reading.data
+        mask = 0
+        values = []
+        for bit, field in enumerate(READING_FIELDS):
+            value = data.get(field)
+            if value is None:
+                values.append(0.0)
+            else:
+                mask |= 1 << bit
+                values.append(value)
+        last_seen = data.get("last_seen")
+        tail = b""
+        if last_seen is not None:
+            mask |= _last_seen_bit
+            tail = last_seen.encode()
+        try:
+            parts.append(_reading.pack(reading.sensor_id, mask, *values, len(tail)))
+        except struct.error as e:
+            # e.g. a sensor_id out of int32 or a last_seen over 64 KiB
+            raise ValueError(f"Cannot pack {reading!r}: {e}") from None
+        parts.append(tail)
+    return b"".join(parts)
+
+
+def decode_readings(body):
+    magic, version, count = _header.unpack_from(body)
+    layout = _readings_by_version.get(version)
+    if magic != MAGIC or layout is None:
+        raise ValueError(f"Unsupported reading message version: {version}")
+    readings = []
+    offset = _header.size
+    for _ in range(count):
+        sensor_id, mask, *values, length = layout.unpack_from(body, offset)
+        offset += layout.size
+        data = {
+            field: values[bit] if mask & (1 << bit) else None
+            for bit, field in enumerate(READING_FIELDS)
+        }
+        data["last_seen"] = body[offset:offset + length].decode() if mask & _last_seen_bit else None
+        offset += length
+        readings.append(Reading(sensor_id, data))
+    return readings
@@ -0,0 +1,125 @@
+import contextlib
+import contextvars
+import functools
+import inspect
+import time
+
+from prometheus_client import Counter, Gauge, Histogram
+
+# Prometheus metrics shared by the API and the consumer. Every store client wrapper
+# reports its operations here, labelled by store and operation.
+
+STORE_LATENCY = Histogram(
+    "store_operation_seconds", "Latency of store operations", ["store", "operation"],
+    buckets=(.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10))
+STORE_ERRORS = Counter("store_operation_errors", "Store operations that raised", ["store", "operation"])
+POOL_CONNECTIONS = Gauge("store_pool_connections", "Connections of a pool by state", ["store", "state"])
+FANOUT_QUEUED = Gauge("fanout_queued_tasks", "Store writes waiting for a fan-out thread")
+PUBLISHER_PENDING = Gauge("publisher_pending_messages", "Messages waiting for the publisher thread")
+QUEUE_DEPTH = Gauge("queue_depth_messages", "Messages in a queue not yet acked by the consumer", ["queue"])
+CONSUMER_LAG = Histogram(
+    "queue_consumer_lag_seconds", "Time between publishing a message and the consumer receiving it", ["queue"],
+    buckets=(.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60, 300))
+
+
+# Store operations of the current request as (store, operation, seconds), when the
+# request is being timed. None otherwise, so recording costs one lookup.
+spans = contextvars.ContextVar("spans", default=None)
+
+
+def record(store, operation, seconds, failed=False, current=None):
+    """
+    Record one store operation. `current` is the span list to add it to, for callbacks
+    that run outside the context of the request that started the operation.
+    """
+    STORE_LATENCY.labels(store, operation).observe(seconds)
+    if failed:
+        STORE_ERRORS.labels(store, operation).inc()
+    if current is None:
+        current = spans.get()
+    if current is not None:
+        current.append((store, operation, seconds))
+
+
+@contextlib.contextmanager
+def track(store, operation):
+    started = time.perf_counter()
+    failed = False
+    try:
+        yield
+    except Exception:
+        failed = True
+        raise
+    finally:
+        record(store, operation, time.perf_counter() - started, failed)
+
+
+def timed(store, operation=None):
+    """Decorate a client method so each call is tracked, by default under the method name."""
+    def decorate(method):
+        name = operation or method.__name__
+        if inspect.iscoroutinefunction(method):
+            @functools.wraps(method)
+            async def async_wrapper(*args, **kwargs):
+                with track(store, name):
+                    return await method(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+            with track(store, name):
+                return method(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def statement(query):
+    """The operation label of a SQL or CQL statement: its leading keyword."""
+    words = str(query).split(None, 1)
+    return words[0].lower() if words else "unknown"
+
+
+@functools.lru_cache(maxsize=None)
+def mongo_listener():
+    """
+    A pymongo command listener tracking every command the driver sends, for
+    MongoClient(event_listeners=...). Built on first use so pymongo is only imported
+    by processes that talk to MongoDB.
+    """
+    from pymongo import monitoring
+
+    class MongoCommandMetrics(monitoring.CommandListener):
+        def started(self, event):
+            pass
+
+        def succeeded(self, event):
+            record("mongodb", event.command_name, event.duration_micros / 1e6)
+
+        def failed(self, event):
+            record("mongodb", event.command_name, event.duration_micros / 1e6, failed=True)
+
+    return MongoCommandMetrics()
+
+
+def instrument_engine(engine, store):
+    """Track the statements of a SQLAlchemy engine and expose its pool usage."""
+    from sqlalchemy import event
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, query, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, query, parameters, context, executemany):
+        record(store, statement(query), time.perf_counter() - conn.info["query_started"].pop())
+
+    @event.listens_for(engine, "handle_error")
+    def handle_error(context):
+        started = context.connection.info.get("query_started") if context.connection is not None else None
+        if started:
+            record(store, statement(context.statement), time.perf_counter() - started.pop(), failed=True)
+        else:
+            STORE_ERRORS.labels(store, statement(context.statement)).inc()
+
+    POOL_CONNECTIONS.labels(store, "checked_out").set_function(engine.pool.checkedout)
+    POOL_CONNECTIONS.labels(store, "idle").set_function(engine.pool.checkedin)
@@ -1,12 +1,15 @@
 from pymongo import MongoClient
 
+from shared import metrics, schema
+
 class MongoDBClient:
     def __init__(self, host="localhost", port=27017):
         self.host = host
         self.port = port
-        self.client = MongoClient(host, port)
+        self.client = MongoClient(host, port, event_listeners=[metrics.mongo_listener()])
         self.database = self.client["MongoDB_"]
         self.collection = self.client["sensors"]
+        schema.ensure("mongodb", self)
 
     def close(self):
         self.client.close()
@@ -0,0 +1,27 @@
+import os
+
+# Number of queue partitions; readings of a sensor always go to the same one
+QUEUE_PARTITIONS = int(os.environ.get("QUEUE_PARTITIONS", 1))
+
+_MASK = 0xFFFFFFFFFFFFFFFF
+
+
+def partition_for(sensor_id, partitions=None):
+    """
+    Jump consistent hash (Lamping & Veach) of the sensor id. When the number of
+    partitions grows from N to N+1 only 1/(N+1) of the sensors move, all of them
+    to the new partition.
+    """
+    partitions = partitions or QUEUE_PARTITIONS
+    # Spread sequential ids before feeding them to the LCG
+    key = (sensor_id * 0x9E3779B97F4A7C15) & _MASK
+    bucket, j = -1, 0
+    while j < partitions:
+        bucket = j
+        key = (key * 2862933555777941757 + 1) & _MASK
+        j = int((bucket + 1) * ((1 << 31) / ((key >> 33) + 1)))
+    return bucket
+
+
+def queue_name(base, partition):
+    return f"{base}.{partition}"
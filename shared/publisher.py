@@ -1,33 +1,186 @@
+import collections
+import os
 import pika
+from queue import Empty, Full, Queue
+import threading
 import time
 
+from shared import metrics
+from shared.messages import Reading, SensorEvent, encode_readings
+from shared.partitioning import QUEUE_PARTITIONS, partition_for, queue_name
+from shared.transport import PublishError
+
 QUEUE_NAME = 'test'
+RABBITMQ_HOST = os.environ.get("RABBITMQ_HOST", "rabbitmq")
+# Messages waiting for the publisher thread; publish() waits once it is full
+PUBLISH_QUEUE_SIZE = int(os.environ.get("PUBLISH_QUEUE_SIZE", 10000))
+# Seconds publish() waits for room in a full queue before raising PublishError
+PUBLISH_TIMEOUT = float(os.environ.get("PUBLISH_TIMEOUT", 5))
+# Messages the publisher thread takes from the local queue per round
+PUBLISH_BATCH_SIZE = int(os.environ.get("PUBLISH_BATCH_SIZE", 100))
+RECONNECT_BACKOFF = 0.5
+RECONNECT_BACKOFF_MAX = 30
+
+_STOP = object()
+
+
+def declare_queue(channel, partition, queue=QUEUE_NAME):
+    # Several consumers may attach to a partition, but only one receives its messages
+    name = queue_name(queue, partition)
+    channel.queue_declare(queue=name, arguments={"x-single-active-consumer": True})
+    return name
+
+
+def encode_valid(readings):
+    # One reading that cannot be packed must not take the others, or the thread, with it
+    try:
+        return encode_readings(readings)
+    except ValueError:
+        valid = []
+        for reading in readings:
+            try:
+                encode_readings([reading])
+            except ValueError as e:
+                print(f"Dropping a reading that cannot be queued: {e}")
+            else:
+                valid.append(reading)
+        return encode_readings(valid)
+
 
 class Publisher:
+    """
+    Thread-safe RabbitMQ publisher. `publish` only puts the message on a local queue;
+    a single background thread owns the pika connection, publishes with publisher
+    confirms and reconnects with exponential backoff when the broker goes away.
+    Messages are kept until the broker confirms them.
+
+    Readings are routed to one of `partitions` queues by a consistent hash of their
+    sensor id, and readings of a partition taken in the same round are packed into a
+    single binary message, so one confirm covers all of them. Sensor events go to the
+    partition of their sensor, after the readings published before them. Other
+    messages go to partition 0.
+    """
 
     channel = None
     conn = None
 
-    def __init__(self):
+    def __init__(self, host=RABBITMQ_HOST, partitions=QUEUE_PARTITIONS, queue=QUEUE_NAME):
         credentials = pika.PlainCredentials('guest', 'guest')
-        parameters = pika.ConnectionParameters('rabbitmq',
+        self.parameters = pika.ConnectionParameters(host,
                                        5672,
                                        '/',
                                        credentials)
-        try:
-            self.conn = pika.BlockingConnection(parameters)
-        except Exception as e:
-            time.sleep(10)
-            self.conn = pika.BlockingConnection(parameters)
+        self.partitions = partitions
+        self.queue = queue
+        self.pending = Queue(maxsize=PUBLISH_QUEUE_SIZE)
+        metrics.PUBLISHER_PENDING.set_function(self.pending.qsize)
+        self.thread = threading.Thread(target=self.run, name="publisher", daemon=True)
+        self.thread.start()
 
+    def connect(self):
+        self.conn = pika.BlockingConnection(self.parameters)
         self.channel = self.conn.channel()
-        self.channel.queue_declare(queue=QUEUE_NAME)
+        for partition in range(self.partitions):
+            declare_queue(self.channel, partition, self.queue)
+        self.channel.confirm_delivery()
+
+    def disconnect(self):
+        try:
+            if self.conn is not None and self.conn.is_open:
+                self.conn.close()
+        except pika.exceptions.AMQPError:
+            pass
+        self.conn = self.channel = None
+
+    def next_batch(self):
+        # Wait for one message, then take whatever else is already queued
+        messages = [self.pending.get()]
+        while len(messages) < PUBLISH_BATCH_SIZE and messages[-1] is not _STOP:
+            try:
+                messages.append(self.pending.get_nowait())
+            except Empty:
+                break
+        by_partition = collections.defaultdict(list)
+        events = []
+        others = []
+        for message in messages:
+            if isinstance(message, Reading):
+                by_partition[partition_for(message.sensor_id, self.partitions)].append(message)
+            elif isinstance(message, SensorEvent):
+                partition = partition_for(message.sensor_id, self.partitions)
+                # Flush the readings taken so far, so the event keeps its place in the partition
+                if by_partition[partition]:
+                    events.append((queue_name(self.queue, partition), encode_valid(by_partition.pop(partition))))
+                events.append((queue_name(self.queue, partition), message.to_json()))
+            elif message is not _STOP:
+                others.append((queue_name(self.queue, 0), message))
+        batch = collections.deque(events)
+        batch.extend(
+            (queue_name(self.queue, partition), encode_valid(readings))
+            for partition, readings in by_partition.items() if readings)
+        batch.extend(others)
+        if messages[-1] is _STOP:
+            batch.append(_STOP)
+        return batch
 
+    def run(self):
+        backoff = RECONNECT_BACKOFF
+        batch = collections.deque()
+        while True:
+            if not batch:
+                try:
+                    batch = self.next_batch()
+                except Exception as e:
+                    # The messages taken are lost; the thread keeps serving the next ones
+                    print(f"Dropping messages that could not be prepared ({e!r})")
+                    continue
+            if batch[0] is _STOP:
+                break
+            try:
+                if self.channel is None:
+                    self.connect()
+                while batch and batch[0] is not _STOP:
+                    # Blocks until the broker confirms, raises if it nacks
+                    routing_key, body = batch[0]
+                    # The publish time lets the consumer report its lag
+                    properties = pika.BasicProperties(headers={"x-published-at": time.time()})
+                    with metrics.track("rabbitmq", "publish"):
+                        self.channel.basic_publish(exchange='', routing_key=routing_key, body=body, properties=properties)
+                    batch.popleft()
+                backoff = RECONNECT_BACKOFF
+            except pika.exceptions.AMQPError as e:
+                print(f"Publish failed ({e!r}), retrying in {backoff}s")
+                self.disconnect()
+                time.sleep(backoff)
+                backoff = min(backoff * 2, RECONNECT_BACKOFF_MAX)
+            except Exception as e:
+                if self.channel is None:
+                    # Could not connect: keep the batch and retry as for broker errors
+                    print(f"Connecting failed ({e!r}), retrying in {backoff}s")
+                    time.sleep(backoff)
+                    backoff = min(backoff * 2, RECONNECT_BACKOFF_MAX)
+                else:
+                    # The message itself is at fault: drop it rather than the thread
+                    routing_key, _ = batch.popleft()
+                    print(f"Dropping a message for {routing_key} that could not be published ({e!r})")
+        self.disconnect()
 
-    
     def publish(self, message):
-        self.channel.basic_publish(exchange='', routing_key=QUEUE_NAME, body=message.to_json())
-        print(" [x] Sent %r" % message)
-    
-    def close(self):
-        self.conn.close()
+        """
+        Queue a message for the publisher thread.
+
+        Raises:
+            PublishError: The thread is not running, or the queue stayed full for PUBLISH_TIMEOUT seconds.
+        """
+        if not self.thread.is_alive():
+            raise PublishError("The publisher thread is not running")
+        # Readings and sensor events are encoded by the publisher thread, which routes them
+        try:
+            self.pending.put(message if isinstance(message, (Reading, SensorEvent)) else message.to_json(), timeout=PUBLISH_TIMEOUT)
+        except Full:
+            raise PublishError(f"{PUBLISH_QUEUE_SIZE} messages are already waiting for the broker") from None
+
+    def close(self, timeout=30):
+        # Lets the thread publish what is already queued before it stops
+        self.pending.put(_STOP)
+        self.thread.join(timeout)
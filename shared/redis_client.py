@@ -1,30 +1,221 @@
 import redis
 
+from shared import metrics, redis_codec
+
+# Moves a sorted set member to a stream entry. Only the caller whose ZREM removed the
+# member adds the entry, and both happen or neither does.
+ZREM_TO_STREAM = """
+if redis.call('ZREM', KEYS[1], ARGV[1]) == 0 then
+    return 0
+end
+redis.call('XADD', KEYS[2], 'MAXLEN', '~', ARGV[2], '*', unpack(ARGV, 3))
+return 1
+"""
+
 class RedisClient:
-    def __init__(self, host='localhost', port=6379, db=0):
+    def __init__(self, host='localhost', port=6379, db=0, codec=None):
         self._host = host
         self._port = port
         self._db = db
         self._client = redis.Redis(host=self._host, port=self._port, db=self._db)
+        self._codec = redis_codec.get_codec(codec)
     
     def close(self):
         self._client.close()
 
+    @metrics.timed("redis")
     def ping(self):
         return self._client.ping()
     
+    @metrics.timed("redis")
     def get(self, key):
         return self._client.get(key)
     
+    @metrics.timed("redis")
     def set(self, key, value):
         return self._client.set(key, value)
     
+    @metrics.timed("redis")
+    def set_nx(self, key, value, ttl):
+        # True only for the first caller while the key lives
+        return bool(self._client.set(key, value, nx=True, ex=ttl))
+
+    @metrics.timed("redis")
+    def set_nx_exists(self, key, value, ttl, other):
+        # set_nx, and whether `other` exists, in one round trip
+        pipe = self._client.pipeline(transaction=False)
+        pipe.set(key, value, nx=True, ex=ttl)
+        pipe.exists(other)
+        done, exists = pipe.execute()
+        return bool(done), bool(exists)
+
+    @metrics.timed("redis")
+    def set_record(self, key, record):
+        return self._client.set(key, self._codec.encode(record))
+
+    @metrics.timed("redis")
+    def swap_record(self, key, record, messages=()):
+        # SET ... GET returns the previous value; the (channel, payload) messages go in the same round trip
+        pipe = self._client.pipeline(transaction=False)
+        pipe.set(key, self._codec.encode(record), get=True)
+        for channel, payload in messages:
+            pipe.publish(channel, payload)
+        return redis_codec.decode(pipe.execute()[0])
+
+    @metrics.timed("redis")
+    def get_record(self, key):
+        # Values written by any codec version decode, so readers survive a codec rollout
+        return redis_codec.decode(self._client.get(key))
+
+    @metrics.timed("redis")
+    def hset(self, key, mapping):
+        return self._client.hset(key, mapping=mapping)
+
+    @metrics.timed("redis")
+    def hget(self, key, field):
+        return self._client.hget(key, field)
+
+    @metrics.timed("redis")
+    def hdel(self, key, *fields):
+        return self._client.hdel(key, *fields)
+
+    @metrics.timed("redis")
+    def hmget(self, key, fields):
+        return self._client.hmget(key, fields)
+
+    @metrics.timed("redis")
+    def hsetnx(self, key, field, value):
+        return self._client.hsetnx(key, field, value)
+
+    def hincr(self, key, field, defaults=None):
+        # HINCRBY by one, after setting the `defaults` fields the hash lacks, in one round trip
+        return self.hincr_many([key], field, defaults)[0]
+
+    @metrics.timed("redis")
+    def hincr_many(self, keys, field, defaults=None):
+        pipe = self._client.pipeline(transaction=False)
+        for key in keys:
+            for name, value in (defaults or {}).items():
+                pipe.hsetnx(key, name, value)
+            pipe.hincrby(key, field, 1)
+        return pipe.execute()[len(defaults or ())::len(defaults or ()) + 1]
+
+    @metrics.timed("redis")
+    def hmget_with_score(self, key, fields, zset, member):
+        # The fields of a hash and the score of a sorted set member, in one round trip
+        pipe = self._client.pipeline(transaction=False)
+        pipe.hmget(key, fields)
+        pipe.zscore(zset, member)
+        return tuple(pipe.execute())
+
+    @metrics.timed("redis")
+    def publish_many(self, messages):
+        pipe = self._client.pipeline(transaction=False)
+        for channel, payload in messages:
+            pipe.publish(channel, payload)
+        return pipe.execute()
+
+    @metrics.timed("redis")
+    def hgetall_many(self, keys):
+        # One round trip for all the hashes; missing ones come back empty
+        pipe = self._client.pipeline(transaction=False)
+        for key in keys:
+            pipe.hgetall(key)
+        return pipe.execute()
+
+    @metrics.timed("redis")
+    def append_recent(self, key, score, record, maxlen, window):
+        # One round trip: add the reading, then cap the buffer by length and by age
+        pipe = self._client.pipeline(transaction=False)
+        pipe.zadd(key, {self._codec.encode(record): score})
+        pipe.zremrangebyrank(key, 0, -maxlen - 1)
+        pipe.zremrangebyscore(key, "-inf", f"({score - window}")
+        return pipe.execute()
+
+    @metrics.timed("redis")
+    def get_recent(self, key, count=None, since=None):
+        # Newest first, so `count` keeps the latest readings
+        values = self._client.zrevrangebyscore(
+            key, "+inf", "-inf" if since is None else since,
+            start=0, num=-1 if count is None else count)
+        return [redis_codec.decode(value) for value in reversed(values)]
+
+    @metrics.timed("redis")
+    def xadd(self, stream, fields, maxlen=None):
+        return self._client.xadd(stream, fields, maxlen=maxlen, approximate=True)
+
+    @metrics.timed("redis")
+    def xgroup_create(self, stream, group):
+        try:
+            return self._client.xgroup_create(stream, group, id="0", mkstream=True)
+        except redis.exceptions.ResponseError as e:
+            # BUSYGROUP: another consumer already created it
+            if "BUSYGROUP" not in str(e):
+                raise
+
+    @metrics.timed("redis")
+    def xreadgroup(self, stream, group, consumer, count, block):
+        response = self._client.xreadgroup(group, consumer, {stream: ">"}, count=count, block=block)
+        return response[0][1] if response else []
+
+    @metrics.timed("redis")
+    def xautoclaim(self, stream, group, consumer, min_idle_time, start_id="0-0", count=None):
+        # Returns the cursor for the next call and the claimed entries
+        response = self._client.xautoclaim(stream, group, consumer, min_idle_time, start_id=start_id, count=count)
+        return response[0], response[1]
+
+    @metrics.timed("redis")
+    def xack(self, stream, group, *ids):
+        return self._client.xack(stream, group, *ids)
+
+    @metrics.timed("redis")
+    def xinfo_groups(self, stream):
+        return self._client.xinfo_groups(stream)
+
+    @metrics.timed("redis")
+    def xrange(self, stream, count=None):
+        return self._client.xrange(stream, count=count)
+
+    @metrics.timed("redis")
+    def xdel(self, stream, *ids):
+        return self._client.xdel(stream, *ids)
+
+    @metrics.timed("redis")
+    def zadd(self, key, mapping):
+        return self._client.zadd(key, mapping)
+
+    @metrics.timed("redis")
+    def zadd_gt(self, key, member, score):
+        # True when `score` raised the member's score, or added it
+        return bool(self._client.zadd(key, {member: score}, gt=True, ch=True))
+
+    @metrics.timed("redis")
+    def zrangebyscore(self, key, min, max):
+        return self._client.zrangebyscore(key, min, max)
+
+    @metrics.timed("redis")
+    def zrem(self, key, *members):
+        return self._client.zrem(key, *members)
+
+    @metrics.timed("redis")
+    def zrem_to_stream(self, key, member, stream, fields, maxlen):
+        # True when this caller moved the member
+        args = [member, maxlen] + [item for pair in fields.items() for item in pair]
+        return bool(self._client.register_script(ZREM_TO_STREAM)(keys=[key, stream], args=args))
+
+    @metrics.timed("redis")
+    def memory_usage(self, key):
+        return self._client.memory_usage(key)
+    
+    @metrics.timed("redis")
     def delete(self, key):
         return self._client.delete(key)
     
+    @metrics.timed("redis")
     def keys(self, pattern):
         return self._client.keys(pattern)
     
+    @metrics.timed("redis")
     def clearAll(self):
         for key in self._client.keys("*"):
             self._client.delete(key)
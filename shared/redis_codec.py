@@ -0,0 +1,89 @@
+import json
+import os
+import struct
+
+# Order matters: it is the on-wire order of the packed floats and of the presence bits.
+READING_FIELDS = ("velocity", "temperature", "humidity", "battery_level")
+
+
+class JsonCodec:
+    """Legacy format: the record as a JSON document. Kept so old values still decode."""
+
+    version = 0
+
+    def encode(self, record):
+        return json.dumps(record, separators=(",", ":")).encode()
+
+    def decode(self, payload):
+        return json.loads(payload)
+
+
+class StructCodec:
+    """
+    Version 1: a version byte, a presence bitmask, the four numeric fields as
+    little-endian doubles and `last_seen` as trailing UTF-8 bytes. `python -m benchmarks.run`
+    compares the Redis memory a sensor takes with it and with JSON.
+    """
+
+    version = 1
+    _layout = struct.Struct("<BB4d")
+    _last_seen_bit = 1 << len(READING_FIELDS)
+
+    def encode(self, record):
+        mask = 0
+        values = []
+        for bit, field in enumerate(READING_FIELDS):
+            value = record.get(field)
+            if value is None:
+                values.append(0.0)
+            else:
+                mask |= 1 << bit
+                values.append(value)
+        last_seen = record.get("last_seen")
+        tail = b""
+        if last_seen is not None:
+            mask |= self._last_seen_bit
+            tail = last_seen.encode()
+        return self._layout.pack(self.version, mask, *values) + tail
+
+    def decode(self, payload):
+        _, mask, *values = self._layout.unpack_from(payload)
+        record = {
+            field: values[bit] if mask & (1 << bit) else None
+            for bit, field in enumerate(READING_FIELDS)
+        }
+        record["last_seen"] = (
+            bytes(payload[self._layout.size:]).decode() if mask & self._last_seen_bit else None
+        )
+        return record
+
+
+CODECS = {
+    "json": JsonCodec(),
+    "struct": StructCodec(),
+}
+
+_BY_VERSION = {codec.version: codec for codec in CODECS.values()}
+
+
+def get_codec(name=None):
+    """Return the codec used for writes, chosen by name or by the REDIS_CODEC env var."""
+    name = name or os.environ.get("REDIS_CODEC", "struct")
+    try:
+        return CODECS[name]
+    except KeyError:
+        raise ValueError(f"Unknown Redis codec: {name}")
+
+
+def decode(payload):
+    """Decode a value written by any codec version."""
+    if payload is None:
+        return None
+    # Legacy values are bare JSON objects, binary values start with their version byte
+    if payload[:1] == b"{":
+        return CODECS["json"].decode(payload)
+    try:
+        codec = _BY_VERSION[payload[0]]
+    except KeyError:
+        raise ValueError(f"Unknown Redis record version: {payload[0]}")
+    return codec.decode(payload)
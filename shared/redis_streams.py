@@ -0,0 +1,148 @@
+import os
+import socket
+import time
+import uuid
+
+from redis.exceptions import RedisError
+
+from shared import metrics
+from shared.messages import Reading, SensorEvent, encode_readings
+from shared.partitioning import QUEUE_PARTITIONS, partition_for, queue_name
+from shared.publisher import QUEUE_NAME
+from shared.redis_client import RedisClient
+from shared.transport import PublishError
+from shared.subscriber import CONSUMER_BATCH_SIZE, CONSUMER_MAX_ATTEMPTS, QUEUE_DEPTH_INTERVAL, retry_delay
+
+STREAM_GROUP = "consumers"
+# Approximate cap on the stream length, old entries beyond it are trimmed by Redis
+STREAM_MAXLEN = int(os.environ.get("STREAM_MAXLEN", 1000000))
+
+
+DEAD_LETTER_STREAM = f"stream:{QUEUE_NAME}.dlq"
+
+
+def stream_key(partition, queue=QUEUE_NAME):
+    return f"stream:{queue_name(queue, partition)}"
+
+
+def retry_key(partition):
+    # Sorted set of entries waiting for a retry, scored by the time they are due
+    return f"{stream_key(partition)}.retry"
+
+
+class RedisStreamPublisher:
+    """Publisher with the same interface as `shared.publisher.Publisher`, backed by one Redis stream per partition."""
+
+    def __init__(self, host=None, partitions=QUEUE_PARTITIONS, queue=QUEUE_NAME):
+        self.redis = RedisClient(host=host or os.environ.get("REDIS_HOST", "redis"))
+        self.partitions = partitions
+        self.queue = queue
+
+    def publish(self, message):
+        # Same contract as the RabbitMQ publisher: every failure is a PublishError
+        try:
+            if isinstance(message, Reading):
+                stream = stream_key(partition_for(message.sensor_id, self.partitions), self.queue)
+                body = encode_readings([message])
+            elif isinstance(message, SensorEvent):
+                stream = stream_key(partition_for(message.sensor_id, self.partitions), self.queue)
+                body = message.to_json()
+            else:
+                stream = stream_key(0, self.queue)
+                body = message.to_json()
+            self.redis.xadd(stream, {"body": body}, maxlen=STREAM_MAXLEN)
+        except (RedisError, TypeError, ValueError) as e:
+            raise PublishError(f"Could not publish {message!r}: {e}") from e
+
+    def close(self):
+        self.redis.close()
+
+
+class RedisStreamSubscriber:
+    """
+    Subscriber with the same interface as `shared.subscriber.Subscriber`, backed by a
+    Redis stream consumer group. Entries are read in batches with XREADGROUP, acked
+    with a single XACK once the callback has handled the batch, and entries left
+    pending by a dead consumer for longer than `min_idle_ms` are reclaimed with XAUTOCLAIM.
+    Failed entries wait in a sorted set for their retry delay before they are added back
+    to the stream, and go to the dead-letter stream after CONSUMER_MAX_ATTEMPTS deliveries.
+    Like with RabbitMQ, a retried reading loses its place among the sensor's readings.
+    """
+
+    def __init__(self, partition=0, host=None, batch_size=CONSUMER_BATCH_SIZE, block_ms=1000, min_idle_ms=60000):
+        self.redis = RedisClient(host=host or os.environ.get("REDIS_HOST", "redis"))
+        self.partition = partition
+        self.stream = stream_key(partition)
+        self.retries = retry_key(partition)
+        self.consumer = f"{socket.gethostname()}-{os.getpid()}"
+        self.batch_size = batch_size
+        self.block_ms = block_ms
+        self.min_idle_ms = min_idle_ms
+        self.reclaim_cursor = "0-0"
+        self.redis.xgroup_create(self.stream, STREAM_GROUP)
+
+    def reclaim(self):
+        # One page of stale pending entries, the cursor walks the pending list across calls
+        self.reclaim_cursor, entries = self.redis.xautoclaim(self.stream, STREAM_GROUP, self.consumer, self.min_idle_ms, start_id=self.reclaim_cursor, count=self.batch_size)
+        return entries
+
+    def reclaim_done(self):
+        return self.reclaim_cursor in (b"0-0", "0-0")
+
+    def requeue_due(self):
+        # Consumers of the same partition may see the same due members: removing one is
+        # the claim on it, so each retry goes back to the stream once
+        for member in self.redis.zrangebyscore(self.retries, "-inf", time.time()):
+            attempts, _, body = member.split(b":", 2)
+            self.redis.zrem_to_stream(self.retries, member, self.stream, {"body": body, "attempts": attempts}, STREAM_MAXLEN)
+
+    def retry(self, body, attempts):
+        if attempts >= CONSUMER_MAX_ATTEMPTS:
+            self.redis.xadd(DEAD_LETTER_STREAM, {"body": body, "attempts": attempts, "partition": self.partition})
+            return
+        # The random id keeps identical bodies apart in the sorted set
+        member = b"%d:%s:%s" % (attempts + 1, uuid.uuid4().hex.encode(), body)
+        self.redis.zadd(self.retries, {member: time.time() + retry_delay(attempts)})
+
+    def report_depth(self):
+        for group in self.redis.xinfo_groups(self.stream):
+            if group["name"] in (STREAM_GROUP, STREAM_GROUP.encode()):
+                # lag: entries not delivered to the group yet (Redis 7), pending: delivered but unacked
+                metrics.QUEUE_DEPTH.labels(self.stream).set((group.get("lag") or 0) + group["pending"])
+
+    def subscribe(self, callback):
+        last_reclaim = 0
+        depth_checked = 0
+        while True:
+            if time.monotonic() - depth_checked >= QUEUE_DEPTH_INTERVAL:
+                self.report_depth()
+                depth_checked = time.monotonic()
+            self.requeue_due()
+            entries = []
+            if not self.reclaim_done() or time.monotonic() - last_reclaim > self.min_idle_ms / 1000:
+                entries = self.reclaim()
+                last_reclaim = time.monotonic()
+            if not entries:
+                entries = self.redis.xreadgroup(self.stream, STREAM_GROUP, self.consumer, self.batch_size, self.block_ms)
+            if not entries:
+                continue
+            ids = [entry_id for entry_id, _ in entries]
+            # Entry ids start with the time Redis added them, in milliseconds
+            now = time.time()
+            lag = metrics.CONSUMER_LAG.labels(self.stream)
+            for entry_id in ids:
+                lag.observe(now - int(entry_id.split(b"-")[0]) / 1000)
+            # Entries trimmed while pending come back without fields
+            entries = [(entry_id, fields) for entry_id, fields in entries if fields]
+            bodies = [fields[b"body"] for _, fields in entries]
+            try:
+                failures = callback(bodies) or []
+            except Exception as e:
+                print(f"Batch failed: {e}")
+                failures = list(enumerate(bodies))
+            for index, body in failures:
+                self.retry(body, int(entries[index][1].get(b"attempts", 1)))
+            self.redis.xack(self.stream, STREAM_GROUP, *ids)
+
+    def close(self):
+        self.redis.close()
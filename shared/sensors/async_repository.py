@@ -0,0 +1,222 @@
+import asyncio
+import logging
+from datetime import datetime
+from typing import List, Optional
+
+from fastapi import HTTPException
+
+from shared.aio.cassandra_client import AsyncCassandraClient
+from shared.aio.database import AsyncPostgres
+from shared.aio.elasticsearch_client import AsyncElasticsearchClient
+from shared.aio.mongodb_client import AsyncMongoDBClient
+from shared.aio.redis_client import AsyncRedisClient
+from shared.aio.timescale import AsyncTimescale
+from shared.fanout import async_fanout
+from shared.sensors import live, read_model, schemas, versions
+from shared.sensors.repository import aggregate_columns, aggregate_query, aggregate_rows, merge_profile, search_query
+from shared.sensors.writers import (
+    DEDUP_TTL, RECENT_MAXLEN, RECENT_WINDOW, TEMPERATURE_STATISTICS_INSERT, TEMPERATURE_STATISTICS_SELECT, WRITE_TIMEOUTS,
+    dedup_key, next_temperature_statistics, reading_timestamp, statistics_marker,
+)
+
+# Async versions of the hot repository functions. They return the same shapes as
+# shared.sensors.repository, but never block the event loop.
+
+logger = logging.getLogger(__name__)
+
+
+async def get_sensor(db: AsyncPostgres, sensor_id: int) -> Optional[dict]:
+    row = await db.fetchrow("SELECT id, name FROM sensors WHERE id = $1", sensor_id)
+    return None if row is None else dict(row)
+
+
+async def get_sensors(db: AsyncPostgres, sensor_ids: List[int]) -> dict:
+    rows = await db.fetch("SELECT id, name FROM sensors WHERE id = ANY($1::int[])", sensor_ids)
+    return {row["id"]: dict(row) for row in rows}
+
+
+async def get_data(redis: AsyncRedisClient, sensor_id: int, db: AsyncPostgres) -> dict:
+    if read_model.READ_MODEL:
+        view = (await read_model.get_views_async(redis, [sensor_id])).get(sensor_id)
+        if view is not None and view[read_model.DATA] is not None:
+            profile = view[read_model.PROFILE]
+            return {**view[read_model.DATA], "id": profile["id"], "name": profile["name"]}
+    db_sensor, sensor_data = await asyncio.gather(get_sensor(db, sensor_id), redis.get_record(f"sensor:{sensor_id}:data"))
+    if db_sensor is None:
+        raise HTTPException(status_code=404, detail="Sensor not found")
+    if sensor_data is None:
+        raise HTTPException(status_code=404, detail="Sensor data not found")
+    sensor_data['id'] = db_sensor['id']
+    sensor_data['name'] = db_sensor['name']
+    return sensor_data
+
+
+async def get_data_timescale(timescale: AsyncTimescale, sensor_id: int, from_date: str, to_date: str, bucket: str, layout: str = "rows") -> dict:
+    materialized_view, query = aggregate_query(sensor_id, from_date, to_date, bucket)
+    await timescale.refresh_materialized_view(materialized_view)
+    rows = await timescale.fetch(query)
+    return aggregate_columns(rows) if layout == "columnar" else aggregate_rows(rows)
+
+
+async def claim_reading(redis: AsyncRedisClient, key: Optional[str], data: schemas.SensorData):
+    # See writers.claim_reading
+    if key is None:
+        return True, data.temperature is not None
+    if data.temperature is None:
+        return await redis.set_nx(key, 1, DEDUP_TTL), False
+    new, counted = await redis.set_nx_exists(key, 1, DEDUP_TTL, statistics_marker(key))
+    return new, not counted
+
+
+async def record_data(cassandra: AsyncCassandraClient, redis: AsyncRedisClient, timescale: AsyncTimescale, sensor_id: int, data: schemas.SensorData):
+    # Same duplicate suppression as the sync path, sharing its Redis keys
+    key = dedup_key(sensor_id, data)
+    new, statistics = await claim_reading(redis, key, data)
+    if not new:
+        logger.debug("Skipping duplicate reading for Sensor ID %s at %s", sensor_id, data.last_seen)
+        return
+    try:
+        await write_data(cassandra=cassandra, redis=redis, timescale=timescale, sensor_id=sensor_id, data=data,
+                         statistics=statistics, marker=key and statistics_marker(key))
+    except Exception:
+        if key is not None:
+            await redis.delete(key)
+        raise
+
+
+async def update_temperature_statistics(cassandra: AsyncCassandraClient, sensor_id: int, temperature: float, redis: Optional[AsyncRedisClient] = None):
+    rows = await cassandra.execute(TEMPERATURE_STATISTICS_SELECT, [sensor_id])
+    row = rows[0] if rows else None
+    values = next_temperature_statistics(sensor_id, row, temperature)
+    await cassandra.execute(TEMPERATURE_STATISTICS_INSERT, values)
+    if redis is not None and read_model.READ_MODEL:
+        await redis.hset(read_model.view_key(sensor_id), read_model.statistics_fields(values))
+
+
+async def save_statistics(cassandra: AsyncCassandraClient, redis: AsyncRedisClient, sensor_id: int, temperature: float, marker: Optional[str]):
+    await update_temperature_statistics(cassandra, sensor_id, temperature, redis)
+    if marker is not None:
+        await redis.set_nx(marker, 1, DEDUP_TTL)
+
+
+async def save_redis(redis: AsyncRedisClient, sensor_id: int, record: dict):
+    if live.LIVE_UPDATES:
+        await live.save_and_publish_async(redis, f"sensor:{sensor_id}:data", sensor_id, record)
+    else:
+        await redis.set_record(f"sensor:{sensor_id}:data", record)
+
+
+async def save_timescale(timescale: AsyncTimescale, redis: AsyncRedisClient, sensor_id: int, data: schemas.SensorData, time: Optional[datetime]):
+    await timescale.execute(
+        """
+        INSERT INTO sensor_data (sensor_id, velocity, temperature, humidity, battery_level, time)
+        VALUES ($1, $2, $3, $4, $5, $6)
+        ON CONFLICT (time,sensor_id) DO UPDATE SET
+        velocity = EXCLUDED.velocity,
+        temperature = EXCLUDED.temperature,
+        humidity = EXCLUDED.humidity,
+        battery_level = EXCLUDED.battery_level;
+        """,
+        sensor_id, data.velocity, data.temperature, data.humidity, data.battery_level, time)
+    if versions.CONDITIONAL_GET:
+        await versions.reading_written_async(redis, sensor_id, data.last_seen)
+
+
+async def write_data(cassandra: AsyncCassandraClient, redis: AsyncRedisClient, timescale: AsyncTimescale, sensor_id: int, data: schemas.SensorData,
+                     statistics: bool = True, marker: Optional[str] = None):
+    record = data.dict()
+    # sensor_data.time is a timestamp without time zone, which drops the offset like the sync path's cast
+    time = None
+    if data.last_seen is not None:
+        time = datetime.fromisoformat(data.last_seen).replace(tzinfo=None)
+
+    tasks = {
+        "redis": save_redis(redis, sensor_id, record),
+        "redis_recent": redis.append_recent(f"sensor:{sensor_id}:recent", reading_timestamp(data), record, RECENT_MAXLEN, RECENT_WINDOW),
+        "timescale": save_timescale(timescale, redis, sensor_id, data, time),
+        "cassandra": cassandra.execute(
+            """
+            INSERT INTO sensor_data_tbl (sensor_id, timestamp, temperature, humidity, velocity, battery_level)
+            VALUES (%s, %s, %s, %s, %s, %s);
+            """,
+            (sensor_id, data.last_seen, data.temperature, data.humidity, data.velocity, data.battery_level)),
+    }
+    if read_model.READ_MODEL:
+        tasks["redis_view"] = redis.hset(read_model.view_key(sensor_id), read_model.data_fields(record))
+    if statistics and data.temperature is not None:
+        tasks["cassandra_statistics"] = save_statistics(cassandra, redis, sensor_id, data.temperature, marker)
+    if data.battery_level is not None:
+        tasks["cassandra_battery"] = cassandra.execute(
+            """
+            INSERT INTO low_battery_sensors (sensor_id, battery_level, last_update)
+            VALUES (%s, %s, %s);
+            """,
+            (sensor_id, data.battery_level, data.last_seen))
+    await async_fanout(tasks, WRITE_TIMEOUTS)
+
+
+async def get_sensors_near(mongodb_client: AsyncMongoDBClient, db: AsyncPostgres, redis: AsyncRedisClient, latitude: float, longitude: float, radius: int) -> List[dict]:
+    collection = mongodb_client.getCollection("sensors")
+    nearby_sensors = await collection.find(
+        {
+            "location": {
+                "$near": {
+                    "$geometry": {
+                        "type": "Point",
+                        "coordinates": [longitude, latitude]
+                    },
+                    "$maxDistance": radius
+                }
+            }
+        },
+        {"id_sensor": 1},
+    ).to_list(None)
+    sensor_ids = [doc["id_sensor"] for doc in nearby_sensors]
+    if not sensor_ids:
+        return []
+    # One SQL query and one Redis round trip or two for every sensor instead of two round trips each
+    rows, readings = await asyncio.gather(
+        db.fetch("SELECT id, name, joined_at FROM sensors WHERE id = ANY($1::int[])", sensor_ids),
+        get_readings(redis, sensor_ids))
+    db_sensors = {row["id"]: dict(row) for row in rows}
+    sensors = []
+    # Same fields and errors as the sync route: the sensor's row and its latest reading
+    for sensor_id in sensor_ids:
+        db_sensor = db_sensors.get(sensor_id)
+        if db_sensor is None:
+            continue
+        if readings.get(sensor_id) is None:
+            raise HTTPException(status_code=404, detail="Sensor data not found")
+        sensors.append({**db_sensor, **readings[sensor_id]})
+    return sensors
+
+
+async def get_readings(redis: AsyncRedisClient, sensor_ids: List[int]) -> dict:
+    """Latest reading by sensor id, from the read model when it has one like `get_data`."""
+    readings = {}
+    if read_model.READ_MODEL:
+        views = await read_model.get_views_async(redis, sensor_ids)
+        readings = {sensor_id: view[read_model.DATA] for sensor_id, view in views.items() if view[read_model.DATA] is not None}
+    missing = [sensor_id for sensor_id in sensor_ids if sensor_id not in readings]
+    if missing:
+        readings.update(zip(missing, await redis.get_records([f"sensor:{sensor_id}:data" for sensor_id in missing])))
+    return readings
+
+
+async def search_sensors(db: AsyncPostgres, mongodb_client: AsyncMongoDBClient, es: AsyncElasticsearchClient, query: str, size: int, search_type: str) -> List[dict]:
+    es_query = search_query(query, size, search_type)
+    results = await es.search("sensors", es_query)
+    sensor_ids = [hit["_source"]["id_sensor"] for hit in results["hits"]["hits"]]
+    if not sensor_ids:
+        return []
+    collection = mongodb_client.getCollection("sensors")
+    db_sensors, documents = await asyncio.gather(
+        get_sensors(db, sensor_ids),
+        collection.find({"id_sensor": {"$in": sensor_ids}}).to_list(None))
+    documents = {document["id_sensor"]: document for document in documents}
+    # Keep the Elasticsearch ranking
+    return [
+        merge_profile(db_sensors[sensor_id], documents[sensor_id])
+        for sensor_id in sensor_ids
+        if sensor_id in db_sensors and sensor_id in documents
+    ]
@@ -0,0 +1,114 @@
+from __future__ import annotations
+
+import json
+import os
+import time
+from typing import TYPE_CHECKING, List, Optional, Tuple
+
+if TYPE_CHECKING:
+    from shared.aio.redis_client import AsyncRedisClient
+    from shared.redis_client import RedisClient
+
+# Live updates: the write path publishes each new reading, and each time a sensor
+# crosses the low battery level, on Redis pub/sub channels the API streams to clients
+# (see app/sensors/live.py). Publishing is fire and forget: with no one listening it
+# costs one round trip per reading.
+LIVE_UPDATES = os.environ.get("LIVE_UPDATES", "1").lower() in ("1", "true", "yes")
+
+# Same level as the /sensors/low_battery query
+LOW_BATTERY_LEVEL = 0.2
+LOW_BATTERY_CHANNEL = "live:low_battery"
+# Hash of sensor id -> type, so readings can also be published on their type's channel
+TYPES_KEY = "sensor:types"
+
+# Types never change, so each process remembers the ones it has looked up. Sensors
+# registered before live updates have none; they are looked up again after this many
+# seconds, in case the hash was backfilled.
+TYPE_RETRY = 60
+_types = {}
+_missing = {}
+
+
+def sensor_channel(sensor_id: int) -> str:
+    return f"live:sensor:{sensor_id}"
+
+
+def type_channel(sensor_type: str) -> str:
+    return f"live:type:{sensor_type}"
+
+
+def is_low(record: Optional[dict]) -> Optional[bool]:
+    if record is None or record.get("battery_level") is None:
+        return None
+    return record["battery_level"] <= LOW_BATTERY_LEVEL
+
+
+def encode(value) -> str:
+    return json.dumps(value, separators=(",", ":"))
+
+
+def channels(sensor_id: int, sensor_type: Optional[str]) -> List[str]:
+    if sensor_type is None:
+        return [sensor_channel(sensor_id)]
+    return [sensor_channel(sensor_id), type_channel(sensor_type)]
+
+
+def reading_messages(sensor_id: int, record: dict, sensor_type: Optional[str]) -> List[Tuple[str, str]]:
+    reading = encode({"event": "reading", "sensor_id": sensor_id, **record})
+    return [(channel, reading) for channel in channels(sensor_id, sensor_type)]
+
+
+def transition_messages(sensor_id: int, record: dict, previous: Optional[dict], sensor_type: Optional[str]) -> List[Tuple[str, str]]:
+    """Messages for a low battery transition, none when the reading did not cross the level."""
+    low = is_low(record)
+    # The first reading of a sensor that is already low counts as a transition
+    if low is None or low == bool(is_low(previous)):
+        return []
+    transition = encode({"event": "low_battery", "sensor_id": sensor_id, "battery_level": record["battery_level"], "low": low})
+    return [(channel, transition) for channel in channels(sensor_id, sensor_type)] + [(LOW_BATTERY_CHANNEL, transition)]
+
+
+def known_type(sensor_id: int) -> Tuple[bool, Optional[str]]:
+    """Whether the type of the sensor must be looked up, and the type if it is known."""
+    if sensor_id in _types:
+        return False, _types[sensor_id]
+    return _missing.get(sensor_id, 0) <= time.monotonic(), None
+
+
+def remember_type(sensor_id: int, value: Optional[bytes]) -> Optional[str]:
+    if value is None:
+        _missing[sensor_id] = time.monotonic() + TYPE_RETRY
+        return None
+    _missing.pop(sensor_id, None)
+    _types[sensor_id] = value.decode()
+    return _types[sensor_id]
+
+
+def sensor_type(redis: RedisClient, sensor_id: int) -> Optional[str]:
+    lookup, kind = known_type(sensor_id)
+    if lookup:
+        kind = remember_type(sensor_id, redis.hget(TYPES_KEY, sensor_id))
+    return kind
+
+
+def save_and_publish(redis: RedisClient, key: str, sensor_id: int, record: dict) -> None:
+    """
+    Store the latest reading of a sensor under `key` and publish it, in one round
+    trip. The reading it replaces tells whether the battery crossed the low level,
+    which takes a second round trip only when it did.
+    """
+    kind = sensor_type(redis, sensor_id)
+    previous = redis.swap_record(key, record, reading_messages(sensor_id, record, kind))
+    transitions = transition_messages(sensor_id, record, previous, kind)
+    if transitions:
+        redis.publish_many(transitions)
+
+
+async def save_and_publish_async(redis: AsyncRedisClient, key: str, sensor_id: int, record: dict) -> None:
+    lookup, kind = known_type(sensor_id)
+    if lookup:
+        kind = remember_type(sensor_id, await redis.hget(TYPES_KEY, sensor_id))
+    previous = await redis.swap_record(key, record, reading_messages(sensor_id, record, kind))
+    transitions = transition_messages(sensor_id, record, previous, kind)
+    if transitions:
+        await redis.publish_many(transitions)
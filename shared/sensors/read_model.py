@@ -0,0 +1,89 @@
+from __future__ import annotations
+
+import json
+import os
+from typing import TYPE_CHECKING, Dict, List, Optional
+
+from shared.messages import SensorEvent
+
+if TYPE_CHECKING:
+    from shared.aio.redis_client import AsyncRedisClient
+    from shared.redis_client import RedisClient
+
+# Denormalized view of each sensor in one Redis hash: its profile (the SQL row merged
+# with its MongoDB document), latest reading and temperature statistics. The consumer
+# keeps the profile current from sensor events; the write path of readings updates the
+# rest. Read endpoints serve from it and fall back to the stores while a sensor has
+# no profile in it yet.
+READ_MODEL = os.environ.get("READ_MODEL", "").lower() in ("1", "true", "yes")
+
+PROFILE = "profile"
+DATA = "data"
+TEMPERATURE_STATISTICS = "temperature_statistics"
+
+
+def view_key(sensor_id: int) -> str:
+    return f"sensor:{sensor_id}:view"
+
+
+def encode(value) -> str:
+    return json.dumps(value, separators=(",", ":"))
+
+
+def data_fields(record: dict) -> dict:
+    return {DATA: encode(record)}
+
+
+def statistics_fields(values) -> dict:
+    # `values` as returned by writers.next_temperature_statistics
+    _, max_temperature, min_temperature, avg_temperature, _, _ = values
+    return {TEMPERATURE_STATISTICS: encode({
+        "max_temperature": max_temperature,
+        "min_temperature": min_temperature,
+        "average_temperature": avg_temperature,
+    })}
+
+
+def apply_event(redis: RedisClient, event: SensorEvent) -> None:
+    key = view_key(event.sensor_id)
+    if event.kind == SensorEvent.CREATED:
+        redis.hset(key, {PROFILE: encode(event.profile)})
+    elif event.kind == SensorEvent.DELETED:
+        redis.delete(key)
+
+
+def decode_view(fields: dict) -> Optional[dict]:
+    # A view without profile is not served: the sensor is not created yet, or is deleted
+    profile = fields.get(PROFILE.encode())
+    if profile is None:
+        return None
+    data = fields.get(DATA.encode())
+    statistics = fields.get(TEMPERATURE_STATISTICS.encode())
+    return {
+        PROFILE: json.loads(profile),
+        DATA: json.loads(data) if data is not None else None,
+        TEMPERATURE_STATISTICS: json.loads(statistics) if statistics is not None else None,
+    }
+
+
+def get_views(redis: RedisClient, sensor_ids: List[int]) -> Dict[int, dict]:
+    """The views of the sensors that have one, fetched in a single round trip."""
+    views = {}
+    for sensor_id, fields in zip(sensor_ids, redis.hgetall_many([view_key(sensor_id) for sensor_id in sensor_ids])):
+        view = decode_view(fields)
+        if view is not None:
+            views[sensor_id] = view
+    return views
+
+
+def get_view(redis: RedisClient, sensor_id: int) -> Optional[dict]:
+    return get_views(redis, [sensor_id]).get(sensor_id)
+
+
+async def get_views_async(redis: AsyncRedisClient, sensor_ids: List[int]) -> Dict[int, dict]:
+    views = {}
+    for sensor_id, fields in zip(sensor_ids, await redis.hgetall_many([view_key(sensor_id) for sensor_id in sensor_ids])):
+        view = decode_view(fields)
+        if view is not None:
+            views[sensor_id] = view
+    return views
@@ -1,18 +1,27 @@
+from __future__ import annotations
+
 from fastapi import HTTPException
-from sqlalchemy.orm import Session
-from typing import List, Optional
+from typing import TYPE_CHECKING, List, Optional
 from datetime import datetime
 import json
-from shared.mongodb_client import MongoDBClient
-from shared import redis_client
-from shared.sensors import models, schemas
-from shared import timescale
-from shared.elasticsearch_client import ElasticsearchClient
-from shared.cassandra_client import CassandraClient 
+from shared.sensors import live, models, read_model, schemas, versions
+from shared.fanout import FANOUT_TIMEOUT, FanoutError, fanout, store_timeouts
+from shared.sensors.writers import (
+    DEDUP_TTL, RECENT_MAXLEN, RECENT_WINDOW, TEMPERATURE_STATISTICS_INSERT, TEMPERATURE_STATISTICS_SELECT,
+    dedup_key, next_temperature_statistics, reading_timestamp, record_data, update_temperature_statistics, write_data,
+)
 from datetime import datetime, timedelta
 
-import logging 
+import time
+from collections import Counter
 
+# Drivers are only needed for the annotations; the clients passed in import them
+if TYPE_CHECKING:
+    from sqlalchemy.orm import Session
+    from shared import redis_client, timescale
+    from shared.cassandra_client import CassandraClient
+    from shared.elasticsearch_client import ElasticsearchClient
+    from shared.mongodb_client import MongoDBClient
 
 
 class DataCommand():
@@ -28,7 +37,6 @@ class DataCommand():
         
 # MY REPOSITORY COMBINED
 
-logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
 
 def get_sensor(db: Session, sensor_id: int) -> Optional[models.Sensor]:
     return db.query(models.Sensor).filter(models.Sensor.id == sensor_id).first()
@@ -45,15 +53,73 @@ def get_sensor_specific(db: Session, sensor_id: int, mongodb_client: MongoDBClie
 
     if document_sensor_data is None:
         return None
-    
-    document_sensor_data['latitude'] = document_sensor_data['location']['coordinates'][1]
-    document_sensor_data['longitude'] = document_sensor_data['location']['coordinates'][0]
-    document_sensor_data = {k: v for k, v in document_sensor_data.items() if k not in ['id_sensor', '_id', 'location']}
 
-    # Merge the data from the SQL database and MongoDB
-    sensor_data = {**db_sensor.to_dict(), **document_sensor_data}
+    return merge_profile(db_sensor.to_dict(), document_sensor_data)
 
-    return sensor_data
+
+def get_sensor_profile(db: Session, sensor_id: int, mongodb_client: MongoDBClient, redis: redis_client.RedisClient) -> Optional[dict]:
+    # One Redis fetch when the read model has the sensor, the SQL and MongoDB join otherwise
+    if read_model.READ_MODEL:
+        view = read_model.get_view(redis, sensor_id)
+        if view is not None:
+            return view[read_model.PROFILE]
+    return get_sensor_specific(db, sensor_id, mongodb_client)
+
+
+def get_profiles(db: Session, mongodb_client: MongoDBClient, redis: Optional[redis_client.RedisClient], sensor_ids: List[int]) -> dict:
+    """Profiles by sensor id, None for the sensors that do not exist."""
+    sensor_ids = list(dict.fromkeys(sensor_ids))
+    profiles = {}
+    if read_model.READ_MODEL and redis is not None:
+        profiles = {sensor_id: view[read_model.PROFILE] for sensor_id, view in read_model.get_views(redis, sensor_ids).items()}
+    for sensor_id in sensor_ids:
+        if sensor_id not in profiles:
+            profiles[sensor_id] = get_sensor_specific(db, sensor_id, mongodb_client)
+    return profiles
+
+
+def get_sensor_view(db: Session, sensor_id: int, mongodb_client: MongoDBClient, redis: redis_client.RedisClient, cassandra: CassandraClient) -> Optional[dict]:
+    """
+    A sensor with its latest reading and temperature statistics.
+
+    Returns:
+        The profile fields plus `data` and `temperature_statistics`, either of them None
+        when the sensor has no readings; None if the sensor does not exist.
+    """
+    view = read_model.get_view(redis, sensor_id) if read_model.READ_MODEL else None
+    if view is None:
+        profile = get_sensor_specific(db, sensor_id, mongodb_client)
+        if profile is None:
+            return None
+        result = cassandra.execute(TEMPERATURE_STATISTICS_SELECT, [sensor_id])
+        if result is None:
+            # execute logged the error; a missing row would read as "no readings yet"
+            raise HTTPException(status_code=503, detail="Temperature statistics are unavailable")
+        row = result.one()
+        statistics = None
+        if row is not None:
+            statistics = {
+                "max_temperature": row.max_temperature,
+                "min_temperature": row.min_temperature,
+                "average_temperature": row.total_temperature / row.temperature_count,
+            }
+        view = {
+            read_model.PROFILE: profile,
+            read_model.DATA: redis.get_record(f"sensor:{sensor_id}:data"),
+            read_model.TEMPERATURE_STATISTICS: statistics,
+        }
+    return {**view[read_model.PROFILE], "data": view[read_model.DATA], "temperature_statistics": view[read_model.TEMPERATURE_STATISTICS]}
+
+
+def merge_profile(sensor: dict, document: dict) -> dict:
+    """Merge the SQL columns of a sensor with its MongoDB document."""
+    document = dict(document)
+    document['latitude'] = document['location']['coordinates'][1]
+    document['longitude'] = document['location']['coordinates'][0]
+    document = {k: v for k, v in document.items() if k not in ['id_sensor', '_id', 'location']}
+
+    # Merge the data from the SQL database and MongoDB
+    return {**sensor, **document}
 
 def get_sensor_by_name(db: Session, name: str) -> Optional[models.Sensor]:
     return db.query(models.Sensor).filter(models.Sensor.name == name).first()
@@ -61,16 +127,52 @@ def get_sensor_by_name(db: Session, name: str) -> Optional[models.Sensor]:
 def get_sensors(db: Session, skip: int = 0, limit: int = 100) -> List[models.Sensor]:
     return db.query(models.Sensor).offset(skip).limit(limit).all()
 
-def create_sensor(db: Session, sensor: schemas.SensorCreate, mongodb_client: MongoDBClient,  es: ElasticsearchClient, cassandra:CassandraClient) -> models.Sensor:
+# Seconds each store may take to register a sensor
+REGISTRATION_TIMEOUTS = store_timeouts(mongodb=FANOUT_TIMEOUT, elasticsearch=FANOUT_TIMEOUT, cassandra=FANOUT_TIMEOUT, redis=2)
+
+
+def create_sensor(db: Session, sensor: schemas.SensorCreate, mongodb_client: MongoDBClient,  es: ElasticsearchClient, cassandra:CassandraClient, redis: Optional[redis_client.RedisClient] = None) -> models.Sensor:
     # SQL -> save only identifier and name
     db_sensor = models.Sensor(name=sensor.name)
     db.add(db_sensor)
     db.commit()
     db.refresh(db_sensor)
     
+    mongodb_client.getDatabase("MongoDB_")
+    mongodb_collection = mongodb_client.getCollection("sensors")
+
+    sensor_data = sensor.dict()
+    sensor_data.update({"id":db_sensor.id}) 
+    
+    # Once the SQL row gives us the id, Mongo, Elasticsearch and Cassandra are written concurrently
+    tasks = {
+        "mongodb": lambda: mongodb_collection.insert_one(sensor_document(db_sensor.id, sensor)),
+        "elasticsearch": lambda: es.index_document("sensors", search_document(db_sensor.id, sensor), id=db_sensor.id),
+        "cassandra": lambda: cassandra.execute(f"""
+            UPDATE sensor.sensor_count_by_type
+            SET count = count + 1 
+            WHERE sensor_type = '{sensor.type}';
+            """, raise_errors=True
+        ),
+    }
+    if redis is not None:
+        # Lets the write path publish the readings on the channel of the type
+        tasks["redis"] = lambda: redis.hset(live.TYPES_KEY, {db_sensor.id: sensor.type})
+    try:
+        fanout(tasks, REGISTRATION_TIMEOUTS)
+    except FanoutError as e:
+        discard_sensors(db, [(db_sensor.id, sensor)], e.results, mongodb_collection, es, cassandra, redis)
+        raise
+    if redis is not None and versions.CONDITIONAL_GET:
+        versions.profile_changed(redis, db_sensor.id)
+    
+    return sensor_data
+
+
+def sensor_document(sensor_id: int, sensor: schemas.SensorCreate) -> dict:
     #Mongo -> save the document with static attributes.
-    document_sensor_data = {
-        "id_sensor": db_sensor.id,
+    return {
+        "id_sensor": sensor_id,
         "type": sensor.type,
         "mac_address": sensor.mac_address,
         "manufacturer": sensor.manufacturer,
@@ -84,100 +186,169 @@ def create_sensor(db: Session, sensor: schemas.SensorCreate, mongodb_client: Mon
         },
         "description": sensor.description
     }
-    
-    mongodb_client.getDatabase("MongoDB_")
-    mongodb_collection = mongodb_client.getCollection("sensors")
-    mongodb_collection.insert_one(document_sensor_data)
-    
-    #document_to_index = {k: v for k, v in document_sensor_data.items() if k not in ['_id']}   
-    document_to_index = {
-        "id_sensor": db_sensor.id,
+
+
+def search_document(sensor_id: int, sensor: schemas.SensorCreate) -> dict:
+    # What Elasticsearch indexes for /sensors/search
+    return {
+        "id_sensor": sensor_id,
         "name": sensor.name,
         "type": sensor.type,
         "description": sensor.description
-    } 
-    
-      # Index the document in Elasticsearch
-    es.index_document("sensors", document_to_index)
+    }
 
-    sensor_data = sensor.dict()
-    sensor_data.update({"id":db_sensor.id}) 
-    
-    cassandra.execute(f"""
-        UPDATE sensor.sensor_count_by_type
-        SET count = count + 1 
-        WHERE sensor_type = '{sensor.type}';
-        """
-    )
-    
-    return sensor_data
 
+# Rows per INSERT of a bulk registration, to keep each statement well under the
+# 65535 bind parameters Postgres accepts
+BULK_CHUNK = 1000
+
+SENSOR_COUNT_INCREMENT = "UPDATE sensor.sensor_count_by_type SET count = count + %s WHERE sensor_type = %s;"
 
-def record_data(cassandra: CassandraClient,redis: redis_client, timescale: timescale, sensor_id: int, data: schemas.SensorData) -> schemas.Sensor:
-    # Ensure proper handling of None values which can't be inserted directly into CQL query strings
-    temperature = 'NULL' if data.temperature is None else data.temperature
-    humidity = 'NULL' if data.humidity is None else data.humidity
-    velocity = 'NULL' if data.velocity is None else data.velocity
-    battery_level = 'NULL' if data.battery_level is None else data.battery_level
-    timestamp = f"'{data.last_seen}'" if data.last_seen is not None else 'NULL'
-    
-    ## save in redis
-    sensorData = json.dumps(data.dict())
-    redis.set(f"sensor:{sensor_id}:data", sensorData)
-    
-    # save in timescale
-    query = f"""
-        INSERT INTO sensor_data (sensor_id, velocity, temperature, humidity, battery_level, time)
-        VALUES ({sensor_id}, {velocity}, {temperature}, {humidity}, {data.battery_level}, '{data.last_seen}')
-        ON CONFLICT (time,sensor_id) DO UPDATE SET
-        velocity = EXCLUDED.velocity,
-        temperature = EXCLUDED.temperature,
-        humidity = EXCLUDED.humidity,
-        battery_level = EXCLUDED.battery_level;
-        """
-    timescale.execute(query)
-    timescale.conn.commit()
-    
-    # save in cassandra
-    
-    logging.debug(f"Recording data for Sensor ID {sensor_id} with data: {data}")
 
-    # Construct the insert query using safer formatting to prevent SQL injection-like issues
-    insert_query = f"""
-    INSERT INTO sensor_data_tbl (sensor_id, timestamp, temperature, humidity, velocity, battery_level)
-    VALUES ({sensor_id}, {timestamp}, {temperature}, {humidity}, {velocity}, {battery_level});
+def create_sensors(db: Session, sensors: List[schemas.SensorCreate], mongodb_client: MongoDBClient, es: ElasticsearchClient, cassandra: CassandraClient, redis: Optional[redis_client.RedisClient] = None) -> dict:
     """
+    Register many sensors at once: one INSERT ... RETURNING per BULK_CHUNK rows, then
+    a single insert_many, Elasticsearch bulk request and counter batch for all of them.
+
+    Returns:
+        {"created": [...], "conflicts": [...]}. Created sensors are returned like
+        create_sensor does; a conflict gives the position of the sensor in the
+        request, its name and why it was not registered.
+    """
+    conflicts = []
+    accepted = {}
+    for index, sensor in enumerate(sensors):
+        if sensor.name in accepted:
+            conflicts.append({"index": index, "name": sensor.name, "detail": "Sensor name repeated in the request"})
+        else:
+            accepted[sensor.name] = (index, sensor)
+
+    from sqlalchemy.dialects.postgresql import insert
+
+    # ON CONFLICT skips the names already registered, even by a concurrent request,
+    # instead of failing the whole statement; they are the ones not returned
+    ids = {}
+    names = list(accepted)
+    for start in range(0, len(names), BULK_CHUNK):
+        chunk = names[start:start + BULK_CHUNK]
+        statement = (
+            insert(models.Sensor)
+            .values([{"name": name, "joined_at": datetime.utcnow()} for name in chunk])
+            .on_conflict_do_nothing(index_elements=[models.Sensor.name])
+            .returning(models.Sensor.id, models.Sensor.name)
+        )
+        ids.update({name: sensor_id for sensor_id, name in db.execute(statement)})
+    db.commit()
+
+    created = []
+    for name, (index, sensor) in accepted.items():
+        if name in ids:
+            created.append((index, ids[name], sensor))
+        else:
+            conflicts.append({"index": index, "name": name, "detail": "Sensor with same name already registered"})
+    conflicts.sort(key=lambda conflict: conflict["index"])
+    created.sort(key=lambda item: item[0])
+
+    if created:
+        counts = Counter(sensor.type for _, _, sensor in created)
+        mongodb_client.getDatabase("MongoDB_")
+        mongodb_collection = mongodb_client.getCollection("sensors")
+        tasks = {
+            "mongodb": lambda: mongodb_collection.insert_many(
+                [sensor_document(sensor_id, sensor) for _, sensor_id, sensor in created], ordered=False),
+            "elasticsearch": lambda: es.bulk_index(
+                "sensors", [search_document(sensor_id, sensor) for _, sensor_id, sensor in created],
+                ids=[sensor_id for _, sensor_id, _ in created]),
+            # One increment per type, all in a single round trip
+            "cassandra": lambda: cassandra.execute(
+                "BEGIN COUNTER BATCH " + " ".join([SENSOR_COUNT_INCREMENT] * len(counts)) + " APPLY BATCH;",
+                [value for sensor_type, count in counts.items() for value in (count, sensor_type)], raise_errors=True),
+        }
+        if redis is not None:
+            tasks["redis"] = lambda: redis.hset(live.TYPES_KEY, {sensor_id: sensor.type for _, sensor_id, sensor in created})
+        try:
+            fanout(tasks, REGISTRATION_TIMEOUTS)
+        except FanoutError as e:
+            discard_sensors(db, [(sensor_id, sensor) for _, sensor_id, sensor in created], e.results, mongodb_collection, es, cassandra, redis)
+            raise
+        if redis is not None and versions.CONDITIONAL_GET:
+            versions.profiles_changed(redis, [sensor_id for _, sensor_id, _ in created])
+
+    return {
+        "created": [{**sensor.dict(), "id": sensor_id} for _, sensor_id, sensor in created],
+        "conflicts": conflicts,
+    }
+
+
+def discard_sensors(db: Session, sensors, succeeded, mongodb_collection, es: ElasticsearchClient, cassandra: CassandraClient, redis: Optional[redis_client.RedisClient]) -> None:
+    """
+    Undo a registration whose fan-out failed, so that retrying it registers the
+    sensors again instead of finding their names taken.
+
+    Args:
+        sensors (List[Tuple[int, SensorCreate]]): The ids given by Postgres and the sensors.
+        succeeded (Iterable[str]): The stores the fan-out wrote to.
+    """
+    ids = [sensor_id for sensor_id, _ in sensors]
+    # Deleting what is not there is harmless, and a write that timed out may still land,
+    # so every store is cleaned but the counters, which only go back down if they went up
+    tasks = {
+        "mongodb": lambda: mongodb_collection.delete_many({"id_sensor": {"$in": ids}}),
+        "elasticsearch": lambda: es.delete_documents("sensors", ids),
+    }
+    if "cassandra" in succeeded:
+        counts = Counter(sensor.type for _, sensor in sensors)
+        tasks["cassandra"] = lambda: cassandra.execute(
+            "BEGIN COUNTER BATCH " + " ".join([SENSOR_COUNT_INCREMENT] * len(counts)) + " APPLY BATCH;",
+            [value for sensor_type, count in counts.items() for value in (-count, sensor_type)], raise_errors=True)
+    if redis is not None:
+        tasks["redis"] = lambda: redis.hdel(live.TYPES_KEY, *ids)
     try:
-        cassandra.execute(insert_query)
-        print("Data inserted successfully into Cassandra.")
-        if temperature is not None:
-            update_temperature_statistics(cassandra, sensor_id, temperature)
-        if battery_level is not None:
-            insert_query = f"""
-            INSERT INTO low_battery_sensors (sensor_id, battery_level, last_update)
-            VALUES ({sensor_id}, {battery_level}, {timestamp});
-            """
-            cassandra.execute(insert_query)
-            print("Low battery sensor data inserted successfully into Cassandra.")
-        
+        fanout(tasks, REGISTRATION_TIMEOUTS)
+    except FanoutError as e:
+        print(f"Failed to undo the registration of sensors {ids}: {e}")
+    # Last, like delete_sensor: the names stay taken until the other stores let them go
+    try:
+        db.query(models.Sensor).filter(models.Sensor.id.in_(ids)).delete()
+        db.commit()
     except Exception as e:
-        print(f"Failed to insert data into Cassandra: {e}")
+        db.rollback()
+        print(f"Failed to delete the rows of sensors {ids}: {e}")
+
 
 # GET DATA indexos version
 
 def get_data(redis: redis_client.RedisClient, sensor_id: int, db:Session) -> schemas.Sensor:
+    if read_model.READ_MODEL:
+        view = read_model.get_view(redis, sensor_id)
+        if view is not None and view[read_model.DATA] is not None:
+            profile = view[read_model.PROFILE]
+            return {**view[read_model.DATA], "id": profile["id"], "name": profile["name"]}
     db_sensor = get_sensor(db, sensor_id)
     if db_sensor is None:
         raise HTTPException(status_code=404, detail="Sensor not found")
-    sensorDataDB = redis.get( f"sensor:{sensor_id}:data")
-    sensor_data = json.loads(sensorDataDB.decode())
+    sensor_data = redis.get_record(f"sensor:{sensor_id}:data")
+    if sensor_data is None:
+        raise HTTPException(status_code=404, detail="Sensor data not found")
     sensor_data['id'] = db_sensor.id
     sensor_data['name'] = db_sensor.name
     return sensor_data
 
+# GET DATA recent window, served from the Redis ring buffer
+
+def get_recent_data(redis: redis_client.RedisClient, sensor_id: int, count: Optional[int] = None, seconds: Optional[int] = None) -> List[dict]:
+    since = None if seconds is None else time.time() - seconds
+    return redis.get_recent(f"sensor:{sensor_id}:recent", count=count, since=since)
+
 # GET DATA temporal version
 
-def get_data_timescale(timescale: timescale, sensor_id: int, from_date: str, to_date: str, bucket: str) -> schemas.Sensor:
+def aggregate_query(sensor_id: int, from_date: str, to_date: str, bucket: str):
+    """
+    Build the query over the continuous aggregate of `bucket`.
+
+    Returns:
+        Tuple[str, str]: The materialized view to refresh and the query.
+    """
     # Determine the appropriate materialized view based on the bucket
     if bucket is None or bucket == 'hour':
         materialized_view = 'sensor_data_hourly'
@@ -191,9 +362,6 @@ def get_data_timescale(timescale: timescale, sensor_id: int, from_date: str, to_
         materialized_view = 'sensor_data_yearly'
     else:
         raise HTTPException(status_code=400, detail="Invalid bucket value")
-    
-    # Refresh the materialized view
-    timescale.refresh_materialized_view(materialized_view)
 
     # Parse the input date strings
     from_date_dt = datetime.fromisoformat(str(from_date))
@@ -223,11 +391,10 @@ def get_data_timescale(timescale: timescale, sensor_id: int, from_date: str, to_
         sensor_id = {sensor_id}
         AND {query_condition}
     """
-    
-    # Execute the query
-    timescale.execute(query)
-    result = timescale.cursor.fetchall()
+    return materialized_view, query
+
 
+def aggregate_rows(result) -> dict:
     # Convert the result into a dictionary format
     sensor_data = {}
     for row in result:
@@ -241,50 +408,43 @@ def get_data_timescale(timescale: timescale, sensor_id: int, from_date: str, to_
     return sensor_data
 
 
-def update_temperature_statistics(cassandra, sensor_id, temperature):
-    print("Fetching existing data for sensor ID:", sensor_id)
-    query = """
-    SELECT max_temperature, min_temperature, total_temperature, temperature_count
-    FROM temperature_statistics
-    WHERE sensor_id = %s;
-    """
-    result = cassandra.execute(query, [sensor_id])
-    row = result.one()
-
-    if row:
-        max_temp = max(row.max_temperature, temperature)
-        min_temp = min(row.min_temperature, temperature)
-        new_count = row.temperature_count + 1
-        new_total = row.total_temperature + temperature
-        avg_temp = new_total / new_count
-        print(f"Updating stats: Max Temp: {max_temp}, Min Temp: {min_temp}, Avg Temp: {avg_temp}")
-    else:
-        max_temp = min_temp = avg_temp = temperature
-        new_total = temperature
-        new_count = 1
-        print("No existing record found. Setting initial values.")
-
-    update_query = """
-    INSERT INTO temperature_statistics (sensor_id, max_temperature, min_temperature, avg_temperature, total_temperature, temperature_count)
-    VALUES (%s, %s, %s, %s, %s, %s)
-    """
-    cassandra.execute(update_query, (sensor_id, max_temp, min_temp, avg_temp, new_total, new_count))
-    print("Temperature statistics updated successfully.")
+AGGREGATE_COLUMNS = ("t", "avg_velocity", "avg_temperature", "avg_humidity", "avg_battery_level")
 
-        
-def get_temperature_values(cassandra:CassandraClient, db: Session, mongodb_client: MongoDBClient):
+
+def aggregate_columns(result) -> dict:
+    # One list per column, transposed by zip() without building a dict per bucket
+    rows = list(result)
+    if not rows:
+        return {name: [] for name in AGGREGATE_COLUMNS}
+    return dict(zip(AGGREGATE_COLUMNS, map(list, zip(*rows))))
+
+
+def get_data_timescale(timescale: timescale, sensor_id: int, from_date: str, to_date: str, bucket: str, layout: str = "rows") -> schemas.Sensor:
+    materialized_view, query = aggregate_query(sensor_id, from_date, to_date, bucket)
+
+    # Refresh the materialized view
+    timescale.refresh_materialized_view(materialized_view)
+
+    # Execute the query
+    timescale.execute(query)
+    rows = timescale.cursor.fetchall()
+    return aggregate_columns(rows) if layout == "columnar" else aggregate_rows(rows)
+
+
+def get_temperature_values(cassandra:CassandraClient, db: Session, mongodb_client: MongoDBClient, redis: Optional[redis_client.RedisClient] = None):
  
     query = """
     SELECT sensor_id, max_temperature, min_temperature, avg_temperature
     FROM temperature_statistics;
     """
     try:
-        result = cassandra.execute(query)
+        result = list(cassandra.execute(query))
         print("Result", result)
+        profiles = get_profiles(db, mongodb_client, redis, [row.sensor_id for row in result])
         sensors = []
         for row in result:
             print("Row",row.sensor_id)
-            db_sensor = get_sensor_specific(db, row.sensor_id, mongodb_client)  
+            db_sensor = profiles[row.sensor_id]
             sensors.append({
                 "id": row.sensor_id,
                 "name": db_sensor['name'],
@@ -330,7 +490,54 @@ def get_sensors_quantity(db: Session, cassandra:CassandraClient):
 
 
 
-def get_low_battery_sensors(cassandra:CassandraClient, db: Session, mongodb_client: MongoDBClient):
+# Summed as double and bigint: float and int sums would lose precision and overflow
+FLEET_TEMPERATURE_SELECT = """
+    SELECT max(max_temperature) AS max_temperature,
+           min(min_temperature) AS min_temperature,
+           sum(CAST(total_temperature AS double)) AS total_temperature,
+           sum(CAST(temperature_count AS bigint)) AS temperature_count
+    FROM temperature_statistics;
+    """
+
+
+def get_fleet_summary(cassandra: CassandraClient) -> dict:
+    """
+    Counts by type, number of low battery sensors and fleet-wide temperature
+    statistics, from the aggregates Cassandra already keeps. The three tables are read
+    concurrently; the temperature statistics are reduced by Cassandra, so a single row
+    comes back whatever the size of the fleet.
+    """
+    results = fanout({
+        "cassandra_counts": lambda: list(cassandra.execute("SELECT sensor_type, count FROM sensor_count_by_type;", raise_errors=True)),
+        "cassandra_low_battery": lambda: list(cassandra.execute(
+            "SELECT sensor_id FROM low_battery_sensors WHERE battery_level <= 0.2 ALLOW FILTERING;", raise_errors=True)),
+        "cassandra_temperature": lambda: cassandra.execute(FLEET_TEMPERATURE_SELECT, raise_errors=True).one(),
+    })
+
+    quantity_by_type = [{"type": row.sensor_type, "quantity": row.count} for row in results["cassandra_counts"]]
+
+    # low_battery_sensors has a row per low reading, so a sensor may appear several times.
+    # CQL has no COUNT(DISTINCT) and can only GROUP BY the primary key in order, which
+    # here starts with battery_level, so the sensors are deduplicated on this side.
+    low_battery = len({row.sensor_id for row in results["cassandra_low_battery"]})
+
+    temperature = results["cassandra_temperature"]
+    temperature_count = temperature.temperature_count if temperature is not None else 0
+
+    return {
+        "quantity": sum(item["quantity"] for item in quantity_by_type),
+        "quantity_by_type": quantity_by_type,
+        "low_battery": low_battery,
+        "temperature": {
+            "max_temperature": temperature.max_temperature if temperature is not None else None,
+            "min_temperature": temperature.min_temperature if temperature is not None else None,
+            # Weighted by readings, not the mean of the per-sensor averages
+            "average_temperature": temperature.total_temperature / temperature_count if temperature_count else None,
+        },
+    }
+
+
+def get_low_battery_sensors(cassandra:CassandraClient, db: Session, mongodb_client: MongoDBClient, redis: Optional[redis_client.RedisClient] = None):
     query = """
     SELECT sensor_id, battery_level, last_update
     FROM low_battery_sensors
@@ -338,10 +545,11 @@ def get_low_battery_sensors(cassandra:CassandraClient, db: Session, mongodb_clie
     ALLOW FILTERING;
     """
     try:
-        result = cassandra.execute(query)
+        result = list(cassandra.execute(query))
+        profiles = get_profiles(db, mongodb_client, redis, [row.sensor_id for row in result])
         sensors = []
         for row in result:
-            db_sensor = get_sensor_specific(db, row.sensor_id, mongodb_client)
+            db_sensor = profiles[row.sensor_id]
             sensors.append({
                 "id": row.sensor_id,
                 "name": db_sensor['name'],
@@ -365,8 +573,6 @@ def get_low_battery_sensors(cassandra:CassandraClient, db: Session, mongodb_clie
 def get_sensors_near(mongodb_client: MongoDBClient,  db:Session, redis:redis_client.RedisClient,  latitude: float, longitude: float, radius: int):
     mongodb_client.getDatabase("MongoDB_")
     collection = mongodb_client.getCollection("sensors")
-    #enable geospatial queries
-    collection.create_index([("location", "2dsphere")])
     nearby_sensors = list(collection.find(
         {
         "location": {
@@ -403,6 +609,10 @@ def delete_sensor(db: Session, sensor_id: int, redis: redis_client, mongodb_clie
     """
     # delete from redis
     redis.delete(f"sensor:{sensor_id}:data")
+    redis.delete(f"sensor:{sensor_id}:recent")
+    # The consumer drops it too on the delete event, after any event still queued for the sensor
+    redis.delete(read_model.view_key(sensor_id))
+    redis.hdel(live.TYPES_KEY, sensor_id)
     # delete from 
     mongodb_client.getDatabase('MongoDB_')
     mongodb_client.getCollection('sensors')
@@ -413,11 +623,13 @@ def delete_sensor(db: Session, sensor_id: int, redis: redis_client, mongodb_clie
         raise HTTPException(status_code=404, detail="Sensor not found")
     db.delete(db_sensor)
     db.commit()
+    # Once every store has dropped it, so no ETag is reissued for what was deleted
+    versions.forget(redis, sensor_id)
     return db_sensor
 
 
 
-def search_sensors(db: Session, mongodb_client: MongoDBClient, es: ElasticsearchClient, query: str, size: int, search_type: str):
+def search_query(query: str, size: int, search_type: str) -> dict:
     try:
         query_dict = json.loads(query)
     except json.JSONDecodeError:
@@ -456,6 +668,11 @@ def search_sensors(db: Session, mongodb_client: MongoDBClient, es: Elasticsearch
             }
         }
 
+    return es_query
+
+
+def search_sensors(db: Session, mongodb_client: MongoDBClient, es: ElasticsearchClient, query: str, size: int, search_type: str):
+    es_query = search_query(query, size, search_type)
     print("Elasticsearch query: ", es_query)
     results = es.search("sensors", es_query)
     sensors = [hit["_source"] for hit in results["hits"]["hits"]]
@@ -1,5 +1,5 @@
 from typing import Optional
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 
 class Sensor(BaseModel):
     id: int
@@ -37,4 +37,5 @@ class SensorData(BaseModel):
     temperature: Optional[float]
     humidity: Optional[float]
     battery_level: Optional[float]
-    last_seen: Optional[str]
\ No newline at end of file
+    # An ISO 8601 timestamp; bounded so every reading fits the queue's binary messages
+    last_seen: Optional[str] = Field(None, max_length=64)
\ No newline at end of file
@@ -0,0 +1,140 @@
+from __future__ import annotations
+
+import hashlib
+import os
+import time
+from datetime import datetime, timezone
+from typing import TYPE_CHECKING, List, Optional
+
+if TYPE_CHECKING:
+    from shared.aio.redis_client import AsyncRedisClient
+    from shared.redis_client import RedisClient
+
+# Validators for conditional GETs. Each sensor has a version hash in Redis:
+#   epoch    set when the hash is created, so ETags do not repeat after Redis loses it
+#   profile  bumped after every write to the sensor's metadata
+#   late     bumped after every reading older than the sensor's watermark
+# The watermark is the newest reading time recorded for the sensor. Aggregate buckets
+# that end before it only change when a late reading arrives, so their ETag is the
+# epoch and the late count. Readers look the versions up before querying the stores
+# and writers bump them after writing, so a version never outlives the data it names.
+# Readings move the watermark once Timescale, which the aggregates read, has them.
+CONDITIONAL_GET = os.environ.get("CONDITIONAL_GET", "true").lower() in ("1", "true", "yes")
+
+WATERMARKS_KEY = "sensor:watermarks"
+
+EPOCH = "epoch"
+PROFILE = "profile"
+LATE = "late"
+
+# Seconds past `to` an aggregate query may cover: it selects the buckets starting up
+# to `to`, and weeks are widened to whole weeks
+BUCKET_SPAN = {
+    "hour": 3600,
+    "day": 86400,
+    "week": 14 * 86400,
+    "month": 31 * 86400,
+    "year": 366 * 86400,
+}
+
+
+def version_key(sensor_id: int) -> str:
+    return f"sensor:{sensor_id}:version"
+
+
+def new_epoch() -> dict:
+    return {EPOCH: f"{time.time_ns():x}"}
+
+
+def wall_clock(moment: datetime) -> float:
+    # sensor_data.time is a timestamp without time zone: the offset is dropped, not applied
+    return moment.replace(tzinfo=timezone.utc).timestamp()
+
+
+def reading_time(last_seen: Optional[str]) -> float:
+    if last_seen is None:
+        return time.time()
+    return wall_clock(datetime.fromisoformat(last_seen))
+
+
+def profile_changed(redis: RedisClient, sensor_id: int) -> None:
+    redis.hincr(version_key(sensor_id), PROFILE, new_epoch())
+
+
+def profiles_changed(redis: RedisClient, sensor_ids: List[int]) -> None:
+    redis.hincr_many([version_key(sensor_id) for sensor_id in sensor_ids], PROFILE, new_epoch())
+
+
+def forget(redis: RedisClient, sensor_id: int) -> None:
+    # ETags of a deleted sensor match nothing from now on
+    redis.delete(version_key(sensor_id))
+    redis.zrem(WATERMARKS_KEY, sensor_id)
+
+
+def track(redis: RedisClient, sensor_id: int) -> None:
+    """Start versioning a sensor created before its version hash existed."""
+    redis.hsetnx(version_key(sensor_id), EPOCH, new_epoch()[EPOCH])
+
+
+async def track_async(redis: AsyncRedisClient, sensor_id: int) -> None:
+    await redis.hsetnx(version_key(sensor_id), EPOCH, new_epoch()[EPOCH])
+
+
+def reading_written(redis: RedisClient, sensor_id: int, last_seen: Optional[str]) -> None:
+    # Raising the watermark is one command; only a late reading takes a second
+    if not redis.zadd_gt(WATERMARKS_KEY, sensor_id, reading_time(last_seen)):
+        redis.hincr(version_key(sensor_id), LATE, new_epoch())
+
+
+async def reading_written_async(redis: AsyncRedisClient, sensor_id: int, last_seen: Optional[str]) -> None:
+    if not await redis.zadd_gt(WATERMARKS_KEY, sensor_id, reading_time(last_seen)):
+        await redis.hincr(version_key(sensor_id), LATE, new_epoch())
+
+
+def profile_etag(fields) -> Optional[str]:
+    """
+    The ETag of a sensor's metadata from the [epoch, profile] fields of its version
+    hash, None when the sensor is not versioned.
+    """
+    epoch, version = fields
+    if epoch is None:
+        return None
+    return f'"{epoch.decode()}.{int(version or 0)}"'
+
+
+def aggregate_etag(fields, watermark: Optional[float], to_date: datetime, bucket: str, variant: tuple) -> Optional[str]:
+    """
+    The ETag of an aggregate query from the [epoch, late] fields of the sensor's
+    version hash and its watermark. None while the query covers buckets that new
+    readings can still change. `variant` tells apart the queries and representations
+    of one sensor: range, bucket, layout and format.
+    """
+    epoch, late = fields
+    if epoch is None or watermark is None or bucket not in BUCKET_SPAN:
+        return None
+    if wall_clock(to_date) + BUCKET_SPAN[bucket] > watermark:
+        return None
+    digest = hashlib.blake2b(repr(variant).encode(), digest_size=8).hexdigest()
+    # Weak: the body is the same whatever its content coding
+    return f'W/"{epoch.decode()}.{int(late or 0)}.{digest}"'
+
+
+def read_profile(redis: RedisClient, sensor_id: int) -> Optional[str]:
+    return profile_etag(redis.hmget(version_key(sensor_id), [EPOCH, PROFILE]))
+
+
+def read_aggregate(redis: RedisClient, sensor_id: int, to_date: datetime, bucket: str, variant: tuple) -> Optional[str]:
+    fields, watermark = redis.hmget_with_score(version_key(sensor_id), [EPOCH, LATE], WATERMARKS_KEY, sensor_id)
+    if fields[0] is None and watermark is not None:
+        # Readings only version a sensor when late; otherwise its first query does
+        track(redis, sensor_id)
+        return None
+    return aggregate_etag(fields, watermark, to_date, bucket, variant)
+
+
+async def read_aggregate_async(redis: AsyncRedisClient, sensor_id: int, to_date: datetime, bucket: str, variant: tuple) -> Optional[str]:
+    fields, watermark = await redis.hmget_with_score(version_key(sensor_id), [EPOCH, LATE], WATERMARKS_KEY, sensor_id)
+    if fields[0] is None and watermark is not None:
+        await track_async(redis, sensor_id)
+        return None
+    return aggregate_etag(fields, watermark, to_date, bucket, variant)
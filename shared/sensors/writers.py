@@ -0,0 +1,209 @@
+from __future__ import annotations
+
+import hashlib
+import logging
+import os
+import time
+from datetime import datetime
+from typing import TYPE_CHECKING, Optional
+
+from shared import redis_codec
+from shared.fanout import FANOUT_TIMEOUT, fanout, store_timeouts
+from shared.sensors import live, read_model, schemas, versions
+
+if TYPE_CHECKING:
+    from shared.cassandra_client import CassandraClient
+    from shared.redis_client import RedisClient
+    from shared.timescale import Timescale
+
+# The write path of sensor readings, shared by the API and the consumer. Kept apart
+# from the repository so the consumer does not import the drivers of stores it never
+# writes to (Postgres models, MongoDB, Elasticsearch).
+
+logger = logging.getLogger(__name__)
+
+# Per-sensor ring buffer of recent readings, capped by length and by age (seconds)
+RECENT_MAXLEN = int(os.environ.get("RECENT_MAXLEN", 1000))
+RECENT_WINDOW = int(os.environ.get("RECENT_WINDOW", 3600))
+
+
+# Seconds a reading is remembered for duplicate suppression
+DEDUP_TTL = int(os.environ.get("DEDUP_TTL", 3600))
+
+# Seconds each write of a reading may take. The Redis writes are a few in-memory
+# commands; the others keep the fan-out default.
+WRITE_TIMEOUTS = store_timeouts(
+    redis=2, redis_recent=2, redis_view=2,
+    timescale=FANOUT_TIMEOUT, cassandra=FANOUT_TIMEOUT, cassandra_statistics=FANOUT_TIMEOUT, cassandra_battery=FANOUT_TIMEOUT,
+)
+
+
+def dedup_key(sensor_id: int, data: schemas.SensorData) -> Optional[str]:
+    # The digest covers last_seen and the values, so a corrected reading for the same instant still goes through
+    if data.last_seen is None:
+        return None
+    digest = hashlib.blake2b(redis_codec.CODECS["struct"].encode(data.dict()), digest_size=8).hexdigest()
+    return f"sensor:{sensor_id}:seen:{digest}"
+
+
+def statistics_marker(key: str) -> str:
+    # Set once the reading's temperature is in the statistics
+    return key.replace(":seen:", ":counted:", 1)
+
+
+def claim_reading(redis: RedisClient, key: Optional[str], data: schemas.SensorData):
+    """
+    Claim a reading for writing, and its temperature for the statistics.
+
+    The statistics are a running count and total, so unlike the other writes they are
+    not idempotent. Their marker is set once they have the reading and outlives a
+    failure of the other stores: a retry of the reading writes those again, but does
+    not count its temperature twice. A reading whose statistics were not updated, or
+    not yet, is counted by its retry.
+
+    Returns:
+        Tuple[bool, bool]: Whether the reading is new, and whether to update the statistics.
+    """
+    if key is None:
+        return True, data.temperature is not None
+    if data.temperature is None:
+        return redis.set_nx(key, 1, DEDUP_TTL), False
+    new, counted = redis.set_nx_exists(key, 1, DEDUP_TTL, statistics_marker(key))
+    return new, not counted
+
+
+def reading_timestamp(data: schemas.SensorData) -> float:
+    if data.last_seen is None:
+        return time.time()
+    return datetime.fromisoformat(data.last_seen).timestamp()
+
+
+def record_data(cassandra: CassandraClient, redis: RedisClient, timescale: Timescale, sensor_id: int, data: schemas.SensorData) -> None:
+    # Gateways resend on timeouts: a reading already recorded is dropped before any store write
+    key = dedup_key(sensor_id, data)
+    new, statistics = claim_reading(redis, key, data)
+    if not new:
+        logger.debug("Skipping duplicate reading for Sensor ID %s at %s", sensor_id, data.last_seen)
+        return
+    try:
+        write_data(cassandra=cassandra, redis=redis, timescale=timescale, sensor_id=sensor_id, data=data,
+                   statistics=statistics, marker=key and statistics_marker(key))
+    except Exception:
+        # Forget the reading so a retry of it is not taken for a duplicate
+        if key is not None:
+            redis.delete(key)
+        raise
+
+
+def write_data(cassandra: CassandraClient, redis: RedisClient, timescale: Timescale, sensor_id: int, data: schemas.SensorData,
+               statistics: bool = True, marker: Optional[str] = None):
+    # Ensure proper handling of None values which can't be inserted directly into CQL query strings
+    temperature = 'NULL' if data.temperature is None else data.temperature
+    humidity = 'NULL' if data.humidity is None else data.humidity
+    velocity = 'NULL' if data.velocity is None else data.velocity
+    battery_level = 'NULL' if data.battery_level is None else data.battery_level
+    timestamp = f"'{data.last_seen}'" if data.last_seen is not None else 'NULL'
+    record = data.dict()
+
+    ## save in redis
+    def save_redis():
+        if live.LIVE_UPDATES:
+            live.save_and_publish(redis, f"sensor:{sensor_id}:data", sensor_id, record)
+        else:
+            redis.set_record(f"sensor:{sensor_id}:data", record)
+        redis.append_recent(f"sensor:{sensor_id}:recent", reading_timestamp(data), record, RECENT_MAXLEN, RECENT_WINDOW)
+        if read_model.READ_MODEL:
+            redis.hset(read_model.view_key(sensor_id), read_model.data_fields(record))
+
+    # save in timescale
+    def save_timescale():
+        query = f"""
+            INSERT INTO sensor_data (sensor_id, velocity, temperature, humidity, battery_level, time)
+            VALUES ({sensor_id}, {velocity}, {temperature}, {humidity}, {data.battery_level}, '{data.last_seen}')
+            ON CONFLICT (time,sensor_id) DO UPDATE SET
+            velocity = EXCLUDED.velocity,
+            temperature = EXCLUDED.temperature,
+            humidity = EXCLUDED.humidity,
+            battery_level = EXCLUDED.battery_level;
+            """
+        timescale.execute(query)
+        timescale.commit()
+        # Aggregates are computed from Timescale: their version moves once it has the reading
+        if versions.CONDITIONAL_GET:
+            versions.reading_written(redis, sensor_id, data.last_seen)
+
+    # save in cassandra
+    def save_cassandra():
+        # Construct the insert query using safer formatting to prevent SQL injection-like issues
+        insert_query = f"""
+        INSERT INTO sensor_data_tbl (sensor_id, timestamp, temperature, humidity, velocity, battery_level)
+        VALUES ({sensor_id}, {timestamp}, {temperature}, {humidity}, {velocity}, {battery_level});
+        """
+        cassandra.execute(insert_query, raise_errors=True)
+        logger.debug("Data inserted successfully into Cassandra.")
+
+    def save_low_battery():
+        insert_query = f"""
+        INSERT INTO low_battery_sensors (sensor_id, battery_level, last_update)
+        VALUES ({sensor_id}, {battery_level}, {timestamp});
+        """
+        cassandra.execute(insert_query, raise_errors=True)
+        logger.debug("Low battery sensor data inserted successfully into Cassandra.")
+
+    def save_statistics():
+        update_temperature_statistics(cassandra, sensor_id, data.temperature, redis)
+        if marker is not None:
+            redis.set_nx(marker, 1, DEDUP_TTL)
+
+    logger.debug("Recording data for Sensor ID %s with data: %s", sensor_id, data)
+
+    # The writes are independent, so they run concurrently.
+    # Failures propagate as a FanoutError so the queue consumer can retry the reading.
+    tasks = {"redis": save_redis, "timescale": save_timescale, "cassandra": save_cassandra}
+    if statistics and data.temperature is not None:
+        tasks["cassandra_statistics"] = save_statistics
+    if data.battery_level is not None:
+        tasks["cassandra_battery"] = save_low_battery
+    fanout(tasks, WRITE_TIMEOUTS)
+
+
+def update_temperature_statistics(cassandra, sensor_id, temperature, redis=None):
+    logger.debug("Fetching existing data for sensor ID: %s", sensor_id)
+    result = cassandra.execute(TEMPERATURE_STATISTICS_SELECT, [sensor_id], raise_errors=True)
+    row = result.one()
+    values = next_temperature_statistics(sensor_id, row, temperature)
+    cassandra.execute(TEMPERATURE_STATISTICS_INSERT, values, raise_errors=True)
+    if redis is not None and read_model.READ_MODEL:
+        redis.hset(read_model.view_key(sensor_id), read_model.statistics_fields(values))
+    logger.debug("Temperature statistics updated successfully.")
+
+
+TEMPERATURE_STATISTICS_SELECT = """
+    SELECT max_temperature, min_temperature, total_temperature, temperature_count
+    FROM temperature_statistics
+    WHERE sensor_id = %s;
+    """
+
+TEMPERATURE_STATISTICS_INSERT = """
+    INSERT INTO temperature_statistics (sensor_id, max_temperature, min_temperature, avg_temperature, total_temperature, temperature_count)
+    VALUES (%s, %s, %s, %s, %s, %s)
+    """
+
+
+def next_temperature_statistics(sensor_id, row, temperature):
+    """Fold a new temperature into the stored statistics row, returning the values to insert."""
+    if row:
+        max_temp = max(row.max_temperature, temperature)
+        min_temp = min(row.min_temperature, temperature)
+        new_count = row.temperature_count + 1
+        new_total = row.total_temperature + temperature
+        avg_temp = new_total / new_count
+        logger.debug("Updating stats: Max Temp: %s, Min Temp: %s, Avg Temp: %s", max_temp, min_temp, avg_temp)
+    else:
+        max_temp = min_temp = avg_temp = temperature
+        new_total = temperature
+        new_count = 1
+        logger.debug("No existing record found. Setting initial values.")
+    return (sensor_id, max_temp, min_temp, avg_temp, new_total, new_count)
+
+        
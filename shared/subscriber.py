@@ -1,13 +1,47 @@
+import os
 import pika
 import time
 
-from shared.publisher import QUEUE_NAME
+from shared import metrics
+from shared.partitioning import queue_name
+from shared.publisher import QUEUE_NAME, RABBITMQ_HOST, declare_queue
+
+# Unacked messages the broker may push ahead of the consumer
+CONSUMER_PREFETCH = int(os.environ.get("CONSUMER_PREFETCH", 500))
+CONSUMER_BATCH_SIZE = int(os.environ.get("CONSUMER_BATCH_SIZE", 100))
+# Seconds a partial batch may wait before it is handled anyway
+CONSUMER_FLUSH_INTERVAL = float(os.environ.get("CONSUMER_FLUSH_INTERVAL", 0.5))
+# Deliveries of a message before it goes to the dead-letter queue
+CONSUMER_MAX_ATTEMPTS = int(os.environ.get("CONSUMER_MAX_ATTEMPTS", 5))
+# Seconds before the first retry, doubled on every further attempt
+CONSUMER_RETRY_DELAY = float(os.environ.get("CONSUMER_RETRY_DELAY", 1))
+# Seconds between two reads of the queue depth for the metrics
+QUEUE_DEPTH_INTERVAL = float(os.environ.get("QUEUE_DEPTH_INTERVAL", 5))
+
+DEAD_LETTER_QUEUE = f"{QUEUE_NAME}.dlq"
+
+
+def retry_delay(attempt):
+    return CONSUMER_RETRY_DELAY * 2 ** (attempt - 1)
+
+
+def declare_retry_queue(channel, partition, attempt):
+    # Messages wait out the TTL here, then the broker dead-letters them back to the partition
+    target = queue_name(QUEUE_NAME, partition)
+    delay_ms = int(retry_delay(attempt) * 1000)
+    name = f"{target}.retry.{delay_ms}"
+    channel.queue_declare(queue=name, arguments={
+        "x-message-ttl": delay_ms,
+        "x-dead-letter-exchange": "",
+        "x-dead-letter-routing-key": target,
+    })
+    return name
+
 
 class Subscriber:
-    def __init__(self):
+    def __init__(self, partition=0, host=RABBITMQ_HOST, prefetch=CONSUMER_PREFETCH, batch_size=CONSUMER_BATCH_SIZE, flush_interval=CONSUMER_FLUSH_INTERVAL):
         credentials = pika.PlainCredentials('guest', 'guest')
-        # Change the host to rabbitmq
-        parameters = pika.ConnectionParameters('localhost',
+        parameters = pika.ConnectionParameters(host,
                                        5672,
                                        '/',
                                        credentials)
@@ -17,14 +51,80 @@ class Subscriber:
             time.sleep(10)
             self.conn = pika.BlockingConnection(parameters)
         self.channel = self.conn.channel()
+        self.partition = partition
+        self.prefetch = prefetch
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
 
 
     def subscribe(self, callback):
-        result = self.channel.queue_declare(queue=QUEUE_NAME)
-        self.channel.basic_consume(queue=QUEUE_NAME, on_message_callback=callback, auto_ack=True)
-        self.channel.start_consuming()
+        """
+        Consume messages in batches. callback gets a list of message bodies and returns
+        the `(index, body)` pairs that failed, with the body to retry. Failures are
+        republished to a delayed retry queue, or to the dead-letter queue after
+        CONSUMER_MAX_ATTEMPTS deliveries, and then the whole batch is acked with a
+        single multiple=True ack. Delivery is at-least-once.
+
+        A retried reading comes back at the end of its partition, after readings of
+        the same sensor published later: retries trade per-sensor order for not
+        blocking the partition. Timescale and Cassandra key readings by time and the
+        anomaly detector skips older ones, so they are unaffected, but the latest
+        value in Redis may be the retried, older reading until the next one arrives.
+        """
+        queue = declare_queue(self.channel, self.partition)
+        self.retry_queues = {
+            attempt: declare_retry_queue(self.channel, self.partition, attempt)
+            for attempt in range(1, CONSUMER_MAX_ATTEMPTS)
+        }
+        self.channel.queue_declare(queue=DEAD_LETTER_QUEUE)
+        # Retries are acked only after the broker has them
+        self.channel.confirm_delivery()
+        self.channel.basic_qos(prefetch_count=self.prefetch)
+        batch = []
+        last_tag = None
+        started = None
+        depth_checked = 0
+        for method, properties, body in self.channel.consume(queue, inactivity_timeout=self.flush_interval):
+            if time.monotonic() - depth_checked >= QUEUE_DEPTH_INTERVAL:
+                # Messages ready in the broker, not counting the ones delivered to us and unacked
+                declared = self.channel.queue_declare(queue=queue, passive=True)
+                metrics.QUEUE_DEPTH.labels(queue).set(declared.method.message_count)
+                depth_checked = time.monotonic()
+            if method is not None:
+                if not batch:
+                    started = time.monotonic()
+                batch.append((body, properties))
+                last_tag = method.delivery_tag
+            if batch and (method is None or len(batch) >= self.batch_size or time.monotonic() - started >= self.flush_interval):
+                self.handle_batch(callback, batch, last_tag)
+                batch = []
+
+    def handle_batch(self, callback, batch, last_tag):
+        now = time.time()
+        lag = metrics.CONSUMER_LAG.labels(queue_name(QUEUE_NAME, self.partition))
+        for _, properties in batch:
+            published_at = (properties.headers or {}).get("x-published-at")
+            if published_at is not None:
+                lag.observe(now - published_at)
+        bodies = [body for body, _ in batch]
+        try:
+            failures = callback(bodies) or []
+        except Exception as e:
+            print(f"Batch failed: {e}")
+            failures = list(enumerate(bodies))
+        for index, body in failures:
+            self.retry(body, batch[index][1])
+        self.channel.basic_ack(delivery_tag=last_tag, multiple=True)
+
+    def retry(self, body, properties):
+        attempts = (properties.headers or {}).get("x-attempts", 1)
+        headers = {"x-attempts": attempts + 1, "x-partition": self.partition}
+        if attempts >= CONSUMER_MAX_ATTEMPTS:
+            routing_key = DEAD_LETTER_QUEUE
+        else:
+            routing_key = self.retry_queues[attempts]
+        self.channel.basic_publish(exchange='', routing_key=routing_key, body=body,
+                                   properties=pika.BasicProperties(headers=headers))
 
     def close(self):
         self.conn.close()
-
-    
\ No newline at end of file
@@ -1,9 +1,14 @@
 import psycopg2
 import os
 
+from shared import metrics
+
 
 class Timescale:
     def __init__(self):
+        self.connect()
+
+    def connect(self):
         self.conn = psycopg2.connect(
             host=os.environ.get("TS_HOST"),
             port=os.environ.get("TS_PORT"),
@@ -19,12 +24,25 @@ class Timescale:
         self.cursor.close()
         self.conn.close()
     
+    def rollback(self):
+        # After a failed statement; reopens the connection if the server dropped it
+        if self.conn.closed:
+            self.connect()
+        else:
+            self.conn.rollback()
+    
     def ping(self):
         return self.conn.ping()
     
     def execute(self, query):
-       return self.cursor.execute(query)
+        with metrics.track("timescale", metrics.statement(query)):
+            return self.cursor.execute(query)
+
+    @metrics.timed("timescale")
+    def commit(self):
+        self.conn.commit()
     
+    @metrics.timed("timescale")
     def delete(self, table):
         self.cursor.execute("DELETE FROM " + table)
         self.conn.commit()
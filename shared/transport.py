@@ -0,0 +1,31 @@
+import os
+
+# Message transport used between the API and the consumer: "rabbitmq" or "redis"
+QUEUE_TRANSPORT = os.environ.get("QUEUE_TRANSPORT", "rabbitmq")
+
+
+class PublishError(RuntimeError):
+    """The message could not be handed to the transport: the caller should answer 503."""
+
+
+def get_publisher(transport=None, **options):
+    # `options` go to the publisher, e.g. queue and partitions for a queue other than the readings'
+    transport = transport or QUEUE_TRANSPORT
+    if transport == "rabbitmq":
+        from shared.publisher import Publisher
+        return Publisher(**options)
+    if transport == "redis":
+        from shared.redis_streams import RedisStreamPublisher
+        return RedisStreamPublisher(**options)
+    raise ValueError(f"Unknown queue transport: {transport}")
+
+
+def get_subscriber(partition=0, transport=None):
+    transport = transport or QUEUE_TRANSPORT
+    if transport == "rabbitmq":
+        from shared.subscriber import Subscriber
+        return Subscriber(partition)
+    if transport == "redis":
+        from shared.redis_streams import RedisStreamSubscriber
+        return RedisStreamSubscriber(partition)
+    raise ValueError(f"Unknown queue transport: {transport}")